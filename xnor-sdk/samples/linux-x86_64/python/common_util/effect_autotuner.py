@@ -0,0 +1,168 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Quality tiers for the native effects, and a tuner that picks one per frame.
+
+`xnor_util.effects.blur` and `background_mask` take keyword arguments that
+trade blur quality for speed. QUALITY_TIERS groups them into a few presets,
+from the default look down to the cheapest settings that still hide the
+background. An EffectAutotuner watches how long each frame of a sample's loop
+takes and moves between the tiers to hold a target frame rate:
+
+    tuner = EffectAutotuner(target_fps=15)
+    while running:
+        start = time.perf_counter()
+        ...
+        effect_start = time.perf_counter()
+        result = effects.blur(frame, mask, **tuner.blur_params)
+        effect_time = time.perf_counter() - effect_start
+        ...
+        tuner.update(time.perf_counter() - start, effect_time)
+"""
+
+import collections
+
+QualityTier = collections.namedtuple("QualityTier", ["name", "blur_params"])
+QualityTier.__doc__ = """\
+A preset of effect settings.
+- `name`: a short description for log messages
+- `blur_params`: keyword arguments for `effects.blur`. The `mask_*` ones also
+  apply to `effects.background_mask` (see `QualityTier.mask_params`).
+"""
+QualityTier.mask_params = property(lambda self: {
+    key: value for key, value in self.blur_params.items()
+    if key.startswith("mask_")})
+
+# Best first. The blur box shrinks along with the downsampled image, so that
+# the blur covers roughly the same area of the frame in every tier.
+QUALITY_TIERS = (
+    QualityTier("high", dict(downsample=3, blur_iterations=2, box_size=11,
+                             mask_blur_iterations=1, mask_box_size=11)),
+    QualityTier("medium", dict(downsample=4, blur_iterations=2, box_size=9,
+                               mask_blur_iterations=1, mask_box_size=11)),
+    QualityTier("low", dict(downsample=6, blur_iterations=1, box_size=7,
+                            mask_blur_iterations=1, mask_box_size=7)),
+    QualityTier("minimum", dict(downsample=8, blur_iterations=1, box_size=5,
+                                mask_blur_iterations=1, mask_box_size=5)),
+)
+
+
+class EffectAutotuner:
+    """Steps through quality tiers to keep frames within a time budget.
+
+    - `target_fps`: the frame rate to hold
+    - `tiers`: presets to choose from, best first. Defaults to QUALITY_TIERS.
+    - `initial_tier`: index of the tier to start with. Defaults to the best.
+    - `smoothing`: weight of each new measurement in the running averages
+    - `patience`: how many frames a trend must last before the tier changes
+    - `headroom`: the fraction of the frame budget that must be left over
+      (going by the last measured cost of the better tier) before stepping up
+
+    The tuner remembers the average effect cost of every tier it has used, so
+    that it won't step back up into a tier that already proved too slow while
+    the rest of the loop (capture, inference, display) costs what it does now.
+    """
+
+    def __init__(self, target_fps, tiers=QUALITY_TIERS, initial_tier=0,
+                 smoothing=0.1, patience=10, headroom=0.1):
+        if target_fps <= 0:
+            raise ValueError("target_fps must be positive")
+        if not tiers:
+            raise ValueError("At least one quality tier is needed")
+        self.target_fps = target_fps
+        self.tiers = tuple(tiers)
+        self._budget = 1 / target_fps
+        self._smoothing = smoothing
+        self._patience = patience
+        self._headroom = headroom
+
+        self._tier_index = min(max(initial_tier, 0), len(self.tiers) - 1)
+        # Running average effect time for each tier, once it has been measured
+        self._effect_times = [None] * len(self.tiers)
+        # Running average time of everything else in the loop
+        self._other_time = None
+        self._frame_time = None
+        # Frames in a row that were over budget (positive) or had room to
+        # spare (negative)
+        self._streak = 0
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return average + self._smoothing * (value - average)
+
+    def _can_step_up(self):
+        if self._tier_index == 0:
+            return False
+        better_effect_time = self._effect_times[self._tier_index - 1]
+        if better_effect_time is None:
+            # Never measured; try it and see
+            return (self._frame_time <
+                    self._budget * (1 - self._headroom))
+        return (self._other_time + better_effect_time <
+                self._budget * (1 - self._headroom))
+
+    def _set_tier(self, index):
+        self._tier_index = index
+        self._streak = 0
+        self._frame_time = None
+
+    ############################
+    # Start of public class API
+    ############################
+
+    @property
+    def tier(self):
+        """The QualityTier to use for the next frame"""
+        return self.tiers[self._tier_index]
+
+    @property
+    def tier_index(self):
+        """Index of the current tier in `tiers`; 0 is the best"""
+        return self._tier_index
+
+    @property
+    def blur_params(self):
+        """Keyword arguments for `effects.blur` at the current tier"""
+        return self.tier.blur_params
+
+    @property
+    def mask_params(self):
+        """Keyword arguments for `effects.background_mask` at the current
+        tier
+        """
+        return self.tier.mask_params
+
+    @property
+    def fps(self):
+        """The recent average frame rate, or None before the first frame"""
+        if not self._frame_time:
+            return None
+        return 1 / self._frame_time
+
+    def update(self, frame_time, effect_time):
+        """Record how long the last frame took in total and in the effect (in
+        seconds), and pick the tier for the next frame.
+
+        Returns True if the tier changed.
+        """
+        index = self._tier_index
+        self._effect_times[index] = self._average(self._effect_times[index],
+                                                  effect_time)
+        self._other_time = self._average(self._other_time,
+                                         max(frame_time - effect_time, 0))
+        self._frame_time = self._average(self._frame_time, frame_time)
+
+        if self._frame_time > self._budget:
+            self._streak = max(self._streak, 0) + 1
+        elif self._can_step_up():
+            self._streak = min(self._streak, 0) - 1
+        else:
+            self._streak = 0
+
+        if self._streak >= self._patience and index < len(self.tiers) - 1:
+            self._set_tier(index + 1)
+            return True
+        if self._streak <= -self._patience:
+            self._set_tier(index - 1)
+            return True
+        return False
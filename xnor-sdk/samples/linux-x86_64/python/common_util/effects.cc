@@ -1,13 +1,22 @@
 // Copyright (c) 2019 Xnor.ai, Inc.
 
 #include <algorithm>
+#include <atomic>
 #include <cmath>
+#include <condition_variable>
 #include <cstdint>
 #include <cstdlib>
 #include <cstring>
+#include <deque>
+#include <functional>
 #include <limits>
 #include <memory>
+#include <mutex>
+#include <thread>
 #include <type_traits>
+#include <vector>
+
+#include <unistd.h>
 
 #include <Python.h>
 
@@ -17,19 +26,133 @@ using std::int32_t;
 using std::uint16_t;
 using std::uint8_t;
 
-// Wraps a simple buffer of type T, giving it 2D dimensions
+// Wraps a simple buffer of type T, giving it 2D dimensions. Frames don't own
+// their data, which lives in a ScratchBuffer or a Python object.
 template <typename T>
 struct Frame final {
   int32_t width, height;
-  std::unique_ptr<T[]> data;
+  T* data;
   int32_t stride; // Only set for bitmaps
 };
 
+// Byte layout of the pixels of an 8-bit, interleaved image
+struct PixelLayout final {
+  const char* name;  // As in GStreamer caps
+  int32_t pixel_size;
+  int32_t r, g, b;  // Byte offsets of each channel within a pixel
+};
+
+constexpr PixelLayout kPixelLayouts[] = {
+    {"RGB", 3, 0, 1, 2},  {"RGBA", 4, 0, 1, 2}, {"RGBx", 4, 0, 1, 2},
+    {"BGRA", 4, 2, 1, 0}, {"BGRx", 4, 2, 1, 0},
+};
+
+// Wraps an 8-bit image in any of kPixelLayouts, with rows `stride` bytes
+// apart. Like Frame, it doesn't own its data.
+struct Image final {
+  int32_t width, height;
+  const uint8_t* data;
+  Py_ssize_t stride;
+  const PixelLayout* layout;
+
+  const uint8_t* Row(int32_t y) const { return data + y * stride; }
+};
+
+// A packed 4-byte YUV layout for backgrounds blended into YUV frames. The
+// `r`, `g` and `b` offsets are those of Y, U and V.
+constexpr PixelLayout kPackedYuvLayout = {"YUVx", 4, 0, 1, 2};
+
+// Plane layout of a YUV 4:2:0 image. Chroma planes are half the size of the
+// luma plane in each direction, rounded up.
+struct YuvLayout final {
+  const char* name;  // As in GStreamer caps
+  int32_t n_planes;
+  // Interleaved chroma values per pixel of each chroma plane: 1 for separate
+  // U and V planes, 2 for a single UV plane
+  int32_t chroma_channels;
+};
+
+constexpr YuvLayout kYuvLayouts[] = {
+    {"I420", 3, 1},
+    {"NV12", 2, 2},
+};
+
+// One plane of an 8-bit image, `width` x `height` pixels of `channels`
+// interleaved values. Like Frame, it doesn't own its data.
+template <typename T>
+struct Plane final {
+  int32_t width, height, channels;
+  T* data;
+  Py_ssize_t stride;
+
+  T* Row(int32_t y) const { return data + y * stride; }
+};
+
+// Wraps a YUV 4:2:0 image in one of kYuvLayouts. Like Frame, it doesn't own
+// its data.
+template <typename T>
+struct YuvImage final {
+  int32_t width, height;
+  const YuvLayout* layout;
+  T* planes[3];
+  Py_ssize_t strides[3];
+
+  int32_t chroma_width() const { return (width + 1) / 2; }
+  int32_t chroma_height() const { return (height + 1) / 2; }
+
+  Plane<T> Luma() const { return {width, height, 1, planes[0], strides[0]}; }
+  // Plane 1 or 2
+  Plane<T> Chroma(int32_t index) const {
+    return {chroma_width(), chroma_height(), layout->chroma_channels,
+            planes[index], strides[index]};
+  }
+};
+
+// Computes GStreamer's default layout of a `width` x `height` image in
+// `layout`: rows padded to a multiple of 4 bytes, and planes stored one after
+// another, with room for an even number of luma rows. Returns the total size.
+Py_ssize_t DefaultYuvLayout(const YuvLayout& layout, int32_t width,
+                            int32_t height, Py_ssize_t strides[3],
+                            Py_ssize_t offsets[3]) {
+  auto round_up = [](Py_ssize_t value, Py_ssize_t multiple) {
+    return (value + multiple - 1) / multiple * multiple;
+  };
+  const Py_ssize_t chroma_rows = round_up(height, 2) / 2;
+  strides[0] = round_up(width, 4);
+  strides[1] = strides[2] = round_up(
+      round_up(width, 2) / 2 * layout.chroma_channels, 4);
+  offsets[0] = 0;
+  offsets[1] = strides[0] * round_up(height, 2);
+  offsets[2] = offsets[1] + strides[1] * chroma_rows;
+  return offsets[layout.n_planes - 1] +
+         strides[layout.n_planes - 1] * chroma_rows;
+}
+
+// A per-thread allocation that is reused from call to call, so that the
+// intermediate frames of an effect are only allocated when the stream size
+// grows.
+template <typename T>
+class ScratchBuffer final {
+ public:
+  T* Get(size_t size) {
+    if (size > capacity_) {
+      data_ = std::make_unique<T[]>(size);
+      capacity_ = size;
+    }
+    return data_.get();
+  }
+
+ private:
+  std::unique_ptr<T[]> data_;
+  size_t capacity_ = 0;
+};
+
 // Add a typedef for "packed" bits to clarify where we expect Frames to be
 // bitmaps
 typedef uint8_t bool1x8;
 
-// "Knob" constants and precomputed values for the algorithms
+// "Knob" constants for the algorithms. These are the defaults; every one of
+// them can be overridden per call (see EffectParams).
 
 // How much to downsample the original image before blurring. Downsampling
 // reduces the work done by blur by a factor of 4 for each iteration, without
@@ -40,24 +163,164 @@ constexpr int32_t kDownsampleFactor = 3;
 constexpr int32_t kBlurIterations = 2;
 constexpr int32_t kBoxSize = 35 / kDownsampleFactor;
 
-// Computed blur-related constants
 constexpr int32_t kRgbChannels = 4;
-constexpr int32_t kHalfBox = kBoxSize / 2;
-constexpr int32_t kHalfBox_STRIDE = kHalfBox * kRgbChannels;
-constexpr float kBoxFactor = 1.0f / kBoxSize;
 
 // Mask blur params
 // If the mask aspect ratio is different from the image aspect ratio, the blur
-// should be non-square as well. In this case, the X and Y parameters are set to
-// the same values since we expect both the mask and the camera image to be
-// 16:9.
+// should be non-square as well. We use the same size in X and Y since we
+// expect both the mask and the camera image to be 16:9.
 constexpr int32_t kMaskBlurIterations = 1;
-constexpr int32_t kMaskBoxSizeX = 11;
-constexpr int32_t kMaskHalfBoxX = kMaskBoxSizeX / 2;
-constexpr float kMaskBoxFactorX = 1.0f / kMaskBoxSizeX;
-constexpr int32_t kMaskBoxSizeY = 11;
-constexpr int32_t kMaskHalfBoxY = kMaskBoxSizeY / 2;
-constexpr float kMaskBoxFactorY = 1.0f / kMaskBoxSizeY;
+constexpr int32_t kMaskBoxSize = 11;
+
+// Redaction params: the size of the squares pixelated boxes are split into,
+// and the box blur of blurred ones
+constexpr int32_t kRedactBlockSize = 16;
+constexpr int32_t kRedactBoxSize = 31;
+constexpr int32_t kRedactBlurIterations = 2;
+
+// The knobs above, as given to a single call. Lighter settings (a larger
+// downsample factor, fewer iterations, smaller boxes) trade blur quality for
+// speed on slow devices.
+struct EffectParams final {
+  int32_t downsample = kDownsampleFactor;
+  int32_t blur_iterations = kBlurIterations;
+  int32_t box_size = kBoxSize;
+  int32_t mask_blur_iterations = kMaskBlurIterations;
+  int32_t mask_box_size = kMaskBoxSize;
+};
+
+// Precomputed values for one box blur pass
+struct BoxKernel final {
+  int32_t half_box;
+  float box_factor;
+
+  explicit BoxKernel(int32_t box_size)
+      : half_box(box_size / 2), box_factor(1.0f / box_size) {}
+};
+
+// How many sets of sampling tables to keep around. One per concurrent stream
+// size is enough.
+constexpr size_t kMaxCachedSamplingTables = 4;
+
+// Upper limit on the `threads` argument, to keep a typo from spawning
+// thousands of threads
+constexpr int32_t kMaxThreads = 64;
+
+// A persistent pool of worker threads for splitting the effects into bands.
+//
+// Threads are started the first time they are needed and then wait for work
+// for the lifetime of the process, so there is no per-frame thread creation.
+// Several callers may use the pool at once; each waits only for its own bands.
+class WorkerPool final {
+ public:
+  // The pool is intentionally leaked: its threads are never joined, so it must
+  // outlive static destruction at interpreter exit.
+  static WorkerPool& Instance() {
+    static WorkerPool* pool = new WorkerPool();
+    return *pool;
+  }
+
+  // Calls `fn(begin, end)` for contiguous bands covering [0, n), using up to
+  // `threads` threads including the calling one, and returns once every band
+  // is done. Bands never overlap, so `fn` only has to be safe to run on
+  // disjoint ranges concurrently.
+  template <typename Fn>
+  void ParallelFor(int32_t n, int32_t threads, const Fn& fn) {
+    const int32_t bands = std::min(n, threads);
+    if (bands <= 1) {
+      if (n > 0) {
+        fn(0, n);
+      }
+      return;
+    }
+    EnsureWorkers(bands - 1);
+
+    std::mutex done_mutex;
+    std::condition_variable done;
+    int32_t remaining = bands - 1;
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      for (int32_t band = 1; band < bands; ++band) {
+        tasks_.emplace_back([&, band] {
+          fn(BandStart(n, bands, band), BandStart(n, bands, band + 1));
+          std::lock_guard<std::mutex> done_lock(done_mutex);
+          if (--remaining == 0) {
+            done.notify_one();
+          }
+        });
+      }
+    }
+    work_available_.notify_all();
+
+    // The calling thread does the first band itself, then helps with whatever
+    // is still queued rather than sleeping.
+    fn(0, BandStart(n, bands, 1));
+    while (RunQueuedTask()) {
+    }
+
+    std::unique_lock<std::mutex> done_lock(done_mutex);
+    done.wait(done_lock, [&remaining] { return remaining == 0; });
+  }
+
+ private:
+  WorkerPool() = default;
+
+  static int32_t BandStart(int32_t n, int32_t bands, int32_t band) {
+    return static_cast<int32_t>(static_cast<int64_t>(n) * band / bands);
+  }
+
+  void EnsureWorkers(int32_t count) {
+    std::lock_guard<std::mutex> lock(mutex_);
+    // Threads don't survive fork(); start over in a child process.
+    if (owner_pid_ != getpid()) {
+      owner_pid_ = getpid();
+      num_workers_ = 0;
+      tasks_.clear();
+    }
+    for (; num_workers_ < count; ++num_workers_) {
+      std::thread(&WorkerPool::WorkerLoop, this).detach();
+    }
+  }
+
+  bool RunQueuedTask() {
+    std::function<void()> task;
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      if (tasks_.empty()) {
+        return false;
+      }
+      task = std::move(tasks_.front());
+      tasks_.pop_front();
+    }
+    task();
+    return true;
+  }
+
+  void WorkerLoop() {
+    for (;;) {
+      std::function<void()> task;
+      {
+        std::unique_lock<std::mutex> lock(mutex_);
+        work_available_.wait(lock, [this] { return !tasks_.empty(); });
+        task = std::move(tasks_.front());
+        tasks_.pop_front();
+      }
+      task();
+    }
+  }
+
+  std::mutex mutex_;
+  std::condition_variable work_available_;
+  std::deque<std::function<void()>> tasks_;
+  int32_t num_workers_ = 0;
+  pid_t owner_pid_ = getpid();
+};
+
+// Shorthand for splitting work across the shared pool
+template <typename Fn>
+void ParallelFor(int32_t n, int32_t threads, const Fn& fn) {
+  WorkerPool::Instance().ParallelFor(n, threads, fn);
+}
 
 // Some constexpr utility functions. Hopefully inlined.
 
@@ -93,395 +356,2712 @@ constexpr int32_t ceil(float val) {
 // Positive-only modulus operator, like the math one
 constexpr int32_t modulo(int32_t a, int32_t m) { return ((a % m) + m) % m; }
 
-// A simple Gaussian-approximation blur. Blur parameters defined above.
-// Arguments:
-//  - `base`: an RGBA image with 16-bit channels
-void Blur(Frame<uint16_t>& base) {
-  uint16_t* const result = base.data.get();
+// Horizontal pass of Blur over rows [y_begin, y_end)
+void BlurRows(Frame<uint16_t>& base, const BoxKernel& kernel, int32_t y_begin,
+              int32_t y_end) {
+  const int32_t half_box = kernel.half_box;
+  const float box_factor = kernel.box_factor;
+  uint16_t* const result = base.data;
   const int32_t base_stride = base.width * kRgbChannels;
 
-  for (int32_t iteration = 0; iteration < kBlurIterations; ++iteration) {
-    // Horizontal pass
-    for (int32_t y = 0; y < base.height; ++y) {
-      const int32_t y_offset = y * base_stride;
-      result[y_offset + 0] = result[y_offset + 1] = result[y_offset + 2] = 0;
-
-      // Compute whole kernel for leftmost pixel
-      for (int32_t x = -kHalfBox; x <= kHalfBox; ++x) {
-        const int32_t i = y_offset + modulo(x, base.width) * kRgbChannels;
-        result[y_offset + 0] += round_half(kBoxFactor * result[i + 0]);
-        result[y_offset + 1] += round_half(kBoxFactor * result[i + 1]);
-        result[y_offset + 2] += round_half(kBoxFactor * result[i + 2]);
-      }
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    const int32_t y_offset = y * base_stride;
+    result[y_offset + 0] = result[y_offset + 1] = result[y_offset + 2] = 0;
 
-      // For the rest of the row, just compute delta from previous pixel
-      for (int32_t x = 1; x < base.width; ++x) {
-        const int32_t i = y_offset + x * kRgbChannels;
-
-        const int32_t min_x = modulo(x - kHalfBox - 1, base.width);
-        const int32_t max_x = modulo(x + kHalfBox + 1, base.width);
-
-        const int32_t last_i = i - kRgbChannels;
-        const int32_t min_i = y_offset + min_x * kRgbChannels;
-        const int32_t max_i = y_offset + max_x * kRgbChannels;
-
-        result[i + 0] = clampint<uint16_t>(
-            round_half(result[last_i + 0] - kBoxFactor * result[min_i + 0] +
-                       kBoxFactor * result[max_i + 0]));
-        result[i + 1] = clampint<uint16_t>(
-            round_half(result[last_i + 1] - kBoxFactor * result[min_i + 1] +
-                       kBoxFactor * result[max_i + 1]));
-        result[i + 2] = clampint<uint16_t>(
-            round_half(result[last_i + 2] - kBoxFactor * result[min_i + 2] +
-                       kBoxFactor * result[max_i + 2]));
-      }
+    // Compute whole kernel for leftmost pixel
+    for (int32_t x = -half_box; x <= half_box; ++x) {
+      const int32_t i = y_offset + modulo(x, base.width) * kRgbChannels;
+      result[y_offset + 0] += round_half(box_factor * result[i + 0]);
+      result[y_offset + 1] += round_half(box_factor * result[i + 1]);
+      result[y_offset + 2] += round_half(box_factor * result[i + 2]);
     }
 
-    // Vertical pass
-    for (int32_t x = 0; x < base.width; ++x) {
-      int32_t i = x * kRgbChannels;
-      result[i + 0] = result[i + 1] = result[i + 2] = 0;
-    }
-    // Compute whole kernel for topmost pixel
-    for (int32_t y = -kHalfBox; y <= kHalfBox; ++y) {
-      const int32_t wrapped_y = modulo(y, base.height);
-      for (int32_t x = 0; x < base.width; ++x) {
-        const int32_t i_x = x * kRgbChannels;
-        result[i_x + 0] += round_half(
-            kBoxFactor * (result[wrapped_y * base_stride + i_x + 0]));
-        result[i_x + 1] += round_half(
-            kBoxFactor * (result[wrapped_y * base_stride + i_x + 1]));
-        result[i_x + 2] += round_half(
-            kBoxFactor * (result[wrapped_y * base_stride + i_x + 2]));
-      }
+    // For the rest of the row, just compute delta from previous pixel
+    for (int32_t x = 1; x < base.width; ++x) {
+      const int32_t i = y_offset + x * kRgbChannels;
+
+      const int32_t min_x = modulo(x - half_box - 1, base.width);
+      const int32_t max_x = modulo(x + half_box + 1, base.width);
+
+      const int32_t last_i = i - kRgbChannels;
+      const int32_t min_i = y_offset + min_x * kRgbChannels;
+      const int32_t max_i = y_offset + max_x * kRgbChannels;
+
+      result[i + 0] = clampint<uint16_t>(
+          round_half(result[last_i + 0] - box_factor * result[min_i + 0] +
+                     box_factor * result[max_i + 0]));
+      result[i + 1] = clampint<uint16_t>(
+          round_half(result[last_i + 1] - box_factor * result[min_i + 1] +
+                     box_factor * result[max_i + 1]));
+      result[i + 2] = clampint<uint16_t>(
+          round_half(result[last_i + 2] - box_factor * result[min_i + 2] +
+                     box_factor * result[max_i + 2]));
     }
+  }
+}
 
-    // For the rest of the columns, just compute deltas from previous pixel
-    for (int32_t y = 1; y < base.height; ++y) {
-      const int32_t y_offset = y * base_stride;
-      const int32_t last_y = y_offset - base_stride;
-      const int32_t min_y =
-          modulo((y - kHalfBox - 1), base.height) * base_stride;
-      const int32_t max_y =
-          modulo((y + kHalfBox + 1), base.height) * base_stride;
-      for (int32_t x = 0; x < base.width; ++x) {
-        const int32_t i_x = x * kRgbChannels;
-        const int32_t i = y_offset + i_x;
-
-        const int32_t i_last = last_y + i_x;
-        const int32_t i_min = min_y + i_x;
-        const int32_t i_max = max_y + i_x;
-        result[i + 0] = clampint<uint16_t>(
-            round_half(result[i_last + 0] - kBoxFactor * result[i_min + 0] +
-                       kBoxFactor * result[i_max + 0]));
-        result[i + 1] = clampint<uint16_t>(
-            round_half(result[i_last + 1] - kBoxFactor * result[i_min + 1] +
-                       kBoxFactor * result[i_max + 1]));
-        result[i + 2] = clampint<uint16_t>(
-            round_half(result[i_last + 2] - kBoxFactor * result[i_min + 2] +
-                       kBoxFactor * result[i_max + 2]));
-      }
+// Vertical pass of Blur over columns [x_begin, x_end)
+void BlurColumns(Frame<uint16_t>& base, const BoxKernel& kernel,
+                 int32_t x_begin, int32_t x_end) {
+  const int32_t half_box = kernel.half_box;
+  const float box_factor = kernel.box_factor;
+  uint16_t* const result = base.data;
+  const int32_t base_stride = base.width * kRgbChannels;
+
+  for (int32_t x = x_begin; x < x_end; ++x) {
+    int32_t i = x * kRgbChannels;
+    result[i + 0] = result[i + 1] = result[i + 2] = 0;
+  }
+  // Compute whole kernel for topmost pixel
+  for (int32_t y = -half_box; y <= half_box; ++y) {
+    const int32_t wrapped_y = modulo(y, base.height);
+    for (int32_t x = x_begin; x < x_end; ++x) {
+      const int32_t i_x = x * kRgbChannels;
+      result[i_x + 0] += round_half(
+          box_factor * (result[wrapped_y * base_stride + i_x + 0]));
+      result[i_x + 1] += round_half(
+          box_factor * (result[wrapped_y * base_stride + i_x + 1]));
+      result[i_x + 2] += round_half(
+          box_factor * (result[wrapped_y * base_stride + i_x + 2]));
+    }
+  }
+
+  // For the rest of the columns, just compute deltas from previous pixel
+  for (int32_t y = 1; y < base.height; ++y) {
+    const int32_t y_offset = y * base_stride;
+    const int32_t last_y = y_offset - base_stride;
+    const int32_t min_y =
+        modulo((y - half_box - 1), base.height) * base_stride;
+    const int32_t max_y =
+        modulo((y + half_box + 1), base.height) * base_stride;
+    for (int32_t x = x_begin; x < x_end; ++x) {
+      const int32_t i_x = x * kRgbChannels;
+      const int32_t i = y_offset + i_x;
+
+      const int32_t i_last = last_y + i_x;
+      const int32_t i_min = min_y + i_x;
+      const int32_t i_max = max_y + i_x;
+      result[i + 0] = clampint<uint16_t>(
+          round_half(result[i_last + 0] - box_factor * result[i_min + 0] +
+                     box_factor * result[i_max + 0]));
+      result[i + 1] = clampint<uint16_t>(
+          round_half(result[i_last + 1] - box_factor * result[i_min + 1] +
+                     box_factor * result[i_max + 1]));
+      result[i + 2] = clampint<uint16_t>(
+          round_half(result[i_last + 2] - box_factor * result[i_min + 2] +
+                     box_factor * result[i_max + 2]));
     }
   }
 }
 
-// A lot like blur, but with some extra simplifications that we can make thanks
-// to the fact that it's only got one channel
-// Arguments:
-//  - `mask`: a 2D float map
-void BlurMask(Frame<float>& mask) {
-  float* const result = mask.data.get();
+// Horizontal pass of BlurMask over rows [y_begin, y_end)
+void BlurMaskRows(Frame<float>& mask, const BoxKernel& kernel, int32_t y_begin,
+                  int32_t y_end) {
+  const int32_t half_box = kernel.half_box;
+  const float box_factor = kernel.box_factor;
+  float* const result = mask.data;
   int32_t mask_stride = mask.width;
 
-  for (int32_t iteration = 0; iteration < kMaskBlurIterations; ++iteration) {
-    // Horizontal pass
-    for (int32_t y = 0; y < mask.height; ++y) {
-      const int32_t y_offset = y * mask_stride;
-      result[y_offset] = 0;
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    const int32_t y_offset = y * mask_stride;
+    result[y_offset] = 0;
 
-      // Compute whole kernel for leftmost pixel
-      for (int32_t x = -kMaskHalfBoxX; x <= kMaskHalfBoxX; ++x) {
-        const int32_t i = y_offset + modulo(x, mask.width);
-        result[y_offset] += kMaskBoxFactorX * result[i];
-      }
+    // Compute whole kernel for leftmost pixel
+    for (int32_t x = -half_box; x <= half_box; ++x) {
+      const int32_t i = y_offset + modulo(x, mask.width);
+      result[y_offset] += box_factor * result[i];
+    }
 
-      // For the rest of the row, just compute delta from previous pixel
-      for (int32_t x = 1; x < mask.width; ++x) {
-        const int32_t i = y_offset + x;
+    // For the rest of the row, just compute delta from previous pixel
+    for (int32_t x = 1; x < mask.width; ++x) {
+      const int32_t i = y_offset + x;
 
-        const int32_t min_x = modulo(x - kMaskHalfBoxX - 1, mask.width);
-        const int32_t max_x = modulo(x + kMaskHalfBoxX + 1, mask.width);
+      const int32_t min_x = modulo(x - half_box - 1, mask.width);
+      const int32_t max_x = modulo(x + half_box + 1, mask.width);
 
-        const int32_t last_i = i - 1;
-        const int32_t min_i = y_offset + min_x;
-        const int32_t max_i = y_offset + max_x;
+      const int32_t last_i = i - 1;
+      const int32_t min_i = y_offset + min_x;
+      const int32_t max_i = y_offset + max_x;
 
-        result[i] = zero_one(result[last_i] - kMaskBoxFactorX * result[min_i] +
-                             kMaskBoxFactorX * result[max_i]);
-      }
+      result[i] = zero_one(result[last_i] - box_factor * result[min_i] +
+                           box_factor * result[max_i]);
     }
+  }
+}
 
-    // Vertical pass
-    for (int32_t x = 0; x < mask.width; ++x) {
-      result[x] = 0;
-    }
-    // Compute whole kernel for topmost pixel
-    for (int32_t y = -kMaskHalfBoxY; y <= kMaskHalfBoxY; ++y) {
-      // Use |y| to avoid weird "blur bleed" from the bottom of the mask to
-      // the top
-      const int32_t wrapped_y = modulo(std::abs(y), mask.height);
-      for (int32_t x = 0; x < mask.width; ++x) {
-        result[x] += kMaskBoxFactorY * (result[wrapped_y * mask_stride + x]);
-      }
+// Vertical pass of BlurMask over columns [x_begin, x_end)
+void BlurMaskColumns(Frame<float>& mask, const BoxKernel& kernel,
+                     int32_t x_begin, int32_t x_end) {
+  const int32_t half_box = kernel.half_box;
+  const float box_factor = kernel.box_factor;
+  float* const result = mask.data;
+  int32_t mask_stride = mask.width;
+
+  for (int32_t x = x_begin; x < x_end; ++x) {
+    result[x] = 0;
+  }
+  // Compute whole kernel for topmost pixel
+  for (int32_t y = -half_box; y <= half_box; ++y) {
+    // Use |y| to avoid weird "blur bleed" from the bottom of the mask to
+    // the top
+    const int32_t wrapped_y = modulo(std::abs(y), mask.height);
+    for (int32_t x = x_begin; x < x_end; ++x) {
+      result[x] += box_factor * (result[wrapped_y * mask_stride + x]);
     }
+  }
 
-    // For the rest of the columns, just compute deltas from previous pixel
-    for (int32_t y = 1; y < mask.height; ++y) {
-      const int32_t y_offset = y * mask_stride;
-      const int32_t last_y = y_offset - mask_stride;
-      const int32_t min_y =
-          modulo((y - kMaskHalfBoxY - 1), mask.height) * mask_stride;
-      const int32_t max_y =
-          modulo((y + kMaskHalfBoxY + 1), mask.height) * mask_stride;
-      for (int32_t x = 0; x < mask.width; ++x) {
-        const int32_t i = y_offset + x;
-
-        const int32_t i_last = last_y + x;
-        const int32_t i_min = min_y + x;
-        const int32_t i_max = max_y + x;
-        result[i] = zero_one(result[i_last] - kMaskBoxFactorY * result[i_min] +
-                             kMaskBoxFactorY * result[i_max]);
-      }
+  // For the rest of the columns, just compute deltas from previous pixel
+  for (int32_t y = 1; y < mask.height; ++y) {
+    const int32_t y_offset = y * mask_stride;
+    const int32_t last_y = y_offset - mask_stride;
+    const int32_t min_y =
+        modulo((y - half_box - 1), mask.height) * mask_stride;
+    const int32_t max_y =
+        modulo((y + half_box + 1), mask.height) * mask_stride;
+    for (int32_t x = x_begin; x < x_end; ++x) {
+      const int32_t i = y_offset + x;
+
+      const int32_t i_last = last_y + x;
+      const int32_t i_min = min_y + x;
+      const int32_t i_max = max_y + x;
+      result[i] = zero_one(result[i_last] - box_factor * result[i_min] +
+                           box_factor * result[i_max]);
     }
   }
 }
 
-// Blits `frame` to `background`, using `mask` as an opacity map
-// Arguments:
-//  - `frame`: an RGBA image with 8-bit channels
-//  - `mask`: a 2D float-map image
-//  - `background`: an RGBA image with 8-bit channels
-void BackgroundMask(Frame<uint8_t>& frame, const Frame<float>& mask,
-                    const Frame<uint8_t>& background) {
-  uint32_t* frame_data = reinterpret_cast<uint32_t*>(frame.data.get());
-  uint32_t* background_data =
-      reinterpret_cast<uint32_t*>(background.data.get());
-
-  for (int32_t y = 0; y < frame.height; ++y) {
-    for (int32_t x = 0; x < frame.width; ++x) {
-      float nx = static_cast<float>(x) / frame.width;
-      float ny = static_cast<float>(y) / frame.height;
+// Unpacks rows [y_begin, y_end) of `bitmap` into a 0.0/1.0 float map
+void BitmapToFloatRows(const Frame<const bool1x8>& bitmap,
+                       Frame<float>& float_map, int32_t y_begin,
+                       int32_t y_end) {
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    for (int32_t x = 0; x < bitmap.width; ++x) {
+      int32_t byte_x = x / 8;
+      int32_t bit_x = x % 8;
+      bool value = (bitmap.data[y * bitmap.stride + byte_x] >> bit_x) & 0x1;
+      float_map.data[y * bitmap.width + x] = static_cast<float>(value);
+    }
+  }
+}
 
-      // Sample mask
-      int32_t mask_x = nx * mask.width;
-      int32_t mask_y = ny * mask.height;
-      float mask_val = mask.data[mask_y * mask.width + mask_x];
+// How BackgroundMask samples the mask when scaling it up to the frame size
+enum class MaskFilter { kNearest, kBilinear };
+
+// Where BackgroundMask samples the mask and background for each column (or
+// row) of the frame
+struct AxisSampling final {
+  std::vector<int32_t> mask;        // Nearest mask pixel
+  std::vector<int32_t> background;  // Nearest background pixel
+  // Bilinear mask sampling: the two neighbouring mask pixels, and the weight
+  // of the second one
+  std::vector<int32_t> mask_low, mask_high;
+  std::vector<float> mask_weight;
+
+  // `background_prescaled` means the background has already been resampled to
+  // the frame size, so it is read pixel for pixel.
+  AxisSampling(int32_t frame_size, int32_t mask_size, int32_t background_size,
+               bool background_prescaled)
+      : mask(frame_size),
+        background(frame_size),
+        mask_low(frame_size),
+        mask_high(frame_size),
+        mask_weight(frame_size) {
+    for (int32_t i = 0; i < frame_size; ++i) {
+      // Same arithmetic as sampling each pixel directly
+      float n = static_cast<float>(i) / frame_size;
+      mask[i] = n * mask_size;
+      background[i] = background_prescaled ? i : n * background_size;
+
+      // Pixel centers line up between the frame and the mask
+      float position = std::max(
+          0.0f, (i + 0.5f) * mask_size / frame_size - 0.5f);
+      mask_low[i] = std::min(floor(position), mask_size - 1);
+      mask_high[i] = std::min(mask_low[i] + 1, mask_size - 1);
+      mask_weight[i] = position - mask_low[i];
+    }
+  }
+};
 
-      // Sample background
-      int32_t background_x = nx * background.width;
-      int32_t background_y = ny * background.height;
-      uint32_t bg_color =
-          background_data[background_y * background.width + background_x];
+// Lookup tables for BackgroundMask. They only depend on the frame, mask and
+// background dimensions, which don't change during a stream.
+struct SamplingTables final {
+  int32_t frame_width, frame_height;
+  int32_t mask_width, mask_height;
+  int32_t background_width, background_height;
+  bool background_prescaled;
+  AxisSampling columns, rows;
+
+  SamplingTables(const Image& frame, const Frame<float>& mask,
+                 const Image& background, bool background_prescaled)
+      : frame_width(frame.width),
+        frame_height(frame.height),
+        mask_width(mask.width),
+        mask_height(mask.height),
+        background_width(background.width),
+        background_height(background.height),
+        background_prescaled(background_prescaled),
+        columns(frame.width, mask.width, background.width,
+                background_prescaled),
+        rows(frame.height, mask.height, background.height,
+             background_prescaled) {}
+
+  bool Matches(const Image& frame, const Frame<float>& mask,
+               const Image& background, bool background_prescaled) const {
+    return frame_width == frame.width && frame_height == frame.height &&
+           mask_width == mask.width && mask_height == mask.height &&
+           background_width == background.width &&
+           background_height == background.height &&
+           this->background_prescaled == background_prescaled;
+  }
+};
 
-      uint32_t frame_color = frame_data[y * frame.width + x];
+// Returns the sampling tables for the given dimensions, building them the first
+// time they're needed. The most recently used tables are kept for later calls.
+std::shared_ptr<const SamplingTables> GetSamplingTables(
+    const Image& frame, const Frame<float>& mask, const Image& background,
+    bool background_prescaled) {
+  static std::mutex mutex;
+  static std::deque<std::shared_ptr<const SamplingTables>> cache;
+
+  std::lock_guard<std::mutex> lock(mutex);
+  for (auto it = cache.begin(); it != cache.end(); ++it) {
+    if ((*it)->Matches(frame, mask, background, background_prescaled)) {
+      std::shared_ptr<const SamplingTables> tables = *it;
+      cache.erase(it);
+      cache.push_front(tables);
+      return tables;
+    }
+  }
+  cache.push_front(std::make_shared<const SamplingTables>(
+      frame, mask, background, background_prescaled));
+  if (cache.size() > kMaxCachedSamplingTables) {
+    cache.pop_back();
+  }
+  return cache.front();
+}
 
-      int32_t frame_r = frame_color & 0x0000FF;
-      int32_t frame_g = (frame_color & 0x00FF00) >> 8;
-      int32_t frame_b = (frame_color & 0xFF0000) >> 16;
-      int32_t bg_r = bg_color & 0x0000FF;
-      int32_t bg_g = (bg_color & 0x00FF00) >> 8;
-      int32_t bg_b = (bg_color & 0xFF0000) >> 16;
-      uint8_t mixed_r = clampint<uint8_t>(bg_r + (frame_r - bg_r) * mask_val);
-      uint8_t mixed_g = clampint<uint8_t>(bg_g + (frame_g - bg_g) * mask_val);
-      uint8_t mixed_b = clampint<uint8_t>(bg_b + (frame_b - bg_b) * mask_val);
+// Rows [y_begin, y_end) of BackgroundMask
+template <MaskFilter kMaskFilter>
+void BackgroundMaskRows(const Image& frame, const Frame<float>& mask,
+                        const Image& background, const SamplingTables& tables,
+                        uint8_t* out, int32_t y_begin, int32_t y_end) {
+  const PixelLayout& frame_layout = *frame.layout;
+  const PixelLayout& background_layout = *background.layout;
+  const AxisSampling& columns = tables.columns;
+  const AxisSampling& rows = tables.rows;
+
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    const uint8_t* frame_row = frame.Row(y);
+    const uint8_t* background_row = background.Row(rows.background[y]);
+    const float* mask_row = mask.data + rows.mask[y] * mask.width;
+    const float* mask_row_low = mask.data + rows.mask_low[y] * mask.width;
+    const float* mask_row_high = mask.data + rows.mask_high[y] * mask.width;
+    const float mask_weight_y = rows.mask_weight[y];
+    uint8_t* out_row = out + y * frame.width * kRgbChannels;
+    for (int32_t x = 0; x < frame.width; ++x) {
+      // Sample mask
+      float mask_val;
+      if (kMaskFilter == MaskFilter::kBilinear) {
+        const int32_t low = columns.mask_low[x];
+        const int32_t high = columns.mask_high[x];
+        const float weight_x = columns.mask_weight[x];
+        float top = mask_row_low[low] +
+                    (mask_row_low[high] - mask_row_low[low]) * weight_x;
+        float bottom = mask_row_high[low] +
+                       (mask_row_high[high] - mask_row_high[low]) * weight_x;
+        mask_val = top + (bottom - top) * mask_weight_y;
+      } else {
+        mask_val = mask_row[columns.mask[x]];
+      }
 
-      frame_data[y * frame.width + x] = mixed_r | mixed_g << 8 | mixed_b << 16;
+      // Sample background
+      const uint8_t* bg_color =
+          background_row + columns.background[x] * background_layout.pixel_size;
+
+      const uint8_t* frame_color = frame_row + x * frame_layout.pixel_size;
+
+      int32_t frame_r = frame_color[frame_layout.r];
+      int32_t frame_g = frame_color[frame_layout.g];
+      int32_t frame_b = frame_color[frame_layout.b];
+      int32_t bg_r = bg_color[background_layout.r];
+      int32_t bg_g = bg_color[background_layout.g];
+      int32_t bg_b = bg_color[background_layout.b];
+      out_row[x * kRgbChannels + 0] =
+          clampint<uint8_t>(bg_r + (frame_r - bg_r) * mask_val);
+      out_row[x * kRgbChannels + 1] =
+          clampint<uint8_t>(bg_g + (frame_g - bg_g) * mask_val);
+      out_row[x * kRgbChannels + 2] =
+          clampint<uint8_t>(bg_b + (frame_b - bg_b) * mask_val);
+      out_row[x * kRgbChannels + 3] = 0;
     }
   }
 }
 
-// Python argument conversion function
-// Takes a `PyObject*` assumed to be a `gst_pipeline.Frame` and converts it to a
-// `Frame<uint8_t>`, which is assumed to be passed through the `void*` argument.
-// Return value indicates to the CPython interpreter whether to call the
-// function again for cleanup (which we do not use here).
-// See https://docs.python.org/3/c-api/arg.html#other-objects for more
-// information on object conversion functions.
-int ConvertBytes(PyObject* obj, void* frame_addr) {
-  Frame<uint8_t> frame;
-  const char* format_str;
-  const char* bytes_data;
-  int bytes_size;
-  if (!PyArg_ParseTuple(obj, "s(ll)y#", &format_str, &frame.width,
-                        &frame.height, &bytes_data, &bytes_size)) {
-    return 0;
+// Blends `n_elements` 8-bit values: out = background + (frame - background) *
+// mask. Used for the planes of YUV frames.
+void BlendRow(const uint8_t* frame, const uint8_t* background,
+              const float* mask, int32_t n_elements, uint8_t* out) {
+  for (int32_t i = 0; i < n_elements; ++i) {
+    out[i] = clampint<uint8_t>(background[i] +
+                               (frame[i] - background[i]) * mask[i]);
   }
+}
 
-  if (std::strcmp(format_str, "RGB") != 0) {
-    PyErr_SetString(PyExc_TypeError, "Bad frame format!");
-    return 0;
+// Scalar version of BackgroundMaskRows, choosing the mask filter at run time
+void BackgroundMaskRowsScalar(const Image& frame, const Frame<float>& mask,
+                              const Image& background,
+                              const SamplingTables& tables,
+                              MaskFilter mask_filter, uint8_t* out,
+                              int32_t y_begin, int32_t y_end) {
+  if (mask_filter == MaskFilter::kBilinear) {
+    BackgroundMaskRows<MaskFilter::kBilinear>(frame, mask, background, tables,
+                                              out, y_begin, y_end);
+  } else {
+    BackgroundMaskRows<MaskFilter::kNearest>(frame, mask, background, tables,
+                                             out, y_begin, y_end);
   }
+}
+
+// SIMD versions of the kernels
+//
+// These are written once with the GCC/clang vector extensions and compiled for
+// each instruction set by always inlining them into small wrappers with the
+// matching `target` attribute (see EFFECTS_SIMD_KERNELS). Each does the same
+// arithmetic in the same order as the scalar kernel it replaces, and the
+// extension is built with -ffp-contract=off so that no multiply-add gets fused,
+// so every version produces bit-identical output.
+//
+// The horizontal pass of BlurMask is a running sum along each row of a single
+// channel, which doesn't vectorize, so it stays scalar everywhere.
+//
+// On x86, SSE4.1 and AVX2 versions are built and the fastest one the CPU
+// supports is picked when the module is imported. On ARM, NEON is used when
+// the compiler targets it (it is always there on 64-bit ARM). The compositing
+// kernel packs pixels into 32-bit lanes, first byte lowest, so SIMD is only
+// used on little-endian targets.
+
+#define EFFECTS_ALWAYS_INLINE inline __attribute__((always_inline))
+
+#if defined(__x86_64__) || defined(__i386__)
+#define EFFECTS_X86 1
+#endif
+#if (defined(__ARM_NEON) || defined(__aarch64__)) && \
+    __BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__
+#define EFFECTS_NEON 1
+#endif
+
+template <int kLanes>
+struct Vectors;
+
+template <>
+struct Vectors<4> {
+  typedef float F __attribute__((vector_size(16)));
+  typedef int32_t I __attribute__((vector_size(16)));
+  typedef uint16_t U16 __attribute__((vector_size(8)));
+  typedef uint8_t U8 __attribute__((vector_size(4)));
+};
+
+template <>
+struct Vectors<8> {
+  typedef float F __attribute__((vector_size(32)));
+  typedef int32_t I __attribute__((vector_size(32)));
+  typedef uint16_t U16 __attribute__((vector_size(16)));
+  typedef uint8_t U8 __attribute__((vector_size(8)));
+};
 
-  int32_t rgba_size = bytes_size * 4 / 3;
-  frame.data = std::make_unique<uint8_t[]>(rgba_size);
+// Vectors are passed by reference so that wider-than-baseline vectors never
+// cross a function boundary that hasn't been compiled for them
+template <typename V, typename T>
+EFFECTS_ALWAYS_INLINE void Load(V& v, const T* data) {
+  std::memcpy(&v, data, sizeof(v));
+}
+
+template <typename V, typename T>
+EFFECTS_ALWAYS_INLINE void Store(T* data, const V& v) {
+  std::memcpy(data, &v, sizeof(v));
+}
 
-  for (int32_t i = 0; i < bytes_size / 3; ++i) {
-    frame.data[4 * i + 0] = bytes_data[3 * i + 0];
-    frame.data[4 * i + 1] = bytes_data[3 * i + 1];
-    frame.data[4 * i + 2] = bytes_data[3 * i + 2];
-    frame.data[4 * i + 3] = 255;
+template <typename V, typename T>
+EFFECTS_ALWAYS_INLINE void Splat(V& v, T value) {
+  for (size_t lane = 0; lane < sizeof(V) / sizeof(T); ++lane) {
+    v[lane] = value;
   }
+}
 
-  *reinterpret_cast<Frame<uint8_t>*>(frame_addr) = std::move(frame);
-  return 1;
+// Loads unsigned 16-bit values and widens them to 32-bit ints
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void LoadU16(typename Vectors<kLanes>::I& v,
+                                   const uint16_t* data) {
+  typename Vectors<kLanes>::U16 narrow;
+  Load(narrow, data);
+  v = __builtin_convertvector(narrow, typename Vectors<kLanes>::I);
 }
 
-// Python argument conversion function
-// Takes a `PyObject*` assumed to be a `xnornet.SegmentationMask` and converts
-// it to a `Frame<bool1x8>`, which is assumed to be passed through the `void*`
-// argument.
-int ConvertMask(PyObject* obj, void* frame_addr) {
-  Frame<bool1x8> frame;
+// Clamps to [0, 65535] and stores as 16-bit values, like clampint<uint16_t>
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void StoreU16(uint16_t* data,
+                                    const typename Vectors<kLanes>::I& v) {
+  typedef typename Vectors<kLanes>::I I;
+  I zero, max;
+  Splat(zero, 0);
+  Splat(max, 65535);
+  I clamped = v < zero ? zero : v;
+  clamped = clamped > max ? max : clamped;
+  Store(data, __builtin_convertvector(clamped, typename Vectors<kLanes>::U16));
+}
 
-  auto get_attr_long = [](PyObject* obj, const char* attr,
-                          int32_t* out) -> bool {
-    PyObject* py_attr = PyObject_GetAttrString(obj, attr);
-    if (py_attr == NULL) {
-      return false;
+// Like round_half: adds 0.5 and truncates
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void RoundHalf(typename Vectors<kLanes>::I& result,
+                                     const typename Vectors<kLanes>::F& v) {
+  typename Vectors<kLanes>::F half;
+  Splat(half, 0.5f);
+  result = __builtin_convertvector(v + half, typename Vectors<kLanes>::I);
+}
+
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void BitmapToFloatRowsSimd(
+    const Frame<const bool1x8>& bitmap, Frame<float>& float_map,
+    int32_t y_begin, int32_t y_end) {
+  typedef Vectors<kLanes> V;
+  static_assert(8 % kLanes == 0, "A vector must cover part of one byte");
+  typename V::I lane_bits, one;
+  for (int32_t lane = 0; lane < kLanes; ++lane) {
+    lane_bits[lane] = lane;
+  }
+  Splat(one, 1);
+
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    const bool1x8* row = bitmap.data + y * bitmap.stride;
+    float* out_row = float_map.data + y * bitmap.width;
+    int32_t x = 0;
+    for (; x + kLanes <= bitmap.width; x += kLanes) {
+      typename V::I bits, shift;
+      Splat(bits, static_cast<int32_t>(row[x / 8]));
+      Splat(shift, x % 8);
+      bits = (bits >> (lane_bits + shift)) & one;
+      Store(out_row + x, __builtin_convertvector(bits, typename V::F));
     }
-    int32_t val = PyLong_AsLong(py_attr);
-    if (PyErr_Occurred()) {
-      Py_DECREF(py_attr);
-      return false;
+    for (; x < bitmap.width; ++x) {
+      out_row[x] = static_cast<float>((row[x / 8] >> (x % 8)) & 0x1);
     }
-    *out = val;
-    Py_DECREF(py_attr);
-    return true;
-  };
-
-  if (!get_attr_long(obj, "width", &frame.width) ||
-      !get_attr_long(obj, "height", &frame.height) ||
-      !get_attr_long(obj, "_stride", &frame.stride)) {
-    return 0;
   }
+}
 
-  PyObject* data = PyObject_CallMethod(obj, "to_bytes", NULL);
-  if (data == NULL) {
-    return 0;
+// Works on the four channels of a pixel at once, since each pixel depends on
+// the one before it
+EFFECTS_ALWAYS_INLINE void BlurRowsSimd(Frame<uint16_t>& base,
+                                        const BoxKernel& kernel,
+                                        int32_t y_begin, int32_t y_end) {
+  typedef Vectors<4> V;
+  const int32_t half_box = kernel.half_box;
+  V::F box_factor;
+  Splat(box_factor, kernel.box_factor);
+  uint16_t* const result = base.data;
+  const int32_t base_stride = base.width * kRgbChannels;
+
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    uint16_t* const row = result + y * base_stride;
+    std::fill(row, row + kRgbChannels, 0);
+
+    // Compute whole kernel for leftmost pixel. The first pixel is both the
+    // sum and one of the terms, as in the scalar code.
+    for (int32_t x = -half_box; x <= half_box; ++x) {
+      V::I sum, value;
+      LoadU16<4>(sum, row);
+      LoadU16<4>(value, row + modulo(x, base.width) * kRgbChannels);
+      V::I rounded;
+      RoundHalf<4>(rounded, box_factor * __builtin_convertvector(value, V::F));
+      sum += rounded;
+      Store(row, __builtin_convertvector(sum, V::U16));
+    }
+
+    // For the rest of the row, just compute delta from previous pixel
+    for (int32_t x = 1; x < base.width; ++x) {
+      const int32_t min_x = modulo(x - half_box - 1, base.width);
+      const int32_t max_x = modulo(x + half_box + 1, base.width);
+      V::I last, min, max;
+      LoadU16<4>(last, row + (x - 1) * kRgbChannels);
+      LoadU16<4>(min, row + min_x * kRgbChannels);
+      LoadU16<4>(max, row + max_x * kRgbChannels);
+      V::F sum = __builtin_convertvector(last, V::F) -
+                 box_factor * __builtin_convertvector(min, V::F) +
+                 box_factor * __builtin_convertvector(max, V::F);
+      V::I rounded;
+      RoundHalf<4>(rounded, sum);
+      StoreU16<4>(row + x * kRgbChannels, rounded);
+    }
   }
+}
 
-  char* bytes_data = NULL;
-  ssize_t data_length;
-  if (PyBytes_AsStringAndSize(data, &bytes_data, &data_length) < 0) {
-    PyErr_SetString(PyExc_TypeError, "Couldn't get mask data");
-    return 0;
+// Works on kLanes channel values of a row at once. Unlike the scalar code,
+// this also blurs the (unused) alpha channel.
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void BlurColumnsSimd(Frame<uint16_t>& base,
+                                           const BoxKernel& kernel,
+                                           int32_t x_begin, int32_t x_end) {
+  typedef Vectors<kLanes> V;
+  const int32_t half_box = kernel.half_box;
+  const float scalar_box_factor = kernel.box_factor;
+  typename V::F box_factor;
+  Splat(box_factor, scalar_box_factor);
+  uint16_t* const result = base.data;
+  const int32_t base_stride = base.width * kRgbChannels;
+  const int32_t begin = x_begin * kRgbChannels;
+  const int32_t end = x_end * kRgbChannels;
+  const int32_t vector_end = begin + (end - begin) / kLanes * kLanes;
+
+  std::fill(result + begin, result + end, 0);
+  // Compute whole kernel for topmost pixel
+  for (int32_t y = -half_box; y <= half_box; ++y) {
+    const uint16_t* wrapped_row =
+        result + modulo(y, base.height) * base_stride;
+    int32_t i = begin;
+    for (; i < vector_end; i += kLanes) {
+      typename V::I sum, value;
+      LoadU16<kLanes>(sum, result + i);
+      LoadU16<kLanes>(value, wrapped_row + i);
+      typename V::I rounded;
+      RoundHalf<kLanes>(rounded, box_factor * __builtin_convertvector(
+                                                  value, typename V::F));
+      sum += rounded;
+      Store(result + i, __builtin_convertvector(sum, typename V::U16));
+    }
+    for (; i < end; ++i) {
+      result[i] += round_half(scalar_box_factor * wrapped_row[i]);
+    }
   }
 
-  frame.data = std::make_unique<bool1x8[]>(data_length);
-  memcpy(frame.data.get(), bytes_data, data_length);
-  *reinterpret_cast<Frame<bool1x8>*>(frame_addr) = std::move(frame);
-  return 1;
+  // For the rest of the columns, just compute deltas from previous pixel
+  for (int32_t y = 1; y < base.height; ++y) {
+    uint16_t* const row = result + y * base_stride;
+    const uint16_t* const last_row = row - base_stride;
+    const uint16_t* const min_row =
+        result + modulo(y - half_box - 1, base.height) * base_stride;
+    const uint16_t* const max_row =
+        result + modulo(y + half_box + 1, base.height) * base_stride;
+    int32_t i = begin;
+    for (; i < vector_end; i += kLanes) {
+      typename V::I last, min, max;
+      LoadU16<kLanes>(last, last_row + i);
+      LoadU16<kLanes>(min, min_row + i);
+      LoadU16<kLanes>(max, max_row + i);
+      typename V::F sum =
+          __builtin_convertvector(last, typename V::F) -
+          box_factor * __builtin_convertvector(min, typename V::F) +
+          box_factor * __builtin_convertvector(max, typename V::F);
+      typename V::I rounded;
+      RoundHalf<kLanes>(rounded, sum);
+      StoreU16<kLanes>(row + i, rounded);
+    }
+    for (; i < end; ++i) {
+      row[i] = clampint<uint16_t>(
+          round_half(last_row[i] - scalar_box_factor * min_row[i] +
+                     scalar_box_factor * max_row[i]));
+    }
+  }
 }
 
-Frame<float> BitmapToFloatMap(const Frame<bool1x8>& bitmap) {
-  Frame<float> float_map = {
-      bitmap.width, bitmap.height,
-      std::make_unique<float[]>(bitmap.width * bitmap.height)};
-  for(int32_t y = 0; y < bitmap.height; ++y) {
-    for (int32_t x = 0; x < bitmap.width; ++x) {
-      int32_t byte_x = x / 8;
-      int32_t bit_x = x % 8;
-      bool value =
-          (bitmap.data.get()[y * bitmap.stride + byte_x] >> bit_x) & 0x1;
-      float_map.data.get()[y * bitmap.width + x] = static_cast<float>(value);
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void BlurMaskColumnsSimd(Frame<float>& mask,
+                                               const BoxKernel& kernel,
+                                               int32_t x_begin,
+                                               int32_t x_end) {
+  typedef Vectors<kLanes> V;
+  const int32_t half_box = kernel.half_box;
+  const float scalar_box_factor = kernel.box_factor;
+  typename V::F box_factor, zero, one;
+  Splat(box_factor, scalar_box_factor);
+  Splat(zero, 0.0f);
+  Splat(one, 1.0f);
+  float* const result = mask.data;
+  const int32_t mask_stride = mask.width;
+  const int32_t vector_end = x_begin + (x_end - x_begin) / kLanes * kLanes;
+
+  std::fill(result + x_begin, result + x_end, 0.0f);
+  // Compute whole kernel for topmost pixel
+  for (int32_t y = -half_box; y <= half_box; ++y) {
+    // Use |y| to avoid weird "blur bleed" from the bottom of the mask to
+    // the top
+    const float* wrapped_row =
+        result + modulo(std::abs(y), mask.height) * mask_stride;
+    int32_t x = x_begin;
+    for (; x < vector_end; x += kLanes) {
+      typename V::F sum, value;
+      Load(sum, result + x);
+      Load(value, wrapped_row + x);
+      sum += box_factor * value;
+      Store(result + x, sum);
+    }
+    for (; x < x_end; ++x) {
+      result[x] += scalar_box_factor * wrapped_row[x];
+    }
+  }
+
+  // For the rest of the columns, just compute deltas from previous pixel
+  for (int32_t y = 1; y < mask.height; ++y) {
+    float* const row = result + y * mask_stride;
+    const float* const last_row = row - mask_stride;
+    const float* const min_row =
+        result + modulo(y - half_box - 1, mask.height) * mask_stride;
+    const float* const max_row =
+        result + modulo(y + half_box + 1, mask.height) * mask_stride;
+    int32_t x = x_begin;
+    for (; x < vector_end; x += kLanes) {
+      typename V::F last, min, max;
+      Load(last, last_row + x);
+      Load(min, min_row + x);
+      Load(max, max_row + x);
+      // Same operand order as zero_one()
+      typename V::F value = last - box_factor * min + box_factor * max;
+      value = one < value ? one : value;
+      value = zero < value ? value : zero;
+      Store(row + x, value);
+    }
+    for (; x < x_end; ++x) {
+      row[x] = zero_one(last_row[x] - scalar_box_factor * min_row[x] +
+                        scalar_box_factor * max_row[x]);
     }
   }
-  return float_map;
 }
 
-PyObject* PyEffectsBlur(PyObject* self, PyObject* args) {
-  Frame<uint8_t> frame;
-  Frame<bool1x8> mask;
-  if (!PyArg_ParseTuple(args, "O&O&", ConvertBytes, &frame, ConvertMask,
-                        &mask)) {
-    return nullptr;
+// The compiler vectorizes this loop well by itself (unpacking 16 bytes at a
+// time, which the vector extensions don't express), so the SIMD versions are
+// just this loop built for each instruction set
+EFFECTS_ALWAYS_INLINE void BlendRowSimd(const uint8_t* frame,
+                                        const uint8_t* background,
+                                        const float* mask, int32_t n_elements,
+                                        uint8_t* out) {
+  for (int32_t i = 0; i < n_elements; ++i) {
+    out[i] = clampint<uint8_t>(background[i] +
+                               (frame[i] - background[i]) * mask[i]);
   }
+}
 
-  int32_t downsampled_width = frame.width / kDownsampleFactor;
-  int32_t downsampled_height = frame.height / kDownsampleFactor;
-  int32_t n_elements = downsampled_width * downsampled_height * kRgbChannels;
+// Reads a pixel of `pixel_size` bytes as a 32-bit value, first byte lowest
+EFFECTS_ALWAYS_INLINE int32_t LoadPixel(const uint8_t* pixel,
+                                        int32_t pixel_size) {
+  if (pixel_size == 4) {
+    uint32_t value;
+    std::memcpy(&value, pixel, sizeof(value));
+    return static_cast<int32_t>(value);
+  }
+  return pixel[0] | (pixel[1] << 8) | (pixel[2] << 16);
+}
 
-  Frame<uint16_t> frame16{downsampled_width, downsampled_height,
-                          std::make_unique<uint16_t[]>(n_elements)};
-  // Scale up to 16 bit and downsample by kDownsampleFactor.
-  //
-  // We convert to 16 bit to avoid artifacts from the blur technique we use,
-  // which assumes that summing over the blur kernel on successive values is
-  // equivalent to adding/subtracting at the edges. This is generally true, but
-  // the optimized version can drift when the sum is rounded to 8-bit values.
-  //
-  // Downsampling speeds the whole thing up without losing much quality, as
-  // mentioned above.
-  for (int32_t y = 0; y < frame.height; ++y) {
-    for (int32_t x = 0; x < frame.width; ++x) {
-      int32_t i = y * frame.width * kRgbChannels + x * kRgbChannels;
-      int32_t ihalf = (y / kDownsampleFactor) * frame16.width * kRgbChannels +
-                      (x / kDownsampleFactor) * kRgbChannels;
-      frame16.data[ihalf + 0] = frame.data[i + 0] << 8;
-      frame16.data[ihalf + 1] = frame.data[i + 1] << 8;
-      frame16.data[ihalf + 2] = frame.data[i + 2] << 8;
+// Blends one channel of kLanes pixels, read from bits `frame_shift` and
+// `background_shift` of the packed pixels, into bits `out_shift` of `out`
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void BlendChannel(
+    typename Vectors<kLanes>::I& out,
+    const typename Vectors<kLanes>::I& frame_pixels,
+    const typename Vectors<kLanes>::I& background_pixels,
+    const typename Vectors<kLanes>::F& mask_values, int32_t frame_shift,
+    int32_t background_shift, int32_t out_shift) {
+  typedef typename Vectors<kLanes>::I I;
+  typedef typename Vectors<kLanes>::F F;
+  I zero, max;
+  Splat(zero, 0);
+  Splat(max, 255);
+  const I frame_values = (frame_pixels >> frame_shift) & max;
+  const I background_values = (background_pixels >> background_shift) & max;
+  I mixed = __builtin_convertvector(
+      __builtin_convertvector(background_values, F) +
+          __builtin_convertvector(frame_values - background_values, F) *
+              mask_values,
+      I);
+  mixed = mixed < zero ? zero : mixed;
+  mixed = mixed > max ? max : mixed;
+  out |= mixed << out_shift;
+}
+
+// Works on kLanes pixels at once, each packed into a 32-bit lane, so that the
+// RGBA output of a vector is a single store
+template <int kLanes>
+EFFECTS_ALWAYS_INLINE void BackgroundMaskRowsSimd(
+    const Image& frame, const Frame<float>& mask, const Image& background,
+    const SamplingTables& tables, MaskFilter mask_filter, uint8_t* out,
+    int32_t y_begin, int32_t y_end) {
+  typedef Vectors<kLanes> V;
+  const PixelLayout& frame_layout = *frame.layout;
+  const PixelLayout& background_layout = *background.layout;
+  const AxisSampling& columns = tables.columns;
+  const AxisSampling& rows = tables.rows;
+  const int32_t frame_pixel_size = frame_layout.pixel_size;
+  const int32_t background_pixel_size = background_layout.pixel_size;
+  // Whether the background pixels of a vector are next to each other
+  const bool background_contiguous =
+      tables.background_prescaled && background_pixel_size == 4;
+
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    const uint8_t* frame_row = frame.Row(y);
+    const uint8_t* background_row = background.Row(rows.background[y]);
+    const float* mask_row = mask.data + rows.mask[y] * mask.width;
+    const float* mask_row_low = mask.data + rows.mask_low[y] * mask.width;
+    const float* mask_row_high = mask.data + rows.mask_high[y] * mask.width;
+    const float mask_weight_y = rows.mask_weight[y];
+    uint8_t* out_row = out + y * frame.width * kRgbChannels;
+
+    int32_t x = 0;
+    for (; x + kLanes <= frame.width; x += kLanes) {
+      typename V::I frame_pixels, background_pixels;
+      if (frame_pixel_size == 4) {
+        Load(frame_pixels, frame_row + x * 4);
+      } else {
+        for (int32_t lane = 0; lane < kLanes; ++lane) {
+          frame_pixels[lane] = LoadPixel(
+              frame_row + (x + lane) * frame_pixel_size, frame_pixel_size);
+        }
+      }
+      if (background_contiguous) {
+        Load(background_pixels, background_row + x * 4);
+      } else {
+        for (int32_t lane = 0; lane < kLanes; ++lane) {
+          background_pixels[lane] = LoadPixel(
+              background_row +
+                  columns.background[x + lane] * background_pixel_size,
+              background_pixel_size);
+        }
+      }
+
+      // Same sampling arithmetic as BackgroundMaskRows
+      typename V::F mask_values;
+      if (mask_filter == MaskFilter::kBilinear) {
+        typename V::F top_low, top_high, bottom_low, bottom_high, weight_x,
+            weight_y;
+        for (int32_t lane = 0; lane < kLanes; ++lane) {
+          const int32_t low = columns.mask_low[x + lane];
+          const int32_t high = columns.mask_high[x + lane];
+          top_low[lane] = mask_row_low[low];
+          top_high[lane] = mask_row_low[high];
+          bottom_low[lane] = mask_row_high[low];
+          bottom_high[lane] = mask_row_high[high];
+        }
+        Load(weight_x, columns.mask_weight.data() + x);
+        Splat(weight_y, mask_weight_y);
+        typename V::F top = top_low + (top_high - top_low) * weight_x;
+        typename V::F bottom =
+            bottom_low + (bottom_high - bottom_low) * weight_x;
+        mask_values = top + (bottom - top) * weight_y;
+      } else {
+        for (int32_t lane = 0; lane < kLanes; ++lane) {
+          mask_values[lane] = mask_row[columns.mask[x + lane]];
+        }
+      }
+
+      // Alpha stays 0
+      typename V::I result;
+      Splat(result, 0);
+      BlendChannel<kLanes>(result, frame_pixels, background_pixels,
+                           mask_values, 8 * frame_layout.r,
+                           8 * background_layout.r, 0);
+      BlendChannel<kLanes>(result, frame_pixels, background_pixels,
+                           mask_values, 8 * frame_layout.g,
+                           8 * background_layout.g, 8);
+      BlendChannel<kLanes>(result, frame_pixels, background_pixels,
+                           mask_values, 8 * frame_layout.b,
+                           8 * background_layout.b, 16);
+      Store(out_row + x * kRgbChannels, result);
+    }
+
+    // The pixels left over at the end of the row
+    for (; x < frame.width; ++x) {
+      float mask_val;
+      if (mask_filter == MaskFilter::kBilinear) {
+        const int32_t low = columns.mask_low[x];
+        const int32_t high = columns.mask_high[x];
+        const float weight_x = columns.mask_weight[x];
+        float top = mask_row_low[low] +
+                    (mask_row_low[high] - mask_row_low[low]) * weight_x;
+        float bottom = mask_row_high[low] +
+                       (mask_row_high[high] - mask_row_high[low]) * weight_x;
+        mask_val = top + (bottom - top) * mask_weight_y;
+      } else {
+        mask_val = mask_row[columns.mask[x]];
+      }
+      const uint8_t* bg_color =
+          background_row + columns.background[x] * background_pixel_size;
+      const uint8_t* frame_color = frame_row + x * frame_pixel_size;
+      int32_t frame_r = frame_color[frame_layout.r];
+      int32_t frame_g = frame_color[frame_layout.g];
+      int32_t frame_b = frame_color[frame_layout.b];
+      int32_t bg_r = bg_color[background_layout.r];
+      int32_t bg_g = bg_color[background_layout.g];
+      int32_t bg_b = bg_color[background_layout.b];
+      out_row[x * kRgbChannels + 0] =
+          clampint<uint8_t>(bg_r + (frame_r - bg_r) * mask_val);
+      out_row[x * kRgbChannels + 1] =
+          clampint<uint8_t>(bg_g + (frame_g - bg_g) * mask_val);
+      out_row[x * kRgbChannels + 2] =
+          clampint<uint8_t>(bg_b + (frame_b - bg_b) * mask_val);
+      out_row[x * kRgbChannels + 3] = 0;
     }
   }
-  Blur(frame16);
+}
 
-  // Scale back down to 8 bit
-  Frame<uint8_t> background = {frame16.width, frame16.height,
-                               std::make_unique<uint8_t[]>(n_elements)};
+// A set of kernels for one instruction set
+struct Kernels final {
+  const char* isa;
+  void (*bitmap_to_float_rows)(const Frame<const bool1x8>& bitmap,
+                               Frame<float>& float_map, int32_t y_begin,
+                               int32_t y_end);
+  void (*blur_rows)(Frame<uint16_t>& base, const BoxKernel& kernel,
+                    int32_t y_begin, int32_t y_end);
+  void (*blur_columns)(Frame<uint16_t>& base, const BoxKernel& kernel,
+                       int32_t x_begin, int32_t x_end);
+  void (*blur_mask_columns)(Frame<float>& mask, const BoxKernel& kernel,
+                            int32_t x_begin, int32_t x_end);
+  void (*background_mask_rows)(const Image& frame, const Frame<float>& mask,
+                               const Image& background,
+                               const SamplingTables& tables,
+                               MaskFilter mask_filter, uint8_t* out,
+                               int32_t y_begin, int32_t y_end);
+  void (*blend_row)(const uint8_t* frame, const uint8_t* background,
+                    const float* mask, int32_t n_elements, uint8_t* out);
+};
+
+constexpr Kernels kScalarKernels = {
+    "scalar",        BitmapToFloatRows,        BlurRows, BlurColumns,
+    BlurMaskColumns, BackgroundMaskRowsScalar, BlendRow};
+
+// Defines `kernels`, the SIMD kernels compiled with `attributes` (e.g. a
+// target attribute) and vectors of `lanes` 32-bit values, in namespace `ns`
+#define EFFECTS_SIMD_KERNELS(ns, isa_name, attributes, lanes)                 \
+  namespace ns {                                                             \
+  attributes void BitmapToFloatRows(const Frame<const bool1x8>& bitmap,      \
+                                    Frame<float>& float_map, int32_t y_begin, \
+                                    int32_t y_end) {                         \
+    BitmapToFloatRowsSimd<lanes>(bitmap, float_map, y_begin, y_end);         \
+  }                                                                          \
+  attributes void BlurRows(Frame<uint16_t>& base, const BoxKernel& kernel,   \
+                           int32_t y_begin, int32_t y_end) {                 \
+    BlurRowsSimd(base, kernel, y_begin, y_end);                              \
+  }                                                                          \
+  attributes void BlurColumns(Frame<uint16_t>& base, const BoxKernel& kernel, \
+                              int32_t x_begin, int32_t x_end) {              \
+    BlurColumnsSimd<lanes>(base, kernel, x_begin, x_end);                    \
+  }                                                                          \
+  attributes void BlurMaskColumns(Frame<float>& mask, const BoxKernel& kernel, \
+                                  int32_t x_begin, int32_t x_end) {          \
+    BlurMaskColumnsSimd<lanes>(mask, kernel, x_begin, x_end);                \
+  }                                                                          \
+  attributes void BackgroundMaskRows(                                        \
+      const Image& frame, const Frame<float>& mask, const Image& background,  \
+      const SamplingTables& tables, MaskFilter mask_filter, uint8_t* out,    \
+      int32_t y_begin, int32_t y_end) {                                      \
+    BackgroundMaskRowsSimd<lanes>(frame, mask, background, tables,           \
+                                  mask_filter, out, y_begin, y_end);         \
+  }                                                                          \
+  attributes void BlendRow(const uint8_t* frame, const uint8_t* background,  \
+                           const float* mask, int32_t n_elements,           \
+                           uint8_t* out) {                                   \
+    BlendRowSimd(frame, background, mask, n_elements, out);                  \
+  }                                                                          \
+  constexpr Kernels kernels = {isa_name,        BitmapToFloatRows,           \
+                               BlurRows,        BlurColumns,                 \
+                               BlurMaskColumns, BackgroundMaskRows,          \
+                               BlendRow};                                    \
+  }
+
+#ifdef EFFECTS_X86
+EFFECTS_SIMD_KERNELS(sse41, "sse4.1", __attribute__((target("sse4.1"))), 4)
+EFFECTS_SIMD_KERNELS(avx2, "avx2", __attribute__((target("avx2"))), 8)
+#endif
+#ifdef EFFECTS_NEON
+EFFECTS_SIMD_KERNELS(neon, "neon", , 4)
+#endif
+
+// Every kernel set this build has, slowest first
+const Kernels* const kAllKernels[] = {
+    &kScalarKernels,
+#ifdef EFFECTS_X86
+    &sse41::kernels,
+    &avx2::kernels,
+#endif
+#ifdef EFFECTS_NEON
+    &neon::kernels,
+#endif
+};
 
-  for (int32_t i = 0; i < frame16.width * frame16.height * kRgbChannels; ++i) {
-    background.data[i] = frame16.data[i] >> 8;
+// Whether this CPU can run the given kernels
+bool IsSupported(const Kernels& kernels) {
+#ifdef EFFECTS_X86
+  __builtin_cpu_init();
+  if (&kernels == &sse41::kernels) {
+    return __builtin_cpu_supports("sse4.1");
+  }
+  if (&kernels == &avx2::kernels) {
+    return __builtin_cpu_supports("avx2");
   }
+#endif
+  return true;
+}
 
-  Frame<float> blurred_mask = BitmapToFloatMap(mask);
-  BlurMask(blurred_mask);
-  BackgroundMask(frame, blurred_mask, background);
+// The kernels the effects use; the fastest supported set unless changed with
+// effects.set_isa()
+std::atomic<const Kernels*> active_kernels{&kScalarKernels};
 
-  PyObject* ret =
-      PyBytes_FromStringAndSize(reinterpret_cast<const char*>(frame.data.get()),
-                                frame.width * frame.height * 4);
-  return ret;
+void SelectFastestKernels() {
+  for (const Kernels* kernels : kAllKernels) {
+    if (IsSupported(*kernels)) {
+      active_kernels = kernels;
+    }
+  }
 }
 
-PyObject* PyEffectsBackgroundMask(PyObject* self, PyObject* args) {
-  Frame<uint8_t> frame;
-  Frame<bool1x8> mask;
-  Frame<uint8_t> background;
-  if (!PyArg_ParseTuple(args, "O&O&O&", ConvertBytes, &frame, ConvertMask,
-                        &mask, ConvertBytes, &background)) {
-    return nullptr;
+// A simple Gaussian-approximation blur. Blur parameters defined above.
+// Arguments:
+//  - `base`: an RGBA image with 16-bit channels
+//  - `params`: `blur_iterations` and `box_size` are used
+//  - `kernels`: the implementation of each pass to use
+//  - `threads`: how many threads to split each pass across. Rows (and
+//    columns) are blurred independently of one another, so the result does not
+//    depend on the number of threads.
+void Blur(Frame<uint16_t>& base, const EffectParams& params,
+          const Kernels& kernels, int32_t threads) {
+  const BoxKernel kernel(params.box_size);
+  for (int32_t iteration = 0; iteration < params.blur_iterations;
+       ++iteration) {
+    ParallelFor(base.height, threads, [&](int32_t begin, int32_t end) {
+      kernels.blur_rows(base, kernel, begin, end);
+    });
+    ParallelFor(base.width, threads, [&](int32_t begin, int32_t end) {
+      kernels.blur_columns(base, kernel, begin, end);
+    });
   }
+}
 
-  Frame<float> blurred_mask = BitmapToFloatMap(mask);
-  BlurMask(blurred_mask);
-  BackgroundMask(frame, blurred_mask, background);
 
-  PyObject* ret =
-      PyBytes_FromStringAndSize(reinterpret_cast<const char*>(frame.data.get()),
-                                frame.width * frame.height * 4);
-  return ret;
+// A lot like blur, but with some extra simplifications that we can make thanks
+// to the fact that it's only got one channel
+// Arguments:
+//  - `mask`: a 2D float map
+//  - `params`: `mask_blur_iterations` and `mask_box_size` are used
+//  - `kernels`: the implementation of each pass to use
+//  - `threads`: how many threads to split each pass across
+void BlurMask(Frame<float>& mask, const EffectParams& params,
+              const Kernels& kernels, int32_t threads) {
+  const BoxKernel kernel(params.mask_box_size);
+  for (int32_t iteration = 0; iteration < params.mask_blur_iterations;
+       ++iteration) {
+    ParallelFor(mask.height, threads, [&](int32_t begin, int32_t end) {
+      BlurMaskRows(mask, kernel, begin, end);
+    });
+    ParallelFor(mask.width, threads, [&](int32_t begin, int32_t end) {
+      kernels.blur_mask_columns(mask, kernel, begin, end);
+    });
+  }
 }
 
-PyMethodDef Methods[] = {
-    {"blur", PyEffectsBlur, METH_VARARGS, "Box blur the image"},
-    {"background_mask", PyEffectsBackgroundMask, METH_VARARGS,
-     "Replace background"},
-    {nullptr, nullptr, 0, nullptr}};
 
-PyModuleDef moduledef = {PyModuleDef_HEAD_INIT, "effects", nullptr, -1,
-                         Methods};
+// Blits `frame` to `background`, using `mask` as an opacity map
+// Arguments:
+//  - `frame`: an 8-bit image
+//  - `mask`: a 2D float-map image
+//  - `background`: an 8-bit image
+//  - `background_prescaled`: whether `background` has already been resampled
+//    to the size of `frame` (see BackgroundImage)
+//  - `out`: where to write the RGBA result, the same size as `frame`. Each
+//    pixel is read before it is written, so this may be `frame` itself if its
+//    pixels are 4 bytes and its rows are not padded.
+//  - `mask_filter`: how to scale `mask` up to the size of `frame`
+//  - `kernels`: the implementation of the blend to use
+//  - `threads`: how many threads to split the rows of `frame` across
+void BackgroundMask(const Image& frame, const Frame<float>& mask,
+                    const Image& background, bool background_prescaled,
+                    uint8_t* out, MaskFilter mask_filter,
+                    const Kernels& kernels, int32_t threads) {
+  std::shared_ptr<const SamplingTables> tables =
+      GetSamplingTables(frame, mask, background, background_prescaled);
+  ParallelFor(frame.height, threads, [&](int32_t begin, int32_t end) {
+    kernels.background_mask_rows(frame, mask, background, *tables,
+                                 mask_filter, out, begin, end);
+  });
+}
 
-}  // namespace
 
-extern "C" PyMODINIT_FUNC PyInit_effects(void) {
-  return PyModule_Create(&moduledef);
+// Unpacks `bitmap` into a 0.0/1.0 float map in this thread's scratch memory
+Frame<float> BitmapToFloatMap(const Frame<const bool1x8>& bitmap,
+                              const Kernels& kernels, int32_t threads) {
+  static thread_local ScratchBuffer<float> scratch;
+  Frame<float> float_map = {
+      bitmap.width, bitmap.height,
+      scratch.Get(static_cast<size_t>(bitmap.width) * bitmap.height)};
+  ParallelFor(bitmap.height, threads, [&](int32_t begin, int32_t end) {
+    kernels.bitmap_to_float_rows(bitmap, float_map, begin, end);
+  });
+  return float_map;
+}
+
+// Where BackgroundMaskPlane reads the background of a plane from: either a
+// plane of the same size and channels (`plane`), or the given `channels` of
+// an image in kPackedYuvLayout, resampled to the size of the plane (`packed`).
+struct PlaneBackground final {
+  Plane<const uint8_t> plane;
+  Image packed;
+  const int32_t* channels;
+};
+
+// Samples row `source_y` of `mask` at each column of a plane, as in
+// BackgroundMaskRows, repeating each value `kChannels` times. With
+// kBilinear, this is the horizontal half of the interpolation.
+template <MaskFilter kMaskFilter, int32_t kChannels>
+void SampleMaskRow(const Frame<float>& mask, int32_t source_y,
+                   const AxisSampling& columns, int32_t width, float* out) {
+  const float* mask_row = mask.data + source_y * mask.width;
+  for (int32_t x = 0; x < width; ++x) {
+    float mask_val;
+    if (kMaskFilter == MaskFilter::kBilinear) {
+      const int32_t low = columns.mask_low[x];
+      const int32_t high = columns.mask_high[x];
+      mask_val = mask_row[low] +
+                 (mask_row[high] - mask_row[low]) * columns.mask_weight[x];
+    } else {
+      mask_val = mask_row[columns.mask[x]];
+    }
+    for (int32_t channel = 0; channel < kChannels; ++channel) {
+      out[x * kChannels + channel] = mask_val;
+    }
+  }
+}
+
+// Rows [y_begin, y_end) of BackgroundMaskPlane, with `kChannels` values per
+// pixel of `plane`.
+//
+// Neighbouring rows of a plane mostly sample the same rows of the (much
+// smaller) mask, so each sampled mask row is kept until a row needs another.
+template <MaskFilter kMaskFilter, int32_t kChannels>
+void BackgroundMaskPlaneRows(const Plane<const uint8_t>& plane,
+                             const Frame<float>& mask,
+                             const PlaneBackground& background,
+                             const SamplingTables& tables,
+                             const Kernels& kernels, const Plane<uint8_t>& out,
+                             int32_t y_begin, int32_t y_end) {
+  static thread_local ScratchBuffer<float> mask_scratch;
+  static thread_local ScratchBuffer<uint8_t> background_scratch;
+  const int32_t n_elements = plane.width * kChannels;
+  float* const scratch = mask_scratch.Get(3 * n_elements);
+  float* mask_values = scratch;
+  // Sampled mask rows, and which rows of the mask they are
+  float* low_values = scratch + n_elements;
+  float* high_values = scratch + 2 * n_elements;
+  int32_t low_row = -1, high_row = -1;
+  uint8_t* background_values = background_scratch.Get(n_elements);
+  const AxisSampling& columns = tables.columns;
+  const AxisSampling& rows = tables.rows;
+
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    if (kMaskFilter == MaskFilter::kBilinear) {
+      if (rows.mask_low[y] == high_row) {
+        std::swap(low_values, high_values);
+        std::swap(low_row, high_row);
+      }
+      if (rows.mask_low[y] != low_row) {
+        low_row = rows.mask_low[y];
+        SampleMaskRow<kMaskFilter, kChannels>(mask, low_row, columns,
+                                              plane.width, low_values);
+      }
+      if (rows.mask_high[y] != high_row) {
+        high_row = rows.mask_high[y];
+        SampleMaskRow<kMaskFilter, kChannels>(mask, high_row, columns,
+                                              plane.width, high_values);
+      }
+      const float mask_weight_y = rows.mask_weight[y];
+      for (int32_t i = 0; i < n_elements; ++i) {
+        mask_values[i] =
+            low_values[i] + (high_values[i] - low_values[i]) * mask_weight_y;
+      }
+    } else if (rows.mask[y] != low_row) {
+      low_row = rows.mask[y];
+      SampleMaskRow<kMaskFilter, kChannels>(mask, low_row, columns,
+                                            plane.width, mask_values);
+    }
+
+    const uint8_t* background_row;
+    if (background.plane.data != nullptr) {
+      background_row = background.plane.Row(y);
+    } else {
+      const uint8_t* packed_row = background.packed.Row(rows.background[y]);
+      for (int32_t x = 0; x < plane.width; ++x) {
+        const uint8_t* bg_color =
+            packed_row + columns.background[x] * kRgbChannels;
+        for (int32_t channel = 0; channel < kChannels; ++channel) {
+          background_values[x * kChannels + channel] =
+              bg_color[background.channels[channel]];
+        }
+      }
+      background_row = background_values;
+    }
+
+    kernels.blend_row(plane.Row(y), background_row, mask_values, n_elements,
+                      out.Row(y));
+  }
+}
+
+
+// Blits one plane of a YUV frame to `background`, using `mask` as an opacity
+// map. The YUV counterpart of BackgroundMask.
+// Arguments:
+//  - `plane`: a luma or chroma plane
+//  - `mask`: a 2D float-map image
+//  - `background`: the background of the plane
+//  - `out`: where to write the result, a plane of the same size and channels
+//  - `mask_filter`: how to scale `mask` up to the size of `plane`
+//  - `kernels`: the implementation of the blend to use
+//  - `threads`: how many threads to split the rows of `plane` across
+void BackgroundMaskPlane(const Plane<const uint8_t>& plane,
+                         const Frame<float>& mask,
+                         const PlaneBackground& background,
+                         const Plane<uint8_t>& out, MaskFilter mask_filter,
+                         const Kernels& kernels, int32_t threads) {
+  // The sampling tables only look at the sizes of the images. A background
+  // plane is already the size of `plane`.
+  const Image plane_shape = {plane.width, plane.height, nullptr, 0, nullptr};
+  const bool prescaled = background.plane.data != nullptr;
+  std::shared_ptr<const SamplingTables> tables = GetSamplingTables(
+      plane_shape, mask, prescaled ? plane_shape : background.packed,
+      prescaled);
+  ParallelFor(plane.height, threads, [&](int32_t begin, int32_t end) {
+    const bool bilinear = mask_filter == MaskFilter::kBilinear;
+    if (plane.channels == 2 && bilinear) {
+      BackgroundMaskPlaneRows<MaskFilter::kBilinear, 2>(
+          plane, mask, background, *tables, kernels, out, begin, end);
+    } else if (plane.channels == 2) {
+      BackgroundMaskPlaneRows<MaskFilter::kNearest, 2>(
+          plane, mask, background, *tables, kernels, out, begin, end);
+    } else if (bilinear) {
+      BackgroundMaskPlaneRows<MaskFilter::kBilinear, 1>(
+          plane, mask, background, *tables, kernels, out, begin, end);
+    } else {
+      BackgroundMaskPlaneRows<MaskFilter::kNearest, 1>(
+          plane, mask, background, *tables, kernels, out, begin, end);
+    }
+  });
+}
+
+
+// Blits a YUV `frame` to a background plane by plane. The mask is applied at
+// full resolution to the luma plane, and scaled to the chroma resolution for
+// the chroma planes.
+// Arguments:
+//  - `frame`: a YUV 4:2:0 image
+//  - `mask`: a 2D float-map image
+//  - `background`: either a YUV image the size and layout of `frame`
+//    (`prescaled`), or an image in kPackedYuvLayout to resample (`packed`);
+//    the other is null
+//  - `out`: where to write the result, in the layout of `frame`
+//  - `mask_filter`: how to scale `mask` up to the size of each plane
+//  - `kernels`: the implementation of the blend to use
+//  - `threads`: how many threads to split the rows of each plane across
+void BackgroundMaskYuv(const YuvImage<const uint8_t>& frame,
+                       const Frame<float>& mask,
+                       const YuvImage<uint8_t>* prescaled,
+                       const Image* packed, const YuvImage<uint8_t>& out,
+                       MaskFilter mask_filter, const Kernels& kernels,
+                       int32_t threads) {
+  // Channels of a packed background for the luma plane, and for the first and
+  // second chroma planes (U and V, or UV)
+  static constexpr int32_t kLumaChannels[] = {0};
+  static constexpr int32_t kUChannels[] = {1, 2};
+  static constexpr int32_t kVChannels[] = {2};
+
+  for (int32_t i = 0; i < frame.layout->n_planes; ++i) {
+    PlaneBackground background = {};
+    if (prescaled != nullptr) {
+      const Plane<uint8_t> plane =
+          i == 0 ? prescaled->Luma() : prescaled->Chroma(i);
+      background.plane = {plane.width, plane.height, plane.channels,
+                          plane.data, plane.stride};
+    } else {
+      background.packed = *packed;
+      background.channels =
+          i == 0 ? kLumaChannels : i == 1 ? kUChannels : kVChannels;
+    }
+    BackgroundMaskPlane(i == 0 ? frame.Luma() : frame.Chroma(i), mask,
+                        background, i == 0 ? out.Luma() : out.Chroma(i),
+                        mask_filter, kernels, threads);
+  }
+}
+
+
+// A rectangle of pixels of a frame, [x_begin, x_end) x [y_begin, y_end)
+struct PixelRect final {
+  int32_t x_begin, y_begin, x_end, y_end;
+};
+
+// The pixels of `rect`, given in coordinates relative to the size of a
+// `width` x `height` frame, rounded outwards and clipped to the frame
+PixelRect ToPixelRect(double x, double y, double rect_width,
+                      double rect_height, int32_t width, int32_t height) {
+  auto clip = [](double value, int32_t size) {
+    return static_cast<int32_t>(
+        std::max(0.0, std::min(value, static_cast<double>(size))));
+  };
+  return {clip(std::floor(x * width), width),
+          clip(std::floor(y * height), height),
+          clip(std::ceil((x + rect_width) * width), width),
+          clip(std::ceil((y + rect_height) * height), height)};
+}
+
+// The rounded average of `count` values adding up to `sum`
+inline uint8_t RoundedMean(int64_t sum, int64_t count) {
+  return static_cast<uint8_t>((sum + count / 2) / count);
+}
+
+// Cell rows [cell_begin, cell_end) of PixelateRect
+void PixelateRows(uint8_t* data, Py_ssize_t stride, int32_t pixel_size,
+                  const PixelRect& rect, int32_t block_size,
+                  int32_t cell_begin, int32_t cell_end) {
+  for (int32_t cell_y = cell_begin; cell_y < cell_end; ++cell_y) {
+    const int32_t y_begin = std::max(rect.y_begin, cell_y * block_size);
+    const int32_t y_end = std::min(rect.y_end, (cell_y + 1) * block_size);
+    int32_t x_begin = rect.x_begin;
+    while (x_begin < rect.x_end) {
+      const int32_t x_end =
+          std::min(rect.x_end, (x_begin / block_size + 1) * block_size);
+      int64_t sums[4] = {0, 0, 0, 0};
+      for (int32_t y = y_begin; y < y_end; ++y) {
+        const uint8_t* row = data + y * stride;
+        for (int32_t x = x_begin; x < x_end; ++x) {
+          for (int32_t c = 0; c < pixel_size; ++c) {
+            sums[c] += row[x * pixel_size + c];
+          }
+        }
+      }
+      const int64_t count =
+          static_cast<int64_t>(x_end - x_begin) * (y_end - y_begin);
+      uint8_t mean[4];
+      for (int32_t c = 0; c < pixel_size; ++c) {
+        mean[c] = RoundedMean(sums[c], count);
+      }
+      for (int32_t y = y_begin; y < y_end; ++y) {
+        uint8_t* row = data + y * stride;
+        for (int32_t x = x_begin; x < x_end; ++x) {
+          std::memcpy(row + x * pixel_size, mean, pixel_size);
+        }
+      }
+      x_begin = x_end;
+    }
+  }
+}
+
+// Replaces each cell of a grid of `block_size` x `block_size` squares within
+// `rect` by its average color. The grid is aligned to the frame rather than
+// to `rect`, so that the blocks don't shimmer as a rectangle moves.
+// Arguments:
+//  - `data`, `stride`, `pixel_size`: the frame's pixels, all of whose bytes
+//    are averaged
+//  - `threads`: how many threads to split the rows of cells across
+void PixelateRect(uint8_t* data, Py_ssize_t stride, int32_t pixel_size,
+                  const PixelRect& rect, int32_t block_size,
+                  int32_t threads) {
+  const int32_t first_cell = rect.y_begin / block_size;
+  const int32_t end_cell = (rect.y_end - 1) / block_size + 1;
+  ParallelFor(end_cell - first_cell, threads, [&](int32_t begin,
+                                                   int32_t end) {
+    PixelateRows(data, stride, pixel_size, rect, block_size,
+                 first_cell + begin, first_cell + end);
+  });
+}
+
+// The largest box size redact() blurs with; see BoxDivider
+constexpr int32_t kMaxRedactBoxSize = (1 << 20) - 1;
+
+// Divides sums of `divisor` 8-bit values by `divisor`, rounding to nearest,
+// with a multiplication and a shift rather than a (much slower) division. The
+// result is exact for divisors up to kMaxRedactBoxSize: the error of the
+// multiplier times a sum of at most 256 * divisor stays under 1 / divisor.
+class BoxDivider final {
+ public:
+  explicit BoxDivider(int32_t divisor)
+      : half_(divisor / 2),
+        multiplier_((uint64_t{1} << kShift) / divisor + 1) {}
+
+  uint8_t operator()(uint32_t sum) const {
+    return static_cast<uint8_t>(((sum + half_) * multiplier_) >> kShift);
+  }
+
+ private:
+  static constexpr int kShift = 48;
+  uint64_t half_;
+  uint64_t multiplier_;
+};
+
+// Horizontal pass of BlurRect over rows [y_begin, y_end): box blurs rows of
+// `width` pixels from `source` into `dest`, repeating the edge pixels of each
+// row past its ends
+void BoxBlurRectRows(const uint8_t* source, Py_ssize_t source_stride,
+                     uint8_t* dest, Py_ssize_t dest_stride, int32_t width,
+                     int32_t pixel_size, int32_t half_box, int32_t y_begin,
+                     int32_t y_end) {
+  const BoxDivider divide(2 * half_box + 1);
+  for (int32_t y = y_begin; y < y_end; ++y) {
+    const uint8_t* in = source + y * source_stride;
+    uint8_t* out = dest + y * dest_stride;
+    uint32_t sums[4] = {0, 0, 0, 0};
+    for (int32_t x = -half_box; x <= half_box; ++x) {
+      const uint8_t* pixel =
+          in + std::max(0, std::min(x, width - 1)) * pixel_size;
+      for (int32_t c = 0; c < pixel_size; ++c) {
+        sums[c] += pixel[c];
+      }
+    }
+    for (int32_t x = 0; x < width; ++x) {
+      const uint8_t* added =
+          in + std::min(x + half_box + 1, width - 1) * pixel_size;
+      const uint8_t* removed = in + std::max(x - half_box, 0) * pixel_size;
+      for (int32_t c = 0; c < pixel_size; ++c) {
+        out[x * pixel_size + c] = divide(sums[c]);
+        sums[c] += added[c] - removed[c];
+      }
+    }
+  }
+}
+
+// Vertical pass of BlurRect over bytes [begin, end) of each row: box blurs
+// `height` rows from `source` into `dest`, repeating the top and bottom rows
+// past the ends. The running sums of a band of columns are updated a row at
+// a time, so that rows are read in order.
+void BoxBlurRectColumns(const uint8_t* source, Py_ssize_t source_stride,
+                        uint8_t* dest, Py_ssize_t dest_stride, int32_t height,
+                        int32_t half_box, int32_t begin, int32_t end) {
+  static thread_local ScratchBuffer<uint32_t> sums_scratch;
+  const BoxDivider divide(2 * half_box + 1);
+  uint32_t* sums = sums_scratch.Get(end - begin);
+  std::fill(sums, sums + (end - begin), 0);
+  for (int32_t y = -half_box; y <= half_box; ++y) {
+    const uint8_t* in =
+        source + std::max(0, std::min(y, height - 1)) * source_stride;
+    for (int32_t i = begin; i < end; ++i) {
+      sums[i - begin] += in[i];
+    }
+  }
+  for (int32_t y = 0; y < height; ++y) {
+    uint8_t* out = dest + y * dest_stride;
+    const uint8_t* added =
+        source + std::min(y + half_box + 1, height - 1) * source_stride;
+    const uint8_t* removed =
+        source + std::max(y - half_box, 0) * source_stride;
+    for (int32_t i = begin; i < end; ++i) {
+      out[i] = divide(sums[i - begin]);
+      sums[i - begin] += added[i] - removed[i];
+    }
+  }
+}
+
+// Box blurs `rect` using only the pixels inside it, so the work is
+// proportional to its area. Each pass rounds the exact average of the box to
+// 8 bits.
+// Arguments:
+//  - `data`, `stride`, `pixel_size`: the frame's pixels, all of whose bytes
+//    are blurred
+//  - `box_size`, `iterations`: the size of the box, and how many times to
+//    blur with it
+//  - `threads`: how many threads to split each pass across
+void BlurRect(uint8_t* data, Py_ssize_t stride, int32_t pixel_size,
+              const PixelRect& rect, int32_t box_size, int32_t iterations,
+              int32_t threads) {
+  static thread_local ScratchBuffer<uint8_t> scratch;
+  const int32_t width = rect.x_end - rect.x_begin;
+  const int32_t height = rect.y_end - rect.y_begin;
+  const int32_t row_size = width * pixel_size;
+  const int32_t half_box = box_size / 2;
+  uint8_t* origin = data + rect.y_begin * stride + rect.x_begin * pixel_size;
+  uint8_t* temp = scratch.Get(static_cast<size_t>(row_size) * height);
+  for (int32_t iteration = 0; iteration < iterations; ++iteration) {
+    ParallelFor(height, threads, [&](int32_t begin, int32_t end) {
+      BoxBlurRectRows(origin, stride, temp, row_size, width, pixel_size,
+                      half_box, begin, end);
+    });
+    ParallelFor(row_size, threads, [&](int32_t begin, int32_t end) {
+      BoxBlurRectColumns(temp, row_size, origin, stride, height, half_box,
+                         begin, end);
+    });
+  }
+}
+
+// Blurs a downsampled frame and scales it back down to 8 bits, returning an
+// image in this thread's scratch memory with the same channels as `frame16`
+// Arguments:
+//  - `frame16`: an image with 16-bit channels, laid out as RGBA
+//  - `layout`: the layout of the result; `kPixelLayouts[1]` (RGBA) or
+//    `kPackedYuvLayout`
+//  - `params`, `kernels`, `threads`: as for Blur
+Image BlurToBackground(Frame<uint16_t>& frame16, const PixelLayout& layout,
+                       const EffectParams& params, const Kernels& kernels,
+                       int32_t threads) {
+  static thread_local ScratchBuffer<uint8_t> background_scratch;
+
+  Blur(frame16, params, kernels, threads);
+
+  // Scale back down to 8 bit
+  const size_t n_elements =
+      static_cast<size_t>(frame16.width) * frame16.height * kRgbChannels;
+  uint8_t* background_data = background_scratch.Get(n_elements);
+  ParallelFor(frame16.height, threads, [&](int32_t begin, int32_t end) {
+    const int32_t row_elements = frame16.width * kRgbChannels;
+    for (int32_t i = begin * row_elements; i < end * row_elements; ++i) {
+      background_data[i] = frame16.data[i] >> 8;
+    }
+  });
+  return {frame16.width, frame16.height, background_data,
+          frame16.width * kRgbChannels, &layout};
+}
+
+// An RGBA image that owns its pixels
+struct OwnedImage final {
+  int32_t width, height;
+  std::unique_ptr<uint8_t[]> data;
+
+  OwnedImage(int32_t width, int32_t height)
+      : width(width),
+        height(height),
+        data(std::make_unique<uint8_t[]>(static_cast<size_t>(width) * height *
+                                         kRgbChannels)) {}
+
+  Image View() const {
+    return {width, height, data.get(), width * kRgbChannels,
+            &kPixelLayouts[1]};
+  }
+};
+
+// A YUV image in GStreamer's default layout that owns its pixels
+struct OwnedYuvImage final {
+  std::unique_ptr<uint8_t[]> data;
+  YuvImage<uint8_t> image;
+
+  OwnedYuvImage(const YuvLayout& layout, int32_t width, int32_t height) {
+    Py_ssize_t offsets[3];
+    const Py_ssize_t size =
+        DefaultYuvLayout(layout, width, height, image.strides, offsets);
+    data = std::make_unique<uint8_t[]>(size);
+    image.width = width;
+    image.height = height;
+    image.layout = &layout;
+    for (int32_t i = 0; i < 3; ++i) {
+      image.planes[i] = i < layout.n_planes ? data.get() + offsets[i] : nullptr;
+    }
+  }
+};
+
+// Converts an 8-bit RGB color to limited-range BT.601 YUV, as GStreamer's
+// videoconvert does by default for standard-definition video
+void RgbToYuv(int32_t r, int32_t g, int32_t b, uint8_t* yuv) {
+  yuv[0] = clampint<uint8_t>(((66 * r + 129 * g + 25 * b + 128) >> 8) + 16);
+  yuv[1] = clampint<uint8_t>(((-38 * r - 74 * g + 112 * b + 128) >> 8) + 128);
+  yuv[2] = clampint<uint8_t>(((112 * r - 94 * g - 18 * b + 128) >> 8) + 128);
+}
+
+// A backdrop for BackgroundMask that is reused from frame to frame. It is
+// converted to RGBA once, and resampled to the frame size only when that size
+// changes, rather than on every call.
+class BackgroundImage final {
+ public:
+  explicit BackgroundImage(const Image& source)
+      : source_(source.width, source.height) {
+    const PixelLayout& layout = *source.layout;
+    for (int32_t y = 0; y < source.height; ++y) {
+      const uint8_t* row = source.Row(y);
+      uint8_t* out_row = source_.data.get() + y * source.width * kRgbChannels;
+      for (int32_t x = 0; x < source.width; ++x) {
+        const uint8_t* pixel = row + x * layout.pixel_size;
+        out_row[x * kRgbChannels + 0] = pixel[layout.r];
+        out_row[x * kRgbChannels + 1] = pixel[layout.g];
+        out_row[x * kRgbChannels + 2] = pixel[layout.b];
+        out_row[x * kRgbChannels + 3] = 255;
+      }
+    }
+  }
+
+  const OwnedImage& source() const { return source_; }
+
+  // Returns the backdrop resampled (by nearest neighbour, like BackgroundMask)
+  // to `width` x `height`. Safe to call from several threads; the result stays
+  // valid even if another thread asks for a different size.
+  std::shared_ptr<const OwnedImage> ScaledTo(int32_t width, int32_t height,
+                                             int32_t threads) {
+    std::lock_guard<std::mutex> lock(mutex_);
+    if (scaled_ == nullptr || scaled_->width != width ||
+        scaled_->height != height) {
+      auto scaled = std::make_shared<OwnedImage>(width, height);
+      const uint32_t* source_data =
+          reinterpret_cast<const uint32_t*>(source_.data.get());
+      uint32_t* scaled_data = reinterpret_cast<uint32_t*>(scaled->data.get());
+      ParallelFor(height, threads, [&](int32_t begin, int32_t end) {
+        for (int32_t y = begin; y < end; ++y) {
+          float ny = static_cast<float>(y) / height;
+          int32_t source_y = ny * source_.height;
+          for (int32_t x = 0; x < width; ++x) {
+            float nx = static_cast<float>(x) / width;
+            int32_t source_x = nx * source_.width;
+            scaled_data[y * width + x] =
+                source_data[source_y * source_.width + source_x];
+          }
+        }
+      });
+      scaled_ = std::move(scaled);
+    }
+    return scaled_;
+  }
+
+  // Like ScaledTo, but converted to a YUV image in `layout`. Each chroma
+  // sample takes the color of the top left pixel it covers.
+  std::shared_ptr<const OwnedYuvImage> ScaledToYuv(const YuvLayout& layout,
+                                                   int32_t width,
+                                                   int32_t height,
+                                                   int32_t threads) {
+    std::shared_ptr<const OwnedImage> scaled =
+        ScaledTo(width, height, threads);
+    std::lock_guard<std::mutex> lock(mutex_);
+    if (scaled_yuv_source_ != scaled || scaled_yuv_->image.layout != &layout) {
+      auto yuv = std::make_shared<OwnedYuvImage>(layout, width, height);
+      const YuvImage<uint8_t>& image = yuv->image;
+      const uint8_t* rgba = scaled->data.get();
+      ParallelFor(height, threads, [&](int32_t begin, int32_t end) {
+        for (int32_t y = begin; y < end; ++y) {
+          const uint8_t* rgba_row = rgba + y * width * kRgbChannels;
+          uint8_t* luma_row = image.Luma().Row(y);
+          uint8_t yuv_pixel[3];
+          for (int32_t x = 0; x < width; ++x) {
+            const uint8_t* pixel = rgba_row + x * kRgbChannels;
+            RgbToYuv(pixel[0], pixel[1], pixel[2], yuv_pixel);
+            luma_row[x] = yuv_pixel[0];
+          }
+          if (y % 2 != 0) {
+            continue;
+          }
+          const Plane<uint8_t> u_plane = image.Chroma(1);
+          const Plane<uint8_t> v_plane =
+              image.Chroma(layout.chroma_channels == 2 ? 1 : 2);
+          uint8_t* u_row = u_plane.Row(y / 2);
+          uint8_t* v_row = v_plane.Row(y / 2) + (layout.chroma_channels - 1);
+          for (int32_t x = 0; x < width; x += 2) {
+            const uint8_t* pixel = rgba_row + x * kRgbChannels;
+            RgbToYuv(pixel[0], pixel[1], pixel[2], yuv_pixel);
+            u_row[x / 2 * u_plane.channels] = yuv_pixel[1];
+            v_row[x / 2 * v_plane.channels] = yuv_pixel[2];
+          }
+        }
+      });
+      scaled_yuv_ = std::move(yuv);
+      scaled_yuv_source_ = std::move(scaled);
+    }
+    return scaled_yuv_;
+  }
+
+  // The size of the last resampled copy, or 0x0 if there is none yet
+  void scaled_size(int32_t* width, int32_t* height) {
+    std::lock_guard<std::mutex> lock(mutex_);
+    *width = scaled_ == nullptr ? 0 : scaled_->width;
+    *height = scaled_ == nullptr ? 0 : scaled_->height;
+  }
+
+ private:
+  OwnedImage source_;
+  std::mutex mutex_;
+  std::shared_ptr<const OwnedImage> scaled_;
+  // The YUV version of `scaled_yuv_source_`, a copy that ScaledTo returned
+  std::shared_ptr<const OwnedYuvImage> scaled_yuv_;
+  std::shared_ptr<const OwnedImage> scaled_yuv_source_;
+};
+
+// Holds on to a Python buffer, keeping the memory behind it valid (and, for
+// a bytearray, its size fixed) until destruction. Destroy with the GIL held.
+// The buffer starts out zeroed and is only released if a successful parse or
+// PyObject_GetBuffer filled it in, so error paths never release garbage.
+class PyBufferHolder final {
+ public:
+  PyBufferHolder() : buffer_() {}
+  ~PyBufferHolder() {
+    if (buffer_.obj != nullptr) {
+      PyBuffer_Release(&buffer_);
+    }
+  }
+  PyBufferHolder(const PyBufferHolder&) = delete;
+  PyBufferHolder& operator=(const PyBufferHolder&) = delete;
+
+  Py_buffer* get() { return &buffer_; }
+  const Py_buffer* operator->() const { return &buffer_; }
+
+ private:
+  Py_buffer buffer_;
+};
+
+// The converted form of an image argument
+struct ImageArg final {
+  Image image;
+  PyBufferHolder buffer;
+};
+
+// The converted form of a YUV image argument
+struct YuvImageArg final {
+  YuvImage<const uint8_t> image;
+  PyBufferHolder buffer;
+};
+
+// The converted form of a mask argument
+struct MaskArg final {
+  Frame<const bool1x8> bitmap;
+  PyBufferHolder buffer;
+};
+
+// The converted form of the `out` argument. `data` stays null if none was
+// given.
+struct OutputArg final {
+  PyObject* obj = nullptr;
+  uint8_t* data = nullptr;
+  PyBufferHolder buffer;
+};
+
+// The Python type of effects.Background objects, created at module import
+PyTypeObject* background_type = nullptr;
+
+// An effects.Background object
+struct PyBackgroundObject {
+  PyObject_HEAD
+  BackgroundImage* background;
+};
+
+// The converted form of a background argument: either an image, or an
+// effects.Background (a borrowed reference, kept alive by the arguments)
+struct BackgroundArg final {
+  ImageArg image;
+  BackgroundImage* prepared = nullptr;
+};
+
+// Reads the optional per-plane `strides` or `offsets` of a frame into
+// `values`, keeping the defaults already there if `obj` is None
+bool GetPlaneValues(PyObject* obj, const char* name, int32_t n_planes,
+                    Py_ssize_t* values) {
+  if (obj == Py_None) {
+    return true;
+  }
+  PyObject* sequence = PySequence_Fast(obj, "");
+  if (sequence == nullptr || PySequence_Fast_GET_SIZE(sequence) != n_planes) {
+    Py_XDECREF(sequence);
+    PyErr_Format(PyExc_ValueError, "Frame %s must have %d items, one per plane",
+                 name, n_planes);
+    return false;
+  }
+  for (int32_t i = 0; i < n_planes; ++i) {
+    values[i] = PyLong_AsSsize_t(PySequence_Fast_GET_ITEM(sequence, i));
+    if (PyErr_Occurred()) {
+      Py_DECREF(sequence);
+      return false;
+    }
+  }
+  Py_DECREF(sequence);
+  return true;
+}
+
+// Shared by ConvertImage and ConvertWritableImage: parses `obj` into `arg`,
+// requiring the image data to be writable if `writable` is set
+int ParseImage(PyObject* obj, ImageArg& arg, bool writable) {
+  Image& image = arg.image;
+  const char* format_str;
+  PyObject* stride_obj = Py_None;
+  PyObject* offsets_obj = Py_None;
+  if (!PyArg_ParseTuple(obj, writable ? "s(ii)w*|OO" : "s(ii)y*|OO",
+                        &format_str, &image.width, &image.height,
+                        arg.buffer.get(), &stride_obj, &offsets_obj)) {
+    return 0;
+  }
+
+  image.layout = nullptr;
+  for (const PixelLayout& layout : kPixelLayouts) {
+    if (std::strcmp(format_str, layout.name) == 0) {
+      image.layout = &layout;
+    }
+  }
+  if (image.layout == nullptr) {
+    PyErr_Format(PyExc_TypeError,
+                 "Bad frame format %s! Expected RGB, RGBA, RGBx, BGRA or BGRx",
+                 format_str);
+    return 0;
+  }
+  if (image.width <= 0 || image.height <= 0) {
+    PyErr_SetString(PyExc_ValueError, "Frame size must be positive");
+    return 0;
+  }
+
+  const Py_ssize_t row_size =
+      static_cast<Py_ssize_t>(image.width) * image.layout->pixel_size;
+  image.stride = row_size;
+  if (stride_obj != Py_None) {
+    image.stride = PyLong_AsSsize_t(stride_obj);
+    if (PyErr_Occurred()) {
+      return 0;
+    }
+    if (image.stride < row_size) {
+      PyErr_SetString(PyExc_ValueError,
+                      "Frame stride is smaller than a row of pixels");
+      return 0;
+    }
+  }
+  Py_ssize_t offset = 0;
+  if (!GetPlaneValues(offsets_obj, "offsets", 1, &offset)) {
+    return 0;
+  }
+  if (offset < 0 ||
+      arg.buffer->len < offset + (image.height - 1) * image.stride + row_size) {
+    PyErr_SetString(PyExc_ValueError, "Frame data is smaller than its size");
+    return 0;
+  }
+  image.data = static_cast<const uint8_t*>(arg.buffer->buf) + offset;
+  return 1;
+}
+
+// Python argument conversion function
+// Takes a `PyObject*` assumed to be a `gst_pipeline.Frame` and converts it to
+// an `ImageArg`, which is assumed to be passed through the `void*` argument.
+// The image data may be any object supporting the buffer protocol (bytes,
+// bytearray, a memoryview of a mapped GStreamer buffer, a NumPy array...); it
+// is used in place rather than copied. An optional fourth item of the tuple
+// gives the number of bytes between the starts of successive rows, for images
+// with padded rows, and an optional fifth one a single-item sequence with the
+// byte offset of the image in the data.
+// Return value indicates to the CPython interpreter whether to call the
+// function again for cleanup (which we do not use here).
+// See https://docs.python.org/3/c-api/arg.html#other-objects for more
+// information on object conversion functions.
+int ConvertImage(PyObject* obj, void* arg_addr) {
+  return ParseImage(obj, *reinterpret_cast<ImageArg*>(arg_addr), false);
+}
+
+// Python argument conversion function
+// Like ConvertImage, but the image data must be writable (a bytearray, a
+// writable memoryview or NumPy array...), for effects that work in place.
+int ConvertWritableImage(PyObject* obj, void* arg_addr) {
+  return ParseImage(obj, *reinterpret_cast<ImageArg*>(arg_addr), true);
+}
+
+// Python argument conversion function
+// Takes a `PyObject*` assumed to be a `gst_pipeline.Frame` in one of
+// kYuvLayouts and converts it to a `YuvImageArg`, which is assumed to be
+// passed through the `void*` argument. Like ConvertImage, the data is used in
+// place. The optional fourth and fifth items of the tuple give the stride and
+// the byte offset of each plane; without them, the planes are expected in
+// GStreamer's default layout (see DefaultYuvLayout).
+int ConvertYuvImage(PyObject* obj, void* arg_addr) {
+  YuvImageArg& arg = *reinterpret_cast<YuvImageArg*>(arg_addr);
+  YuvImage<const uint8_t>& image = arg.image;
+  const char* format_str;
+  PyObject* strides_obj = Py_None;
+  PyObject* offsets_obj = Py_None;
+  if (!PyArg_ParseTuple(obj, "s(ii)y*|OO", &format_str, &image.width,
+                        &image.height, arg.buffer.get(), &strides_obj,
+                        &offsets_obj)) {
+    return 0;
+  }
+
+  image.layout = nullptr;
+  for (const YuvLayout& layout : kYuvLayouts) {
+    if (std::strcmp(format_str, layout.name) == 0) {
+      image.layout = &layout;
+    }
+  }
+  if (image.layout == nullptr) {
+    PyErr_Format(PyExc_TypeError, "Bad frame format %s! Expected I420 or NV12",
+                 format_str);
+    return 0;
+  }
+  if (image.width <= 0 || image.height <= 0) {
+    PyErr_SetString(PyExc_ValueError, "Frame size must be positive");
+    return 0;
+  }
+
+  const int32_t n_planes = image.layout->n_planes;
+  image.planes[2] = nullptr;
+  Py_ssize_t offsets[3];
+  DefaultYuvLayout(*image.layout, image.width, image.height, image.strides,
+                   offsets);
+  if (!GetPlaneValues(strides_obj, "strides", n_planes, image.strides) ||
+      !GetPlaneValues(offsets_obj, "offsets", n_planes, offsets)) {
+    return 0;
+  }
+  for (int32_t i = 0; i < n_planes; ++i) {
+    const Plane<const uint8_t> plane =
+        i == 0 ? image.Luma() : image.Chroma(i);
+    const Py_ssize_t row_size =
+        static_cast<Py_ssize_t>(plane.width) * plane.channels;
+    if (plane.stride < row_size) {
+      PyErr_SetString(PyExc_ValueError,
+                      "Frame stride is smaller than a row of pixels");
+      return 0;
+    }
+    if (offsets[i] < 0 ||
+        arg.buffer->len <
+            offsets[i] + (plane.height - 1) * plane.stride + row_size) {
+      PyErr_SetString(PyExc_ValueError, "Frame data is smaller than its size");
+      return 0;
+    }
+    image.planes[i] = static_cast<const uint8_t*>(arg.buffer->buf) + offsets[i];
+  }
+  return 1;
+}
+
+// Python argument conversion function
+// Takes a `PyObject*` assumed to be a `xnornet.SegmentationMask` and converts
+// it to a `MaskArg`, which is assumed to be passed through the `void*`
+// argument. The result refers to the data returned by `to_bytes()`, without
+// copying it.
+int ConvertMask(PyObject* obj, void* arg_addr) {
+  MaskArg& arg = *reinterpret_cast<MaskArg*>(arg_addr);
+  Frame<const bool1x8>& frame = arg.bitmap;
+
+  auto get_attr_long = [](PyObject* obj, const char* attr,
+                          int32_t* out) -> bool {
+    PyObject* py_attr = PyObject_GetAttrString(obj, attr);
+    if (py_attr == NULL) {
+      return false;
+    }
+    int32_t val = PyLong_AsLong(py_attr);
+    if (PyErr_Occurred()) {
+      Py_DECREF(py_attr);
+      return false;
+    }
+    *out = val;
+    Py_DECREF(py_attr);
+    return true;
+  };
+
+  if (!get_attr_long(obj, "width", &frame.width) ||
+      !get_attr_long(obj, "height", &frame.height) ||
+      !get_attr_long(obj, "_stride", &frame.stride)) {
+    return 0;
+  }
+  if (frame.width <= 0 || frame.height <= 0 ||
+      frame.stride < (frame.width + 7) / 8) {
+    PyErr_SetString(PyExc_ValueError, "Bad mask dimensions");
+    return 0;
+  }
+
+  PyObject* data = PyObject_CallMethod(obj, "to_bytes", NULL);
+  if (data == NULL) {
+    return 0;
+  }
+  // The buffer keeps its own reference to `data`
+  int status = PyObject_GetBuffer(data, arg.buffer.get(), PyBUF_SIMPLE);
+  Py_DECREF(data);
+  if (status < 0) {
+    return 0;
+  }
+  if (arg.buffer->len < static_cast<Py_ssize_t>(frame.stride) * frame.height) {
+    PyErr_SetString(PyExc_ValueError, "Mask data is smaller than its size");
+    return 0;
+  }
+  frame.data = static_cast<const bool1x8*>(arg.buffer->buf);
+  return 1;
+}
+
+// Python argument conversion function
+// Takes a writable, contiguous buffer-protocol object (or None) and converts it
+// to an `OutputArg`, which is assumed to be passed through the `void*`
+// argument.
+int ConvertOutput(PyObject* obj, void* arg_addr) {
+  OutputArg& arg = *reinterpret_cast<OutputArg*>(arg_addr);
+  if (obj == Py_None) {
+    return 1;
+  }
+  if (PyObject_GetBuffer(obj, arg.buffer.get(), PyBUF_WRITABLE) < 0) {
+    return 0;
+  }
+  arg.obj = obj;
+  arg.data = static_cast<uint8_t*>(arg.buffer->buf);
+  return 1;
+}
+
+// Python argument conversion function
+// Takes a `PyObject*` assumed to be an `effects.Background` or a
+// `gst_pipeline.Frame` and converts it to a `BackgroundArg`, which is assumed
+// to be passed through the `void*` argument.
+int ConvertBackground(PyObject* obj, void* arg_addr) {
+  BackgroundArg& arg = *reinterpret_cast<BackgroundArg*>(arg_addr);
+  if (PyObject_TypeCheck(obj, background_type)) {
+    arg.prepared = reinterpret_cast<PyBackgroundObject*>(obj)->background;
+    if (arg.prepared == nullptr) {
+      PyErr_SetString(PyExc_ValueError, "Background is not initialized");
+      return 0;
+    }
+    return 1;
+  }
+  return ConvertImage(obj, &arg.image);
+}
+
+// Python argument conversion function
+// Takes a `PyObject*` assumed to be the name of a mask filter and converts it
+// to a `MaskFilter`, which is assumed to be passed through the `void*`
+// argument.
+int ConvertMaskFilter(PyObject* obj, void* filter_addr) {
+  MaskFilter& filter = *reinterpret_cast<MaskFilter*>(filter_addr);
+  const char* name = PyUnicode_Check(obj) ? PyUnicode_AsUTF8(obj) : nullptr;
+  if (name != nullptr && std::strcmp(name, "nearest") == 0) {
+    filter = MaskFilter::kNearest;
+  } else if (name != nullptr && std::strcmp(name, "bilinear") == 0) {
+    filter = MaskFilter::kBilinear;
+  } else {
+    PyErr_Clear();
+    PyErr_SetString(PyExc_ValueError,
+                    "mask_filter must be 'nearest' or 'bilinear'");
+    return 0;
+  }
+  return 1;
+}
+
+// How redact() hides the inside of each box
+enum class RedactMode { kPixelate, kBlur };
+
+// Python argument conversion function
+// Takes a `PyObject*` assumed to be the name of a redaction mode and converts
+// it to a `RedactMode`, which is assumed to be passed through the `void*`
+// argument.
+int ConvertRedactMode(PyObject* obj, void* mode_addr) {
+  RedactMode& mode = *reinterpret_cast<RedactMode*>(mode_addr);
+  const char* name = PyUnicode_Check(obj) ? PyUnicode_AsUTF8(obj) : nullptr;
+  if (name != nullptr && std::strcmp(name, "pixelate") == 0) {
+    mode = RedactMode::kPixelate;
+  } else if (name != nullptr && std::strcmp(name, "blur") == 0) {
+    mode = RedactMode::kBlur;
+  } else {
+    PyErr_Clear();
+    PyErr_SetString(PyExc_ValueError, "mode must be 'pixelate' or 'blur'");
+    return 0;
+  }
+  return 1;
+}
+
+// A rectangle in coordinates relative to the frame size, like an
+// `xnornet.Rectangle`
+struct RelativeRect final {
+  double x, y, width, height;
+};
+
+// Reads an `xnornet.BoundingBox`, or anything with `x`, `y`, `width` and
+// `height` attributes such as an `xnornet.Rectangle`, into `rect`
+bool GetRelativeRect(PyObject* obj, RelativeRect* rect) {
+  PyObject* rectangle = PyObject_HasAttrString(obj, "rectangle")
+                            ? PyObject_GetAttrString(obj, "rectangle")
+                            : (Py_INCREF(obj), obj);
+  if (rectangle == nullptr) {
+    return false;
+  }
+  auto get_attr_double = [rectangle](const char* attr, double* out) -> bool {
+    PyObject* value = PyObject_GetAttrString(rectangle, attr);
+    if (value == nullptr) {
+      return false;
+    }
+    *out = PyFloat_AsDouble(value);
+    Py_DECREF(value);
+    return !PyErr_Occurred();
+  };
+  const bool success = get_attr_double("x", &rect->x) &&
+                       get_attr_double("y", &rect->y) &&
+                       get_attr_double("width", &rect->width) &&
+                       get_attr_double("height", &rect->height);
+  Py_DECREF(rectangle);
+  if (!success && PyErr_ExceptionMatches(PyExc_AttributeError)) {
+    PyErr_Clear();
+    PyErr_SetString(PyExc_TypeError,
+                    "boxes must hold xnornet.BoundingBox or Rectangle "
+                    "objects");
+  }
+  return success;
+}
+
+// Python argument conversion function
+// Takes an iterable of `xnornet.BoundingBox` or `xnornet.Rectangle` objects
+// and converts it to a `std::vector<RelativeRect>`, which is assumed to be
+// passed through the `void*` argument.
+int ConvertBoxes(PyObject* obj, void* rects_addr) {
+  auto& rects = *reinterpret_cast<std::vector<RelativeRect>*>(rects_addr);
+  PyObject* iterator = PyObject_GetIter(obj);
+  if (iterator == nullptr) {
+    return 0;
+  }
+  PyObject* item;
+  while ((item = PyIter_Next(iterator)) != nullptr) {
+    RelativeRect rect;
+    const bool success = GetRelativeRect(item, &rect);
+    Py_DECREF(item);
+    if (!success) {
+      break;
+    }
+    rects.push_back(rect);
+  }
+  Py_DECREF(iterator);
+  return PyErr_Occurred() ? 0 : 1;
+}
+
+// Returns where an effect should write its `size`-byte result: either the
+// caller's `out` buffer, checking that it is large enough, or a new bytes
+// object. Sets `*result` to the object to return.
+uint8_t* GetOutput(OutputArg& out, Py_ssize_t size, PyObject** result) {
+  if (out.data != nullptr) {
+    if (out.buffer->len < size) {
+      PyErr_Format(PyExc_ValueError,
+                   "out must hold at least %zd bytes, got %zd", size,
+                   out.buffer->len);
+      return nullptr;
+    }
+    Py_INCREF(out.obj);
+    *result = out.obj;
+    return out.data;
+  }
+  *result = PyBytes_FromStringAndSize(nullptr, size);
+  if (*result == nullptr) {
+    return nullptr;
+  }
+  return reinterpret_cast<uint8_t*>(PyBytes_AS_STRING(*result));
+}
+
+// GetOutput for a `width` x `height` RGBA result
+uint8_t* GetOutput(OutputArg& out, int32_t width, int32_t height,
+                   PyObject** result) {
+  return GetOutput(out, static_cast<Py_ssize_t>(width) * height * kRgbChannels,
+                   result);
+}
+
+// GetOutput for a YUV result the size and format of `frame`, in GStreamer's
+// default layout. Sets `*image` to the planes of the result.
+bool GetYuvOutput(OutputArg& out, const YuvImage<const uint8_t>& frame,
+                  YuvImage<uint8_t>* image, PyObject** result) {
+  Py_ssize_t offsets[3];
+  image->width = frame.width;
+  image->height = frame.height;
+  image->layout = frame.layout;
+  const Py_ssize_t size = DefaultYuvLayout(*frame.layout, frame.width,
+                                           frame.height, image->strides,
+                                           offsets);
+  uint8_t* data = GetOutput(out, size, result);
+  if (data == nullptr) {
+    return false;
+  }
+  // Clear the row padding of a new result, which the effects don't write
+  const Py_ssize_t chroma_size = static_cast<Py_ssize_t>(
+      (frame.width + 1) / 2) * ((frame.height + 1) / 2) * 2;
+  if (out.data == nullptr &&
+      size != static_cast<Py_ssize_t>(frame.width) * frame.height +
+                  chroma_size) {
+    std::memset(data, 0, size);
+  }
+  for (int32_t i = 0; i < 3; ++i) {
+    image->planes[i] = i < frame.layout->n_planes ? data + offsets[i] : nullptr;
+  }
+  return true;
+}
+
+// Checks the knobs given to one of the Python functions, setting a Python
+// exception and returning false if any is out of range. The downsample factor
+// is only checked for the blur effects (`blur`), the only ones that take it.
+bool ValidateParams(const EffectParams& params, int32_t width, int32_t height,
+                    bool blur) {
+  if (blur && (params.downsample < 1 || width < params.downsample ||
+               height < params.downsample)) {
+    PyErr_SetString(PyExc_ValueError,
+                    "downsample must be at least 1 and at most the frame size");
+    return false;
+  }
+  if (params.blur_iterations < 0 || params.mask_blur_iterations < 0) {
+    PyErr_SetString(PyExc_ValueError, "Blur iterations can't be negative");
+    return false;
+  }
+  // Box sizes must be odd for the box to be centered on each pixel
+  if (params.box_size < 1 || params.box_size % 2 == 0 ||
+      params.mask_box_size < 1 || params.mask_box_size % 2 == 0) {
+    PyErr_SetString(PyExc_ValueError, "Box sizes must be positive odd numbers");
+    return false;
+  }
+  return true;
+}
+
+// Turns the `threads` argument of the Python functions into a thread count:
+// values below 1 mean "one per CPU core".
+int32_t ResolveThreads(int32_t threads) {
+  if (threads < 1) {
+    threads = static_cast<int32_t>(std::thread::hardware_concurrency());
+  }
+  return std::max(1, std::min(threads, kMaxThreads));
+}
+
+PyObject* PyEffectsBlur(PyObject* self, PyObject* args, PyObject* kwargs) {
+  static const char* keywords[] = {"frame",
+                                   "mask",
+                                   "out",
+                                   "mask_filter",
+                                   "threads",
+                                   "downsample",
+                                   "blur_iterations",
+                                   "box_size",
+                                   "mask_blur_iterations",
+                                   "mask_box_size",
+                                   nullptr};
+  ImageArg frame_arg;
+  MaskArg mask_arg;
+  OutputArg out_arg;
+  MaskFilter mask_filter = MaskFilter::kNearest;
+  int32_t threads = 1;
+  EffectParams params;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwargs, "O&O&|$O&O&iiiiii", const_cast<char**>(keywords),
+          ConvertImage, &frame_arg, ConvertMask, &mask_arg, ConvertOutput,
+          &out_arg, ConvertMaskFilter, &mask_filter, &threads,
+          &params.downsample, &params.blur_iterations, &params.box_size,
+          &params.mask_blur_iterations, &params.mask_box_size)) {
+    return nullptr;
+  }
+  threads = ResolveThreads(threads);
+  const Image& frame = frame_arg.image;
+  if (!ValidateParams(params, frame.width, frame.height, true)) {
+    return nullptr;
+  }
+  PyObject* result;
+  uint8_t* out = GetOutput(out_arg, frame.width, frame.height, &result);
+  if (out == nullptr) {
+    return nullptr;
+  }
+
+  // Everything from here on works on memory that the arguments keep alive,
+  // so other Python threads (capture, inference, drawing) can run in the
+  // meantime.
+  const Kernels& kernels = *active_kernels;
+  Py_BEGIN_ALLOW_THREADS
+
+  static thread_local ScratchBuffer<uint16_t> frame16_scratch;
+
+  const int32_t downsample = params.downsample;
+  int32_t downsampled_width = frame.width / downsample;
+  int32_t downsampled_height = frame.height / downsample;
+  size_t n_elements = static_cast<size_t>(downsampled_width) *
+                      downsampled_height * kRgbChannels;
+
+  Frame<uint16_t> frame16{downsampled_width, downsampled_height,
+                          frame16_scratch.Get(n_elements)};
+  // Scale up to 16 bit and downsample by the downsample factor.
+  //
+  // We convert to 16 bit to avoid artifacts from the blur technique we use,
+  // which assumes that summing over the blur kernel on successive values is
+  // equivalent to adding/subtracting at the edges. This is generally true, but
+  // the optimized version can drift when the sum is rounded to 8-bit values.
+  //
+  // Downsampling speeds the whole thing up without losing much quality, as
+  // mentioned above. Each downsampled pixel takes the value of the last pixel
+  // in its block of downsample x downsample pixels. Pixels past the last whole
+  // block (when the frame size isn't a multiple of the factor) are dropped.
+  const PixelLayout& layout = *frame.layout;
+  ParallelFor(frame16.height, threads, [&](int32_t begin, int32_t end) {
+    for (int32_t y_half = begin; y_half < end; ++y_half) {
+      const uint8_t* row = frame.Row(y_half * downsample + downsample - 1);
+      for (int32_t x_half = 0; x_half < frame16.width; ++x_half) {
+        const int32_t x = x_half * downsample + downsample - 1;
+        const uint8_t* pixel = row + x * layout.pixel_size;
+        int32_t ihalf = y_half * frame16.width * kRgbChannels +
+                        x_half * kRgbChannels;
+        frame16.data[ihalf + 0] = pixel[layout.r] << 8;
+        frame16.data[ihalf + 1] = pixel[layout.g] << 8;
+        frame16.data[ihalf + 2] = pixel[layout.b] << 8;
+        frame16.data[ihalf + 3] = 0;
+      }
+    }
+  });
+  const Image background = BlurToBackground(frame16, kPixelLayouts[1], params,
+                                            kernels, threads);
+
+  Frame<float> blurred_mask =
+      BitmapToFloatMap(mask_arg.bitmap, kernels, threads);
+  BlurMask(blurred_mask, params, kernels, threads);
+  BackgroundMask(frame, blurred_mask, background, false, out, mask_filter,
+                 kernels, threads);
+
+  Py_END_ALLOW_THREADS
+
+  return result;
+}
+
+PyObject* PyEffectsBackgroundMask(PyObject* self, PyObject* args,
+                                  PyObject* kwargs) {
+  static const char* keywords[] = {"frame",
+                                   "mask",
+                                   "background",
+                                   "out",
+                                   "mask_filter",
+                                   "threads",
+                                   "mask_blur_iterations",
+                                   "mask_box_size",
+                                   nullptr};
+  ImageArg frame_arg;
+  MaskArg mask_arg;
+  BackgroundArg background_arg;
+  OutputArg out_arg;
+  MaskFilter mask_filter = MaskFilter::kNearest;
+  int32_t threads = 1;
+  EffectParams params;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwargs, "O&O&O&|$O&O&iii", const_cast<char**>(keywords),
+          ConvertImage, &frame_arg, ConvertMask, &mask_arg, ConvertBackground,
+          &background_arg, ConvertOutput, &out_arg, ConvertMaskFilter,
+          &mask_filter, &threads, &params.mask_blur_iterations,
+          &params.mask_box_size)) {
+    return nullptr;
+  }
+  threads = ResolveThreads(threads);
+  const Image& frame = frame_arg.image;
+  if (!ValidateParams(params, frame.width, frame.height, false)) {
+    return nullptr;
+  }
+  PyObject* result;
+  uint8_t* out = GetOutput(out_arg, frame.width, frame.height, &result);
+  if (out == nullptr) {
+    return nullptr;
+  }
+
+  // See PyEffectsBlur
+  const Kernels& kernels = *active_kernels;
+  Py_BEGIN_ALLOW_THREADS
+
+  Frame<float> blurred_mask =
+      BitmapToFloatMap(mask_arg.bitmap, kernels, threads);
+  BlurMask(blurred_mask, params, kernels, threads);
+  if (background_arg.prepared != nullptr) {
+    std::shared_ptr<const OwnedImage> background =
+        background_arg.prepared->ScaledTo(frame.width, frame.height, threads);
+    BackgroundMask(frame, blurred_mask, background->View(), true, out,
+                   mask_filter, kernels, threads);
+  } else {
+    BackgroundMask(frame, blurred_mask, background_arg.image.image, false, out,
+                   mask_filter, kernels, threads);
+  }
+
+  Py_END_ALLOW_THREADS
+
+  return result;
+}
+
+PyObject* PyEffectsRedact(PyObject* self, PyObject* args, PyObject* kwargs) {
+  static const char* keywords[] = {"frame",      "boxes",
+                                   "mode",       "threads",
+                                   "block_size", "box_size",
+                                   "blur_iterations", nullptr};
+  ImageArg frame_arg;
+  std::vector<RelativeRect> boxes;
+  RedactMode mode = RedactMode::kPixelate;
+  int32_t threads = 1;
+  int32_t block_size = kRedactBlockSize;
+  int32_t box_size = kRedactBoxSize;
+  int32_t blur_iterations = kRedactBlurIterations;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwargs, "O&O&|$O&iiii", const_cast<char**>(keywords),
+          ConvertWritableImage, &frame_arg, ConvertBoxes, &boxes,
+          ConvertRedactMode, &mode, &threads, &block_size, &box_size,
+          &blur_iterations)) {
+    return nullptr;
+  }
+  threads = ResolveThreads(threads);
+  if (block_size < 1) {
+    PyErr_SetString(PyExc_ValueError, "block_size must be positive");
+    return nullptr;
+  }
+  if (box_size < 1 || box_size % 2 == 0) {
+    PyErr_SetString(PyExc_ValueError, "Box sizes must be positive odd numbers");
+    return nullptr;
+  }
+  if (box_size > kMaxRedactBoxSize) {
+    PyErr_Format(PyExc_ValueError, "box_size can't be larger than %d",
+                 kMaxRedactBoxSize);
+    return nullptr;
+  }
+  if (blur_iterations < 0) {
+    PyErr_SetString(PyExc_ValueError, "Blur iterations can't be negative");
+    return nullptr;
+  }
+  const Image& frame = frame_arg.image;
+  // ConvertWritableImage asked for a writable buffer
+  uint8_t* data = const_cast<uint8_t*>(frame.data);
+  const int32_t pixel_size = frame.layout->pixel_size;
+
+  // See PyEffectsBlur
+  Py_BEGIN_ALLOW_THREADS
+
+  for (const RelativeRect& box : boxes) {
+    const PixelRect rect = ToPixelRect(box.x, box.y, box.width, box.height,
+                                       frame.width, frame.height);
+    if (rect.x_begin >= rect.x_end || rect.y_begin >= rect.y_end) {
+      continue;
+    }
+    if (mode == RedactMode::kPixelate) {
+      PixelateRect(data, frame.stride, pixel_size, rect, block_size, threads);
+    } else {
+      BlurRect(data, frame.stride, pixel_size, rect, box_size, blur_iterations,
+               threads);
+    }
+  }
+
+  Py_END_ALLOW_THREADS
+
+  Py_RETURN_NONE;
+}
+
+PyObject* PyEffectsAvailableIsas(PyObject* self, PyObject* args) {
+  PyObject* isas = PyList_New(0);
+  if (isas == nullptr) {
+    return nullptr;
+  }
+  for (const Kernels* kernels : kAllKernels) {
+    if (!IsSupported(*kernels)) {
+      continue;
+    }
+    PyObject* name = PyUnicode_FromString(kernels->isa);
+    if (name == nullptr || PyList_Append(isas, name) < 0) {
+      Py_XDECREF(name);
+      Py_DECREF(isas);
+      return nullptr;
+    }
+    Py_DECREF(name);
+  }
+  return isas;
+}
+
+PyObject* PyEffectsIsa(PyObject* self, PyObject* args) {
+  return PyUnicode_FromString(active_kernels.load()->isa);
+}
+
+PyObject* PyEffectsSetIsa(PyObject* self, PyObject* args) {
+  const char* name;
+  if (!PyArg_ParseTuple(args, "s", &name)) {
+    return nullptr;
+  }
+  for (const Kernels* kernels : kAllKernels) {
+    if (std::strcmp(kernels->isa, name) == 0 && IsSupported(*kernels)) {
+      active_kernels = kernels;
+      Py_RETURN_NONE;
+    }
+  }
+  PyErr_Format(PyExc_ValueError,
+               "Instruction set '%s' is not available on this CPU", name);
+  return nullptr;
+}
+
+PyObject* PyEffectsBlurYuv(PyObject* self, PyObject* args, PyObject* kwargs) {
+  static const char* keywords[] = {"frame",
+                                   "mask",
+                                   "out",
+                                   "mask_filter",
+                                   "threads",
+                                   "downsample",
+                                   "blur_iterations",
+                                   "box_size",
+                                   "mask_blur_iterations",
+                                   "mask_box_size",
+                                   nullptr};
+  YuvImageArg frame_arg;
+  MaskArg mask_arg;
+  OutputArg out_arg;
+  MaskFilter mask_filter = MaskFilter::kNearest;
+  int32_t threads = 1;
+  EffectParams params;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwargs, "O&O&|$O&O&iiiiii", const_cast<char**>(keywords),
+          ConvertYuvImage, &frame_arg, ConvertMask, &mask_arg, ConvertOutput,
+          &out_arg, ConvertMaskFilter, &mask_filter, &threads,
+          &params.downsample, &params.blur_iterations, &params.box_size,
+          &params.mask_blur_iterations, &params.mask_box_size)) {
+    return nullptr;
+  }
+  threads = ResolveThreads(threads);
+  const YuvImage<const uint8_t>& frame = frame_arg.image;
+  if (!ValidateParams(params, frame.width, frame.height, true)) {
+    return nullptr;
+  }
+  PyObject* result;
+  YuvImage<uint8_t> out;
+  if (!GetYuvOutput(out_arg, frame, &out, &result)) {
+    return nullptr;
+  }
+
+  // See PyEffectsBlur
+  const Kernels& kernels = *active_kernels;
+  Py_BEGIN_ALLOW_THREADS
+
+  static thread_local ScratchBuffer<uint16_t> frame16_scratch;
+
+  const int32_t downsample = params.downsample;
+  Frame<uint16_t> frame16{frame.width / downsample, frame.height / downsample};
+  frame16.data = frame16_scratch.Get(static_cast<size_t>(frame16.width) *
+                                     frame16.height * kRgbChannels);
+  // Downsample as in PyEffectsBlur, taking the chroma of each sampled pixel
+  // from the chroma planes
+  const Plane<const uint8_t> luma = frame.Luma();
+  const Plane<const uint8_t> chroma_u = frame.Chroma(1);
+  const int32_t v_plane = frame.layout->chroma_channels == 2 ? 1 : 2;
+  const int32_t v_offset = frame.layout->chroma_channels == 2 ? 1 : 0;
+  const Plane<const uint8_t> chroma_v = frame.Chroma(v_plane);
+  ParallelFor(frame16.height, threads, [&](int32_t begin, int32_t end) {
+    for (int32_t y_half = begin; y_half < end; ++y_half) {
+      const int32_t y = y_half * downsample + downsample - 1;
+      const uint8_t* luma_row = luma.Row(y);
+      const uint8_t* u_row = chroma_u.Row(y / 2);
+      const uint8_t* v_row = chroma_v.Row(y / 2) + v_offset;
+      uint16_t* out_row = frame16.data + y_half * frame16.width * kRgbChannels;
+      for (int32_t x_half = 0; x_half < frame16.width; ++x_half) {
+        const int32_t x = x_half * downsample + downsample - 1;
+        const int32_t chroma_x = x / 2 * chroma_u.channels;
+        out_row[x_half * kRgbChannels + 0] = luma_row[x] << 8;
+        out_row[x_half * kRgbChannels + 1] = u_row[chroma_x] << 8;
+        out_row[x_half * kRgbChannels + 2] = v_row[chroma_x] << 8;
+        out_row[x_half * kRgbChannels + 3] = 0;
+      }
+    }
+  });
+  const Image background = BlurToBackground(frame16, kPackedYuvLayout, params,
+                                            kernels, threads);
+
+  Frame<float> blurred_mask =
+      BitmapToFloatMap(mask_arg.bitmap, kernels, threads);
+  BlurMask(blurred_mask, params, kernels, threads);
+  BackgroundMaskYuv(frame, blurred_mask, nullptr, &background, out,
+                    mask_filter, kernels, threads);
+
+  Py_END_ALLOW_THREADS
+
+  return result;
+}
+
+PyObject* PyEffectsBackgroundMaskYuv(PyObject* self, PyObject* args,
+                                     PyObject* kwargs) {
+  static const char* keywords[] = {"frame",
+                                   "mask",
+                                   "background",
+                                   "out",
+                                   "mask_filter",
+                                   "threads",
+                                   "mask_blur_iterations",
+                                   "mask_box_size",
+                                   nullptr};
+  YuvImageArg frame_arg;
+  MaskArg mask_arg;
+  BackgroundArg background_arg;
+  OutputArg out_arg;
+  MaskFilter mask_filter = MaskFilter::kNearest;
+  int32_t threads = 1;
+  EffectParams params;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwargs, "O&O&O&|$O&O&iii", const_cast<char**>(keywords),
+          ConvertYuvImage, &frame_arg, ConvertMask, &mask_arg,
+          ConvertBackground, &background_arg, ConvertOutput, &out_arg,
+          ConvertMaskFilter, &mask_filter, &threads,
+          &params.mask_blur_iterations, &params.mask_box_size)) {
+    return nullptr;
+  }
+  threads = ResolveThreads(threads);
+  const YuvImage<const uint8_t>& frame = frame_arg.image;
+  if (!ValidateParams(params, frame.width, frame.height, false)) {
+    return nullptr;
+  }
+  PyObject* result;
+  YuvImage<uint8_t> out;
+  if (!GetYuvOutput(out_arg, frame, &out, &result)) {
+    return nullptr;
+  }
+
+  // See PyEffectsBlur
+  const Kernels& kernels = *active_kernels;
+  Py_BEGIN_ALLOW_THREADS
+
+  Frame<float> blurred_mask =
+      BitmapToFloatMap(mask_arg.bitmap, kernels, threads);
+  BlurMask(blurred_mask, params, kernels, threads);
+  // A plain image is converted on every call; an effects.Background keeps
+  // its converted copy
+  std::unique_ptr<BackgroundImage> converted;
+  BackgroundImage* background = background_arg.prepared;
+  if (background == nullptr) {
+    converted.reset(new BackgroundImage(background_arg.image.image));
+    background = converted.get();
+  }
+  std::shared_ptr<const OwnedYuvImage> yuv_background = background->ScaledToYuv(
+      *frame.layout, frame.width, frame.height, threads);
+  BackgroundMaskYuv(frame, blurred_mask, &yuv_background->image, nullptr, out,
+                    mask_filter, kernels, threads);
+
+  Py_END_ALLOW_THREADS
+
+  return result;
+}
+
+int PyBackgroundInit(PyObject* self, PyObject* args, PyObject* kwargs) {
+  static const char* keywords[] = {"image", nullptr};
+  ImageArg image_arg;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&",
+                                   const_cast<char**>(keywords), ConvertImage,
+                                   &image_arg)) {
+    return -1;
+  }
+  PyBackgroundObject* background = reinterpret_cast<PyBackgroundObject*>(self);
+  delete background->background;
+  background->background = new BackgroundImage(image_arg.image);
+  return 0;
+}
+
+void PyBackgroundDealloc(PyObject* self) {
+  delete reinterpret_cast<PyBackgroundObject*>(self)->background;
+  PyTypeObject* type = Py_TYPE(self);
+  type->tp_free(self);
+  Py_DECREF(type);
+}
+
+PyObject* PyBackgroundGetSize(PyObject* self, void* closure) {
+  const BackgroundImage* background =
+      reinterpret_cast<PyBackgroundObject*>(self)->background;
+  if (background == nullptr) {
+    Py_RETURN_NONE;
+  }
+  return Py_BuildValue("(ii)", background->source().width,
+                       background->source().height);
+}
+
+PyObject* PyBackgroundGetScaledSize(PyObject* self, void* closure) {
+  BackgroundImage* background =
+      reinterpret_cast<PyBackgroundObject*>(self)->background;
+  int32_t width = 0, height = 0;
+  if (background != nullptr) {
+    background->scaled_size(&width, &height);
+  }
+  if (width == 0) {
+    Py_RETURN_NONE;
+  }
+  return Py_BuildValue("(ii)", width, height);
+}
+
+PyGetSetDef BackgroundGetSet[] = {
+    {const_cast<char*>("size"), PyBackgroundGetSize, nullptr,
+     const_cast<char*>("(width, height) of the original image"), nullptr},
+    {const_cast<char*>("scaled_size"), PyBackgroundGetScaledSize, nullptr,
+     const_cast<char*>("(width, height) the image is currently resampled to, "
+                       "or None"),
+     nullptr},
+    {nullptr, nullptr, nullptr, nullptr, nullptr}};
+
+PyType_Slot BackgroundSlots[] = {
+    {Py_tp_doc, const_cast<char*>(
+                    "Background(image)\n--\n\n"
+                    "A backdrop for background_mask() that is reused across\n"
+                    "frames. image is a (format, (width, height), data[,\n"
+                    "stride]) tuple, as for background_mask(); it is copied.\n"
+                    "The copy is resampled to the frame size the first time\n"
+                    "it is used and whenever that size changes, instead of\n"
+                    "on every frame.")},
+    {Py_tp_new, reinterpret_cast<void*>(PyType_GenericNew)},
+    {Py_tp_init, reinterpret_cast<void*>(PyBackgroundInit)},
+    {Py_tp_dealloc, reinterpret_cast<void*>(PyBackgroundDealloc)},
+    {Py_tp_getset, BackgroundGetSet},
+    {0, nullptr}};
+
+PyType_Spec BackgroundSpec = {"xnor_util.effects.Background",
+                              sizeof(PyBackgroundObject), 0,
+                              Py_TPFLAGS_DEFAULT, BackgroundSlots};
+
+PyMethodDef Methods[] = {
+    {"blur", reinterpret_cast<PyCFunction>(PyEffectsBlur),
+     METH_VARARGS | METH_KEYWORDS,
+     "blur(frame, mask, *, out=None, mask_filter='nearest', threads=1,\n"
+     "     downsample=3, blur_iterations=2, box_size=11,\n"
+     "     mask_blur_iterations=1, mask_box_size=11)\n--\n\n"
+     "Box blur the image outside of the mask and return it as RGBA.\n\n"
+     "frame is a (format, (width, height), data[, stride]) tuple such as a\n"
+     "gst_pipeline.Frame. format is RGB, RGBA, RGBx, BGRA or BGRx, and data\n"
+     "any buffer-protocol object. The result is written into out, a writable\n"
+     "buffer of at least width * height * 4 bytes, which is returned; without\n"
+     "out, a new bytes object is returned. mask_filter ('nearest' or\n"
+     "'bilinear') is how the mask is scaled up to the frame size. threads < 1\n"
+     "uses one thread per CPU core.\n\n"
+     "The remaining arguments trade quality for speed: the frame is shrunk\n"
+     "by downsample before blur_iterations passes of a box blur box_size\n"
+     "pixels wide, and the mask edges are softened by mask_blur_iterations\n"
+     "passes of a mask_box_size box blur. Box sizes must be odd."},
+    {"background_mask", reinterpret_cast<PyCFunction>(PyEffectsBackgroundMask),
+     METH_VARARGS | METH_KEYWORDS,
+     "background_mask(frame, mask, background, *, out=None,\n"
+     "                mask_filter='nearest', threads=1,\n"
+     "                mask_blur_iterations=1, mask_box_size=11)\n--\n\n"
+     "Replace the image outside of the mask with background and return it as\n"
+     "RGBA. background is an image like frame, or a Background to reuse from\n"
+     "frame to frame. The other arguments are as for blur()."},
+    {"blur_yuv", reinterpret_cast<PyCFunction>(PyEffectsBlurYuv),
+     METH_VARARGS | METH_KEYWORDS,
+     "blur_yuv(frame, mask, *, out=None, mask_filter='nearest', threads=1,\n"
+     "         downsample=3, blur_iterations=2, box_size=11,\n"
+     "         mask_blur_iterations=1, mask_box_size=11)\n--\n\n"
+     "Like blur(), for an I420 or NV12 frame, without converting it to RGB.\n"
+     "The result has the format of frame.\n\n"
+     "frame is a (format, (width, height), data[, strides[, offsets]])\n"
+     "tuple, where strides and offsets give the row stride and starting\n"
+     "byte of each plane. Without them, and in the result, the planes are in\n"
+     "GStreamer's default layout: rows padded to a multiple of 4 bytes and\n"
+     "planes stored one after another. The mask is applied to the luma plane\n"
+     "at full resolution, and scaled to the chroma planes' resolution for\n"
+     "them."},
+    {"background_mask_yuv",
+     reinterpret_cast<PyCFunction>(PyEffectsBackgroundMaskYuv),
+     METH_VARARGS | METH_KEYWORDS,
+     "background_mask_yuv(frame, mask, background, *, out=None,\n"
+     "                    mask_filter='nearest', threads=1,\n"
+     "                    mask_blur_iterations=1, mask_box_size=11)\n--\n\n"
+     "Like background_mask(), for an I420 or NV12 frame as for blur_yuv().\n"
+     "background is an RGB image or a Background as for background_mask();\n"
+     "it is converted to BT.601 YUV, which a Background only does when the\n"
+     "frame size changes."},
+    {"redact", reinterpret_cast<PyCFunction>(PyEffectsRedact),
+     METH_VARARGS | METH_KEYWORDS,
+     "redact(frame, boxes, *, mode='pixelate', threads=1, block_size=16,\n"
+     "       box_size=31, blur_iterations=2)\n--\n\n"
+     "Hide the inside of each box in frame, in place, and return None.\n\n"
+     "frame is as for blur(), but its data must be writable (e.g. a\n"
+     "bytearray). boxes is an iterable of xnornet.BoundingBox or Rectangle\n"
+     "objects, in coordinates relative to the frame size; each is rounded\n"
+     "out to whole pixels. Only pixels inside the boxes are read or\n"
+     "written, so the cost is proportional to the area they cover.\n\n"
+     "mode 'pixelate' replaces each block_size x block_size square (aligned\n"
+     "to the frame) with its average color. mode 'blur' applies\n"
+     "blur_iterations passes of a box blur box_size pixels wide, using only\n"
+     "the pixels inside the box. threads is as for blur()."},
+    {"available_isas", PyEffectsAvailableIsas, METH_NOARGS,
+     "available_isas()\n--\n\n"
+     "Return the names of the instruction sets the effects can use on this\n"
+     "CPU, slowest first. 'scalar' is always available."},
+    {"isa", PyEffectsIsa, METH_NOARGS,
+     "isa()\n--\n\n"
+     "Return the name of the instruction set the effects use. It is the\n"
+     "fastest available one unless changed with set_isa()."},
+    {"set_isa", PyEffectsSetIsa, METH_VARARGS,
+     "set_isa(name)\n--\n\n"
+     "Make the effects use the named instruction set from available_isas().\n"
+     "Every instruction set produces identical results; this is for\n"
+     "benchmarking and testing."},
+    {nullptr, nullptr, 0, nullptr}};
+
+PyModuleDef moduledef = {PyModuleDef_HEAD_INIT, "effects", nullptr, -1,
+                         Methods};
+
+}  // namespace
+
+extern "C" PyMODINIT_FUNC PyInit_effects(void) {
+  SelectFastestKernels();
+  PyObject* module = PyModule_Create(&moduledef);
+  if (module == nullptr) {
+    return nullptr;
+  }
+  background_type =
+      reinterpret_cast<PyTypeObject*>(PyType_FromSpec(&BackgroundSpec));
+  if (background_type == nullptr) {
+    Py_DECREF(module);
+    return nullptr;
+  }
+  // PyModule_AddObject steals a reference; keep ours for type checks
+  Py_INCREF(background_type);
+  if (PyModule_AddObject(module, "Background",
+                         reinterpret_cast<PyObject*>(background_type)) < 0) {
+    Py_DECREF(background_type);
+    Py_DECREF(module);
+    return nullptr;
+  }
+  return module;
 }
@@ -0,0 +1,43 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Pick the implementation of the video effects the samples use.
+
+The effects are implemented natively in common_util/effects.cc, which has to
+be built with `python3 setup.py install`, and with NumPy in
+common_util/effects_numpy.py, a slower stand-in for devices where the
+extension can't be built. Samples get whichever is available with:
+
+    import common_util.effects_loader as effects_loader
+    effects = effects_loader.load_effects()
+"""
+
+# Colorful printing!
+import common_util.ansi as ansi
+
+
+def load_effects():
+    """Return the native effects module if it's built, or else the NumPy
+    version, printing a note that it's slower. If neither can be imported,
+    prints how to get one and raises the extension's ImportError.
+    """
+    try:
+        # Support code that helps process video frames using segmentation
+        # masks. See common_util/effects.cc for implementation
+        import xnor_util.effects as effects
+    except ImportError as e:
+        try:
+            # The same effects written with NumPy, for when the extension
+            # can't be built. See common_util/effects_numpy.py
+            import common_util.effects_numpy as effects
+        except ImportError:
+            print(ansi.RED + "ERROR: " + ansi.NORMAL +
+                  "Unable to import the effects module!")
+            print("(Have you run " + ansi.BOLD + "python3 setup.py install" +
+                  ansi.NORMAL + "? Without it, install " + ansi.BOLD +
+                  "numpy" + ansi.NORMAL + " to use a slower version of the "
+                  "effects.)\n")
+            raise e
+        print(ansi.BOLD + "NOTE: " + ansi.NORMAL + "The effects module isn't "
+              "built; using the slower NumPy version. (Run " + ansi.BOLD +
+              "python3 setup.py install" + ansi.NORMAL + " to build it.)")
+    return effects
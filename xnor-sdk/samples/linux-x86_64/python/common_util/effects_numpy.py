@@ -0,0 +1,528 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""A NumPy implementation of the background blur and greenscreen effects.
+
+This is a stand-in for the `xnor_util.effects` extension (see effects.cc) on
+devices where it can't be built, e.g. because there is no compiler or no
+Python headers for the installed interpreter. It has the same `blur`,
+`background_mask`, `redact` and `Background` API, and samples fall back to it
+automatically when the extension can't be imported (see effects_loader.py):
+
+    import common_util.effects_loader as effects_loader
+    effects = effects_loader.load_effects()
+
+Each step is vectorized over whole arrays rather than looping over pixels in
+Python, but the extension is still several times faster; run
+`effects_benchmark.py --compare_backends` to see by how much on your device.
+
+The results are not bit-for-bit identical to the extension's. The box blurs
+here are exact averages computed from cumulative sums, whereas the extension
+updates a running sum pixel by pixel with rounding at every step, so colors
+and mask edges may differ slightly. The mask and background are sampled at
+exactly the same places. `redact` rounds like the extension at every step,
+so its results are identical. The YUV variants of the effects (`blur_yuv` and
+`background_mask_yuv`) are not implemented, and `threads` is accepted for
+compatibility but ignored.
+"""
+
+import collections
+import functools
+import math
+import threading
+
+import numpy as np
+
+# Defaults of the tuning knobs; see effects.cc
+DOWNSAMPLE = 3
+BLUR_ITERATIONS = 2
+BOX_SIZE = 35 // DOWNSAMPLE
+MASK_BLUR_ITERATIONS = 1
+MASK_BOX_SIZE = 11
+REDACT_BLOCK_SIZE = 16
+REDACT_BOX_SIZE = 31
+REDACT_BLUR_ITERATIONS = 2
+
+# Bytes per pixel, and whether the channels are stored in BGR order
+_PIXEL_LAYOUTS = {
+    "RGB": (3, False),
+    "RGBA": (4, False),
+    "RGBx": (4, False),
+    "BGRA": (4, True),
+    "BGRx": (4, True),
+}
+
+_MASK_FILTERS = ("nearest", "bilinear")
+_REDACT_MODES = ("pixelate", "blur")
+# Exactness limit of the extension's box blur divisions
+_MAX_REDACT_BOX_SIZE = (1 << 20) - 1
+
+# The only "instruction set" of this backend, for compatibility with the
+# extension's available_isas(), isa() and set_isa()
+_ISA = "numpy"
+
+AxisSampling = collections.namedtuple(
+    "AxisSampling",
+    ["mask", "background", "mask_low", "mask_high", "mask_weight"])
+AxisSampling.__doc__ = """\
+Where the effects sample the mask and background for each column (or row) of
+the frame. Each item is an array with one value per column:
+- `mask`: nearest mask pixel
+- `background`: nearest background pixel
+- `mask_low`, `mask_high`, `mask_weight`: the two neighbouring mask pixels and
+  the weight of the second, for bilinear mask sampling
+"""
+
+
+def _nearest(frame_size, source_size):
+    """Return the nearest pixel of an axis of @source_size to sample for each
+    pixel of an axis of @frame_size. Same float32 arithmetic as the
+    extension, so that both sample the same pixels.
+    """
+    n = np.arange(frame_size, dtype=np.float32) / np.float32(frame_size)
+    return (n * np.float32(source_size)).astype(np.intp)
+
+
+@functools.lru_cache(maxsize=8)
+def _axis_sampling(frame_size, mask_size, background_size):
+    """Return the AxisSampling for one axis of a frame. The arrays only
+    depend on the sizes, so they are built once per stream size and must not
+    be modified.
+    """
+    mask = _nearest(frame_size, mask_size)
+    background = _nearest(frame_size, background_size)
+
+    # Pixel centers line up between the frame and the mask
+    position = np.arange(frame_size, dtype=np.float32)
+    centers = np.maximum(
+        np.float32(0), (position + np.float32(0.5)) * np.float32(mask_size) /
+        np.float32(frame_size) - np.float32(0.5))
+    mask_low = np.minimum(np.floor(centers).astype(np.intp), mask_size - 1)
+    mask_high = np.minimum(mask_low + 1, mask_size - 1)
+    mask_weight = centers - mask_low.astype(np.float32)
+
+    sampling = AxisSampling(mask, background, mask_low, mask_high,
+                            mask_weight)
+    for array in sampling:
+        array.flags.writeable = False
+    return sampling
+
+
+@functools.lru_cache(maxsize=16)
+def _box_indices(size, box_size, reflect_start):
+    """Return the indices that pad an axis of @size for a box blur: one
+    before the first window, then every pixel of every window, wrapping
+    around the ends. With @reflect_start, the windows at the start are
+    mirrored instead, so the end of the axis doesn't bleed into the start.
+    """
+    half_box = box_size // 2
+    indices = np.arange(-half_box - 1, size + half_box)
+    if reflect_start:
+        indices = np.abs(indices)
+    indices %= size
+    indices.flags.writeable = False
+    return indices
+
+
+def _box_blur(array, box_size, axis, reflect_start=False):
+    """Return the average of each @box_size window of @array along @axis,
+    as float32. Each window costs one subtraction of cumulative sums,
+    whatever its size.
+    """
+    indices = _box_indices(array.shape[axis], box_size, reflect_start)
+    sums = np.cumsum(np.take(array, indices, axis=axis), axis=axis,
+                     dtype=np.float32)
+    # Window i covers indices i + 1 .. i + box_size of the padded axis
+    upper = [slice(None)] * array.ndim
+    lower = [slice(None)] * array.ndim
+    upper[axis] = slice(box_size, None)
+    lower[axis] = slice(None, -box_size)
+    windows = sums[tuple(upper)]
+    windows -= sums[tuple(lower)]
+    windows *= np.float32(1 / box_size)
+    return windows
+
+
+def _pixel_array(image, writeable=False):
+    """Return a height x width x (bytes per pixel) view of the pixels of a
+    (format, (width, height), data[, stride[, offsets]]) tuple such as a
+    `gst_pipeline.Frame`, and whether its channels are in BGR order
+    """
+    frame_format, (width, height), data = image[:3]
+    stride = image[3] if len(image) > 3 else None
+    offsets = image[4] if len(image) > 4 else None
+
+    if frame_format not in _PIXEL_LAYOUTS:
+        raise TypeError("Bad frame format {}! Expected RGB, RGBA, RGBx, BGRA "
+                        "or BGRx".format(frame_format))
+    if width <= 0 or height <= 0:
+        raise ValueError("Frame size must be positive")
+    pixel_size, bgr = _PIXEL_LAYOUTS[frame_format]
+    row_size = width * pixel_size
+    if stride is None:
+        stride = row_size
+    elif stride < row_size:
+        raise ValueError("Frame stride is smaller than a row of pixels")
+    offset = 0
+    if offsets is not None:
+        if len(offsets) != 1:
+            raise ValueError("Frame offsets must have 1 items, one per plane")
+        offset = offsets[0]
+
+    if writeable and memoryview(data).readonly:
+        raise BufferError("Object is not writable.")
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if offset < 0 or len(buffer) < offset + (height - 1) * stride + row_size:
+        raise ValueError("Frame data is smaller than its size")
+    pixels = np.lib.stride_tricks.as_strided(
+        buffer[offset:], shape=(height, width, pixel_size),
+        strides=(stride, pixel_size, 1), writeable=writeable)
+    return pixels, bgr
+
+
+def _image_array(image):
+    """Return a height x width x 3 view of the RGB channels of a (format,
+    (width, height), data[, stride[, offsets]]) tuple such as a
+    `gst_pipeline.Frame`
+    """
+    pixels, bgr = _pixel_array(image)
+    return pixels[:, :, 2::-1] if bgr else pixels[:, :, :3]
+
+
+def _mask_array(mask):
+    """Unpack an `xnornet.SegmentationMask` into a 0.0/1.0 float32 array"""
+    width, height, stride = mask.width, mask.height, mask._stride
+    if width <= 0 or height <= 0 or stride < (width + 7) // 8:
+        raise ValueError("Bad mask dimensions")
+    data = np.frombuffer(mask.to_bytes(), dtype=np.uint8)
+    if len(data) < stride * height:
+        raise ValueError("Mask data is smaller than its size")
+    bits = np.unpackbits(data[:stride * height].reshape(height, stride),
+                         axis=1, count=width, bitorder='little')
+    return bits.astype(np.float32)
+
+
+def _blurred_mask(mask, mask_blur_iterations, mask_box_size):
+    """Unpack @mask and soften its edges, as for BlurMask in effects.cc"""
+    mask = _mask_array(mask)
+    for _ in range(mask_blur_iterations):
+        mask = np.clip(_box_blur(mask, mask_box_size, axis=1), 0, 1)
+        mask = np.clip(_box_blur(mask, mask_box_size, axis=0,
+                                 reflect_start=True), 0, 1)
+    return mask
+
+
+def _validate_params(width, height, downsample=None,
+                     blur_iterations=BLUR_ITERATIONS, box_size=BOX_SIZE,
+                     mask_blur_iterations=MASK_BLUR_ITERATIONS,
+                     mask_box_size=MASK_BOX_SIZE):
+    # Only blur takes a downsample factor, and passes it
+    if downsample is not None and (downsample < 1 or width < downsample or
+                                   height < downsample):
+        raise ValueError(
+            "downsample must be at least 1 and at most the frame size")
+    if blur_iterations < 0 or mask_blur_iterations < 0:
+        raise ValueError("Blur iterations can't be negative")
+    # Box sizes must be odd for the box to be centered on each pixel
+    if (box_size < 1 or box_size % 2 == 0 or mask_box_size < 1 or
+            mask_box_size % 2 == 0):
+        raise ValueError("Box sizes must be positive odd numbers")
+
+
+def _check_mask_filter(mask_filter):
+    if mask_filter not in _MASK_FILTERS:
+        raise ValueError("mask_filter must be 'nearest' or 'bilinear'")
+
+
+def _get_output(out, width, height):
+    """Return a height x width x 4 array to write an RGBA result into: a
+    view of @out, checking that it is large enough, or a new array
+    """
+    size = width * height * 4
+    if out is None:
+        return np.empty((height, width, 4), dtype=np.uint8)
+    view = memoryview(out)
+    if view.readonly:
+        raise BufferError("Object is not writable.")
+    if view.nbytes < size:
+        raise ValueError("out must hold at least {} bytes, got {}".format(
+            size, view.nbytes))
+    return np.frombuffer(out, dtype=np.uint8, count=size).reshape(
+        height, width, 4)
+
+
+def _background_mask(frame, mask, background, background_prescaled,
+                     mask_filter, out):
+    """Blend @frame over @background (both height x width x 3 arrays, the
+    background at its own size unless @background_prescaled), using the
+    float @mask as opacity, into the RGBA array @out
+    """
+    height, width = frame.shape[:2]
+    mask_height, mask_width = mask.shape
+    columns = _axis_sampling(width, mask_width, background.shape[1])
+    rows = _axis_sampling(height, mask_height, background.shape[0])
+
+    if mask_filter == "bilinear":
+        # Interpolate horizontally along the (few) mask rows first
+        low = mask.take(columns.mask_low, axis=1)
+        horizontal = low + (mask.take(columns.mask_high, axis=1) - low) * \
+            columns.mask_weight
+        top = horizontal.take(rows.mask_low, axis=0)
+        frame_mask = top + (horizontal.take(rows.mask_high, axis=0) - top) * \
+            rows.mask_weight[:, np.newaxis]
+    else:
+        # Indexing one axis at a time is much faster than both at once
+        frame_mask = mask.take(rows.mask, axis=0).take(columns.mask, axis=1)
+
+    if not background_prescaled:
+        background = background.take(rows.background, axis=0).take(
+            columns.background, axis=1)
+
+    # One channel at a time, which keeps the arithmetic on contiguous arrays
+    frame_channel = np.empty((height, width), dtype=np.float32)
+    background_channel = np.empty((height, width), dtype=np.float32)
+    for channel in range(3):
+        np.copyto(frame_channel, frame[:, :, channel])
+        np.copyto(background_channel, background[:, :, channel])
+        frame_channel -= background_channel
+        frame_channel *= frame_mask
+        frame_channel += background_channel
+        # Values stay between the frame's and the background's, so
+        # truncating to 8 bits is the same as the extension's clamp
+        np.copyto(out[:, :, channel], frame_channel, casting="unsafe")
+    out[:, :, 3] = 0
+
+
+def _result(out, array):
+    return out if out is not None else array.tobytes()
+
+
+############################
+# Start of public module API
+############################
+
+
+class Background:
+    """A backdrop for background_mask() that is reused across frames.
+
+    `image` is a (format, (width, height), data[, stride]) tuple, as for
+    background_mask(); it is copied. The copy is resampled to the frame size
+    the first time it is used and whenever that size changes, instead of on
+    every frame.
+    """
+
+    def __init__(self, image):
+        self._source = np.array(_image_array(image))
+        self._lock = threading.Lock()
+        self._scaled = None
+
+    @property
+    def size(self):
+        """(width, height) of the original image"""
+        return self._source.shape[1], self._source.shape[0]
+
+    @property
+    def scaled_size(self):
+        """(width, height) the image is currently resampled to, or None"""
+        scaled = self._scaled
+        if scaled is None:
+            return None
+        return scaled.shape[1], scaled.shape[0]
+
+    def _scaled_to(self, width, height):
+        """Return the image resampled (by nearest neighbour, like
+        background_mask) to @width x @height
+        """
+        with self._lock:
+            scaled = self._scaled
+            if scaled is None or scaled.shape[:2] != (height, width):
+                source_height, source_width = self._source.shape[:2]
+                scaled = self._source[
+                    _nearest(height, source_height)[:, np.newaxis],
+                    _nearest(width, source_width)]
+                self._scaled = scaled
+            return scaled
+
+
+def blur(frame, mask, *, out=None, mask_filter="nearest", threads=1,
+         downsample=DOWNSAMPLE, blur_iterations=BLUR_ITERATIONS,
+         box_size=BOX_SIZE, mask_blur_iterations=MASK_BLUR_ITERATIONS,
+         mask_box_size=MASK_BOX_SIZE):
+    """Box blur the image outside of the mask and return it as RGBA.
+
+    Takes the same arguments as `xnor_util.effects.blur`; see there.
+    """
+    pixels = _image_array(frame)
+    height, width = pixels.shape[:2]
+    _validate_params(width, height, downsample, blur_iterations, box_size,
+                     mask_blur_iterations, mask_box_size)
+    _check_mask_filter(mask_filter)
+    result = _get_output(out, width, height)
+
+    # Each downsampled pixel takes the value of the last pixel in its block,
+    # and pixels past the last whole block are dropped
+    downsampled_height, downsampled_width = (height // downsample,
+                                             width // downsample)
+    background = pixels[downsample - 1::downsample,
+                        downsample - 1::downsample]
+    background = background[:downsampled_height, :downsampled_width]
+    for _ in range(blur_iterations):
+        background = _box_blur(background, box_size, axis=1)
+        background = _box_blur(background, box_size, axis=0)
+    background = background.astype(np.uint8)
+
+    blurred_mask = _blurred_mask(mask, mask_blur_iterations, mask_box_size)
+    _background_mask(pixels, blurred_mask, background, False, mask_filter,
+                     result)
+    return _result(out, result)
+
+
+def background_mask(frame, mask, background, *, out=None,
+                    mask_filter="nearest", threads=1,
+                    mask_blur_iterations=MASK_BLUR_ITERATIONS,
+                    mask_box_size=MASK_BOX_SIZE):
+    """Replace the image outside of the mask with background and return it
+    as RGBA.
+
+    Takes the same arguments as `xnor_util.effects.background_mask`; see
+    there. `background` may be a Background from this module.
+    """
+    pixels = _image_array(frame)
+    height, width = pixels.shape[:2]
+    _validate_params(width, height, mask_blur_iterations=mask_blur_iterations,
+                     mask_box_size=mask_box_size)
+    _check_mask_filter(mask_filter)
+    result = _get_output(out, width, height)
+
+    blurred_mask = _blurred_mask(mask, mask_blur_iterations, mask_box_size)
+    if isinstance(background, Background):
+        _background_mask(pixels, blurred_mask,
+                         background._scaled_to(width, height), True,
+                         mask_filter, result)
+    else:
+        _background_mask(pixels, blurred_mask, _image_array(background),
+                         False, mask_filter, result)
+    return _result(out, result)
+
+
+def _pixel_rect(box, width, height):
+    """Return the (x_begin, y_begin, x_end, y_end) pixels covered by an
+    `xnornet.BoundingBox` or `xnornet.Rectangle`, clipped to the frame
+    """
+    rectangle = getattr(box, "rectangle", box)
+    try:
+        x, y = float(rectangle.x), float(rectangle.y)
+        right = x + float(rectangle.width)
+        bottom = y + float(rectangle.height)
+    except AttributeError:
+        raise TypeError(
+            "boxes must hold xnornet.BoundingBox or Rectangle objects")
+
+    def clip(value, size):
+        return int(min(max(value, 0.0), size))
+
+    return (clip(math.floor(x * width), width),
+            clip(math.floor(y * height), height),
+            clip(math.ceil(right * width), width),
+            clip(math.ceil(bottom * height), height))
+
+
+def _rounded_mean(sums, count):
+    """Round averages the same way as the extension"""
+    return (sums + count // 2) // count
+
+
+def _pixelate(pixels, x_begin, y_begin, block_size):
+    """Replace each block_size square of the frame's grid within @pixels,
+    a view of the frame from (@x_begin, @y_begin), by its average color
+    """
+    def cell_starts(begin, size):
+        first_boundary = (begin // block_size + 1) * block_size - begin
+        return np.concatenate(
+            ([0], np.arange(first_boundary, size, block_size)))
+
+    row_starts = cell_starts(y_begin, pixels.shape[0])
+    column_starts = cell_starts(x_begin, pixels.shape[1])
+    sums = np.add.reduceat(
+        np.add.reduceat(pixels, row_starts, axis=0, dtype=np.int64),
+        column_starts, axis=1)
+    cell_heights = np.diff(np.append(row_starts, pixels.shape[0]))
+    cell_widths = np.diff(np.append(column_starts, pixels.shape[1]))
+    counts = np.outer(cell_heights, cell_widths)[:, :, np.newaxis]
+    means = _rounded_mean(sums, counts).astype(np.uint8)
+    pixels[...] = np.repeat(np.repeat(means, cell_heights, axis=0),
+                            cell_widths, axis=1)
+
+
+def _rect_box_blur(array, box_size, axis):
+    """Box blur @array along @axis, repeating its edges, and round to 8 bits
+    like the extension
+    """
+    size = array.shape[axis]
+    half_box = box_size // 2
+    indices = np.clip(np.arange(-half_box - 1, size + half_box), 0, size - 1)
+    sums = np.cumsum(np.take(array, indices, axis=axis), axis=axis,
+                     dtype=np.int64)
+    # The first window covers indices 1 .. box_size of the padded axis; the
+    # cumulative sum of index 0 is only subtracted
+    upper = [slice(None)] * array.ndim
+    lower = [slice(None)] * array.ndim
+    upper[axis] = slice(box_size, None)
+    lower[axis] = slice(None, -box_size)
+    windows = sums[tuple(upper)] - sums[tuple(lower)]
+    return _rounded_mean(windows, box_size).astype(np.uint8)
+
+
+def redact(frame, boxes, *, mode="pixelate", threads=1,
+           block_size=REDACT_BLOCK_SIZE, box_size=REDACT_BOX_SIZE,
+           blur_iterations=REDACT_BLUR_ITERATIONS):
+    """Hide the inside of each box in frame, in place, and return None.
+
+    Takes the same arguments as `xnor_util.effects.redact`; see there. The
+    results are identical to the extension's.
+    """
+    pixels, _ = _pixel_array(frame, writeable=True)
+    height, width = pixels.shape[:2]
+    if mode not in _REDACT_MODES:
+        raise ValueError("mode must be 'pixelate' or 'blur'")
+    if block_size < 1:
+        raise ValueError("block_size must be positive")
+    if box_size < 1 or box_size % 2 == 0:
+        raise ValueError("Box sizes must be positive odd numbers")
+    if box_size > _MAX_REDACT_BOX_SIZE:
+        raise ValueError("box_size can't be larger than {}".format(
+            _MAX_REDACT_BOX_SIZE))
+    if blur_iterations < 0:
+        raise ValueError("Blur iterations can't be negative")
+
+    for x_begin, y_begin, x_end, y_end in [
+            _pixel_rect(box, width, height) for box in boxes]:
+        if x_begin >= x_end or y_begin >= y_end:
+            continue
+        rect = pixels[y_begin:y_end, x_begin:x_end]
+        if mode == "pixelate":
+            _pixelate(rect, x_begin, y_begin, block_size)
+        else:
+            blurred = rect
+            for _ in range(blur_iterations):
+                blurred = _rect_box_blur(blurred, box_size, axis=1)
+                blurred = _rect_box_blur(blurred, box_size, axis=0)
+            rect[...] = blurred
+
+
+def available_isas():
+    """Return the names of the instruction sets the effects can use. There
+    is only one for this module, "numpy".
+    """
+    return [_ISA]
+
+
+def isa():
+    """Return the name of the instruction set the effects use"""
+    return _ISA
+
+
+def set_isa(name):
+    """Accepts only "numpy"; for compatibility with the extension"""
+    if name != _ISA:
+        raise ValueError(
+            "Instruction set '{}' is not available on this CPU".format(name))
@@ -11,6 +11,7 @@ import collections
 import ctypes
 import logging
 import threading
+import time
 
 import gi
 gi.require_foreign('cairo')
@@ -27,23 +28,54 @@ from gi.repository import GstApp
 from gi.repository import GstVideo
 from gi.repository import Gtk
 
-Frame = collections.namedtuple("Frame", ["format", "size", "data"])
+import common_util.overlays as overlays
+
+Frame = collections.namedtuple("Frame",
+                               ["format", "size", "data", "stride", "offsets"])
+Frame.__new__.__defaults__ = (None, None)
 Frame.__doc__ = """\
 A single frame of video (an image buffer).
-- `format`: a string describing the format of the buffer (e.g. "RGB")
+- `format`: a string describing the format of the buffer (e.g. "RGB", or
+  "I420" and "NV12" for planar YUV)
 - `size`: A tuple of image dimensions, (w, h)
-- `data': A `bytes` object with the image data in the given format
+- `data': A bytes-like object with the image data in the given format. For
+  frames from `GStreamerPipeline.get_mapped_frame()` this is a read-only
+  `memoryview` that is only valid inside the `with` block.
+- `stride`: The number of bytes from the start of one row to the next, which
+  can be more than a row of pixels when GStreamer pads rows. None (the
+  default) means rows are tightly packed. For planar formats, a tuple with
+  the stride of each plane.
+- `offsets`: For planar formats, a tuple with the byte offset of each plane
+  in `data`. None (the default) means GStreamer's default layout for the
+  format (or, for packed formats, that the image starts at the beginning of
+  `data`).
 """
 Frame.__repr__ = lambda self: "Frame ({}, {}x{})".format(
     self.format, *self.size)
 
+InferenceResult = collections.namedtuple("InferenceResult",
+                                         ["frame", "results"])
+InferenceResult.__doc__ = """\
+The output of an InferenceWorker for a single frame.
+- `frame`: the Frame that was evaluated
+- `results`: whatever the worker's evaluate function returned for `frame`
+"""
+
+# A scene of overlays prerendered by VideoOverlayPipeline, and the
+# cairo.ImageSurface it was rendered to
+_OverlayLayer = collections.namedtuple("_OverlayLayer", ["scene", "surface"])
+
 LOG = logging.getLogger(__name__)
 
 
 # Helper to deal with an inconsistency in pygobject's gstreamer bindings across
 # versions
 def _gst_buffer_extract(buf):
-    """Return a bytes containing the same data as @buf"""
+    """Return a bytearray containing the same data as @buf
+
+    Always a bytearray, rather than bytes on some versions, so that the
+    frames of GStreamerPipeline.get_frame() can be modified in place.
+    """
     # We would like to use Gst.Buffer.extract_dup, buf in certain older versions
     # of pygobject, it leaks memory by not cleaning up after marshalling the
     # returned data into a python Bytes. So instead we have to use
@@ -53,16 +85,87 @@ def _gst_buffer_extract(buf):
     # annotations on gst_buffer_extract -- before this, it had to be called with
     # a C pointer even in Python.
     if Gst.Buffer.extract.get_arguments()[1].is_caller_allocates():
-        # After the change, Gst.Buffer.extract now segfaults. Luckily, the
-        # memory leak was fixed around the same time as the introspection
-        # annotations were updated, so this is probably okay.
-        return buf.extract_dup(0, buf.get_size())
+        # After the change, Gst.Buffer.extract now segfaults, and extract_dup
+        # returns immutable bytes. Map the buffer instead and copy the mapped
+        # memory straight into a bytearray.
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            raise BufferMapFailure()
+        try:
+            return bytearray(map_info.data)
+        finally:
+            buf.unmap(map_info)
     else:
-        # Get the sample image data as a python Bytes via ctypes
-        image_data = ctypes.create_string_buffer(buf.get_size())
-        data_ptr = ctypes.cast(image_data, ctypes.c_void_p).value
-        buf.extract(0, data_ptr, buf.get_size())
-        return image_data.raw
+        # Extract straight into a bytearray via ctypes. (A ctypes string buffer
+        # would need a second copy to turn it into a python object.)
+        image_data = bytearray(buf.get_size())
+        c_array = (ctypes.c_char * len(image_data)).from_buffer(image_data)
+        buf.extract(0, ctypes.addressof(c_array), len(image_data))
+        del c_array  # Release the export so the bytearray stays resizable
+        return image_data
+
+
+def _gst_sample_format(gst_sample):
+    """Return the (format, (width, height), stride, offsets) of the image in
+    @gst_sample
+
+    For packed formats the stride is that of the only plane and the offsets
+    are None; for planar ones (I420, NV12) both are tuples with one item per
+    plane. Both are None if GStreamer can't tell.
+    """
+    caps = gst_sample.get_caps()
+    caps_struct = caps.get_structure(0)
+    frame_format = caps_struct.get_string('format')
+    frame_size = (caps_struct.get_value('width'),
+                  caps_struct.get_value('height'))
+    video_info = GstVideo.VideoInfo()
+    if not video_info.from_caps(caps):
+        return frame_format, frame_size, None, None
+    n_planes = video_info.finfo.n_planes
+    if n_planes == 1:
+        return frame_format, frame_size, video_info.stride[0], None
+    return (frame_format, frame_size, tuple(video_info.stride[:n_planes]),
+            tuple(video_info.offset[:n_planes]))
+
+
+class MappedFrame:
+    """Zero-copy access to the image in a Gst.Sample
+
+    A context object: entering it maps the sample's buffer for reading and
+    returns a Frame whose `data` is a read-only memoryview of the mapped
+    memory; leaving it releases the view and unmaps the buffer. Anything
+    created from the data (e.g. an `xnornet.Input`) must not be used after the
+    `with` block.
+
+    Recent versions of the GStreamer python overrides expose mapped memory
+    directly. Older ones copy it once into a `bytes` while mapping, which is
+    still one copy fewer than `GStreamerPipeline.get_frame()`.
+    """
+
+    def __init__(self, gst_sample):
+        self._sample = gst_sample
+        self._buffer = gst_sample.get_buffer()
+        self._map_info = None
+        self._view = None
+
+        (self.format, self.size, self.stride,
+         self.offsets) = _gst_sample_format(gst_sample)
+
+    def __enter__(self):
+        success, map_info = self._buffer.map(Gst.MapFlags.READ)
+        if not success:
+            raise BufferMapFailure()
+        self._map_info = map_info
+        self._view = memoryview(map_info.data)
+        return Frame(self.format, self.size, self._view, self.stride,
+                     self.offsets)
+
+    def __exit__(self, type, value, traceback):
+        self._view.release()
+        self._view = None
+        self._buffer.unmap(self._map_info)
+        self._map_info = None
+        return
 
 
 class GStreamerPipeline(Gtk.Window):
@@ -73,6 +176,9 @@ class GStreamerPipeline(Gtk.Window):
     ways.
     """
 
+    # The format of the frames captured by the appsink
+    _frame_format = "RGB"
+
     def __init__(self, window_title, webcam_device=None, video_input=None):
         GObject.threads_init()
         Gst.init(None)
@@ -110,6 +216,9 @@ class GStreamerPipeline(Gtk.Window):
         # Keep track of whether we are started or stopped
         self.running = False
 
+        # Background inference thread, if start_inference_worker was called
+        self._inference_worker = None
+
     def __enter__(self):
         """Pipelines are themselves context objects which manage the gstreamer
         resources. Start the pipeline.
@@ -229,13 +338,15 @@ class GStreamerPipeline(Gtk.Window):
         return source
 
     def _make_appsink(self):
-        """Creates an appsink suitable for capturing RGB frames from the source
+        """Creates an appsink that captures frames from the source in the
+        pipeline's frame format (RGB unless a subclass says otherwise)
         """
         queue = self._make_element('queue', 'appsink_queue')
         queue.props.max_size_buffers = 1
         converter = self._make_element('videoconvert', 'appsink_converter')
         capsfilter = self._make_element('capsfilter', 'appsink_capsfilter')
-        capsfilter.props.caps = Gst.Caps.from_string('video/x-raw,format=RGB')
+        capsfilter.props.caps = Gst.Caps.from_string(
+            'video/x-raw,format={}'.format(self._frame_format))
         appsink = self._make_element('appsink', 'appsink')
         appsink.props.max_buffers = 1
         appsink.props.drop = True  # Drop old buffers when queue is full
@@ -263,48 +374,134 @@ class GStreamerPipeline(Gtk.Window):
         _, cur_state, _ = self._pipeline.get_state(Gst.SECOND)
         return cur_state
 
-    ############################
-    # Start of public class API
-    ############################
-
-    def get_frame(self):
-        """Block until a frame is available, then return it as a Frame."""
-        # Refuse to do anything if stop() has been called
-        if not self.running:
-            LOG.warning("Tried to get a frame from a stopped pipeline!")
-            return None
+    def _pump_events(self):
+        """Process pending GTK events so that the window keeps updating
 
-        # Process GTK events so that the window keeps updating
-        # Doing this instead of calling Gtk.main_loop() allows us to evaluate
-        # the model on the main thread
+        Doing this instead of calling Gtk.main_loop() allows us to evaluate
+        the model on the main thread
+        """
         while Gtk.events_pending():
             Gtk.main_iteration_do(False)
 
-        # Get a sample from the pipeline
-        _, cur_state, _ = self._pipeline.get_state(Gst.SECOND)
+    def _pull_sample(self, cur_state, timeout=None):
+        """Get the newest Gst.Sample from the appsink, or None
+
+        @cur_state is the current pipeline Gst.State. With a @timeout (in
+        seconds), waits at most that long for a sample, so that callers on
+        other threads never hold the pipeline lock indefinitely.
+        """
         if cur_state == Gst.State.PLAYING:
             with self._pipeline_lock:
-                gst_sample = self._appsink.pull_sample()
+                if timeout is None:
+                    return self._appsink.pull_sample()
+                return self._appsink.try_pull_sample(
+                    int(timeout * Gst.SECOND))
         elif cur_state == Gst.State.PAUSED:
             with self._pipeline_lock:
-                gst_sample = self._appsink.pull_preroll()
-        else:
+                if timeout is None:
+                    return self._appsink.pull_preroll()
+                return self._appsink.try_pull_preroll(
+                    int(timeout * Gst.SECOND))
+        return None
+
+    @staticmethod
+    def _sample_to_frame(gst_sample):
+        """Copy the contents of a Gst.Sample into a Frame, whose data is a
+        bytearray
+        """
+        frame_format, frame_size, stride, offsets = _gst_sample_format(
+            gst_sample)
+        image_data = _gst_buffer_extract(gst_sample.get_buffer())
+        return Frame(frame_format, frame_size, image_data, stride, offsets)
+
+    def _get_sample(self):
+        """Pump GTK events, then block until a Gst.Sample is available"""
+        # Refuse to do anything if stop() has been called
+        if not self.running:
+            LOG.warning("Tried to get a frame from a stopped pipeline!")
+            return None
+
+        self._pump_events()
+
+        # Get a sample from the pipeline
+        cur_state = self._get_state()
+        if cur_state not in (Gst.State.PLAYING, Gst.State.PAUSED):
             LOG.info("Video pipeline is not playing; no frame to return")
             return None
+        gst_sample = self._pull_sample(cur_state)
 
         if gst_sample is None:
             LOG.warning("Could not pull sample")
+        return gst_sample
+
+    ############################
+    # Start of public class API
+    ############################
+
+    def get_frame(self):
+        """Block until a frame is available, then return it as a Frame.
+
+        The frame's data is a copy, in a bytearray that can be modified in
+        place (e.g. by `effects.redact`) and passed to put_frame().
+        """
+        gst_sample = self._get_sample()
+        if gst_sample is None:
             return None
+        return self._sample_to_frame(gst_sample)
 
-        data = gst_sample.get_buffer()
-        # Get the sample metadata
-        caps_struct = gst_sample.get_caps().get_structure(0)
-        frame_format = caps_struct.get_string('format')
-        frame_size = (caps_struct.get_value('width'),
-                      caps_struct.get_value('height'))
+    def get_mapped_frame(self):
+        """Block until a frame is available, then return it as a MappedFrame.
 
-        image_data = _gst_buffer_extract(data)
-        return Frame(frame_format, frame_size, image_data)
+        Unlike get_frame(), the image data is not copied out of the pipeline;
+        use the result as a context manager to access it:
+
+            mapped = pipeline.get_mapped_frame()
+            if mapped is not None:
+                with mapped as frame:
+                    ...
+        """
+        gst_sample = self._get_sample()
+        if gst_sample is None:
+            return None
+        return MappedFrame(gst_sample)
+
+    def start_inference_worker(self, evaluate, callback=None):
+        """Evaluate frames on a background thread instead of the caller's
+
+        @evaluate is called with each Frame and should return the model's
+        results for it. The worker always evaluates the newest frame available,
+        skipping any that arrived while it was busy, so capture, display and
+        inference each run at their own rate. Results are published as
+        InferenceResults, either by calling @callback on the worker thread, or
+        through get_inference_result().
+        """
+        if self._inference_worker is not None:
+            raise RuntimeError("An inference worker is already running")
+        self._inference_worker = InferenceWorker(self, evaluate, callback)
+        self._inference_worker.start()
+
+    def get_inference_result(self, timeout=0.1):
+        """Wait up to @timeout seconds for the inference worker to publish a
+        new result, keeping the window responsive meanwhile.
+
+        Returns the newest InferenceResult not returned before, or None if
+        there is none yet or the pipeline stopped. Raises the exception that
+        stopped the worker if evaluating a frame failed.
+        """
+        if self._inference_worker is None:
+            raise RuntimeError("start_inference_worker was not called")
+
+        # Wait in short slices so that key presses and window events are
+        # still handled promptly while inference is slow.
+        deadline = time.monotonic() + timeout
+        while self.running:
+            self._pump_events()
+            remaining = deadline - time.monotonic()
+            result = self._inference_worker.get_result(
+                max(0, min(remaining, 1 / 60)))
+            if result is not None or remaining <= 0:
+                return result
+        return None
 
     def play(self):
         """Resume the GStreamer pipeline"""
@@ -332,19 +529,45 @@ class GStreamerPipeline(Gtk.Window):
             self.hide()
             self.running = False
 
+        worker = self._inference_worker
+        if worker is not None:
+            worker.stop()
+            if worker is not threading.current_thread():
+                worker.join()
+
 
 class VideoOverlayPipeline(GStreamerPipeline):
     """A pipeline that can draw overlays on top of live-streaming video
 
     Uses a cairo overlay element to asynchronously update the video overlay at a
     different framerate from the underlying video.
+
+    The overlays drawn are a "scene": a tuple that is never modified, only
+    replaced. The draw callback on the streaming thread reads the current
+    scene without locking, and so never sees one half built or waits for the
+    application. set_overlays() replaces the whole scene at once, which is the
+    cheapest way to update it every frame.
+
+    With @prerender_overlays, each new scene is also drawn once into an image
+    the size of the video, on the thread that sets it, and the draw callback
+    only paints that image over every frame instead of running each overlay's
+    drawing code again. This helps when the video's frame rate is well above
+    the rate the overlays change at; run overlay_benchmark.py to compare.
     """
 
-    def __init__(self, window_title, webcam_device=None, video_input=None):
+    def __init__(self, window_title, webcam_device=None, video_input=None,
+                 prerender_overlays=False):
         super().__init__(window_title, webcam_device, video_input)
 
-        self._overlays = []
+        self._overlays = ()
+        # Only serializes the methods that change the scene
         self._overlays_lock = threading.Lock()
+        self._prerender_overlays = prerender_overlays
+        # The last scene rendered, and the surface it was rendered to
+        self._overlay_layer = None
+        # (width, height) of the frames the overlays are drawn on, as seen
+        # by the draw callback
+        self._overlay_size = None
 
     def _make_overlay(self):
         """Creates a cairo overlay element and hooks up the draw signal"""
@@ -377,14 +600,51 @@ class VideoOverlayPipeline(GStreamerPipeline):
 
     def _draw_overlays(self, surface, cr, timestamp, duration):
         """GStreamer callback for drawing our overlays to the cairooverlay"""
-        with self._overlays_lock:
-            for overlay in self._overlays:
-                overlay.draw(surface, cr, timestamp, duration)
+        # Reading the attributes is atomic, and the scene is never modified
+        scene = self._overlays
+        layer = self._overlay_layer
+        target = cr.get_target()
+        size = (target.get_width(), target.get_height())
+        self._overlay_size = size
+
+        # The layer can lag behind the scene for a moment, or have been
+        # rendered before the frame size was known
+        if (layer is not None and layer.scene is scene and
+                (layer.surface.get_width(),
+                 layer.surface.get_height()) == size):
+            cr.set_source_surface(layer.surface, 0, 0)
+            cr.paint()
+            return
+        for overlay in scene:
+            overlay.draw(surface, cr, timestamp, duration)
+
+    def _publish_overlays(self, scene):
+        """Make @scene the current scene, rendering it first when prerendering.
+        Must be called with _overlays_lock held.
+        """
+        if self._prerender_overlays:
+            size = self._overlay_size
+            if scene and size is not None:
+                self._overlay_layer = _OverlayLayer(
+                    scene, overlays.render_layer(scene, *size))
+            else:
+                self._overlay_layer = None
+        self._overlays = scene
 
     ############################
     # Start of public class API
     ############################
 
+    def set_overlays(self, overlays):
+        """Replace all overlays in the window with the ones in @overlays
+
+        The new overlays are collected first, then swapped in all at once, so
+        the window shows either the old ones or the new ones, never a mix.
+        """
+        scene = tuple(overlays)
+        with self._overlays_lock:
+            self._publish_overlays(scene)
+
     def remove_overlay(self, overlay):
         """Remove a particular overlay from the window
 
@@ -392,7 +652,9 @@ class VideoOverlayPipeline(GStreamerPipeline):
         removed/cleared, an exception will be thrown.
         """
         with self._overlays_lock:
-            self._overlays.remove(overlay)
+            scene = list(self._overlays)
+            scene.remove(overlay)
+            self._publish_overlays(tuple(scene))
 
     def add_overlay(self, overlay):
         """Add an overlay to the window
@@ -401,17 +663,32 @@ class VideoOverlayPipeline(GStreamerPipeline):
         removed or cleared.
         """
         with self._overlays_lock:
-            self._overlays.append(overlay)
+            self._publish_overlays(self._overlays + (overlay,))
 
     def clear_overlay(self):
         """Clear all overlays (bounding boxes and text) from the window."""
         with self._overlays_lock:
-            self._overlays.clear()
+            self._publish_overlays(())
 
 
 class VideoProcessingPipeline(GStreamerPipeline):
+    """A pipeline that displays frames processed by the application
+
+    Frames are captured from the source with get_frame() or
+    get_mapped_frame(), and the processed results displayed with put_frame().
+    @frame_format is the format frames are captured in: "RGB" (the default),
+    or "I420" or "NV12" to skip the conversion to RGB for effects that work on
+    YUV directly (see `effects.blur_yuv`). put_frame() accepts frames in any of
+    them.
+    """
 
-    def __init__(self, window_title, webcam_device=None, video_input=None):
+    FRAME_FORMATS = ("RGB", "I420", "NV12")
+
+    def __init__(self, window_title, webcam_device=None, video_input=None,
+                 frame_format="RGB"):
+        if frame_format not in self.FRAME_FORMATS:
+            raise ValueError("Unsupported frame format {}".format(frame_format))
+        self._frame_format = frame_format
         super().__init__(window_title, webcam_device, video_input)
 
         # Make sure the appsrc was created successfully for put_frame
@@ -460,6 +737,88 @@ class VideoProcessingPipeline(GStreamerPipeline):
         self._appsrc.push_buffer(buf)
 
 
+class InferenceWorker(threading.Thread):
+    """Evaluates the newest frame of a pipeline on a background thread
+
+    Created by GStreamerPipeline.start_inference_worker; see there for details.
+    """
+
+    # How long to wait for a new sample before checking whether to stop
+    PULL_TIMEOUT = 0.1
+
+    def __init__(self, pipeline, evaluate, callback=None):
+        super().__init__(name="InferenceWorker", daemon=True)
+        self._pipeline = pipeline
+        self._evaluate = evaluate
+        self._callback = callback
+
+        self._stopping = threading.Event()
+        # The newest result not yet handed out by get_result
+        self._result = None
+        # The exception that stopped the worker, raised again by get_result
+        self._error = None
+        self._result_ready = threading.Condition()
+
+    def run(self):
+        last_buffer_pts = None
+        while not self._stopping.is_set():
+            cur_state = self._pipeline._get_state()
+            gst_sample = self._pipeline._pull_sample(cur_state,
+                                                     self.PULL_TIMEOUT)
+            if gst_sample is None:
+                # Not playing (e.g. still starting up) or no new frame yet
+                if cur_state not in (Gst.State.PLAYING, Gst.State.PAUSED):
+                    self._stopping.wait(self.PULL_TIMEOUT)
+                continue
+
+            # While paused the appsink keeps returning the preroll buffer;
+            # don't spend the CPU evaluating the same image over and over.
+            buffer_pts = gst_sample.get_buffer().pts
+            if (buffer_pts == last_buffer_pts and
+                    buffer_pts != Gst.CLOCK_TIME_NONE):
+                self._stopping.wait(self.PULL_TIMEOUT)
+                continue
+            last_buffer_pts = buffer_pts
+
+            try:
+                frame = self._pipeline._sample_to_frame(gst_sample)
+                result = InferenceResult(frame, self._evaluate(frame))
+                if self._callback is not None:
+                    self._callback(result)
+            except Exception as e:
+                # Hand the error to whoever waits for results, rather than
+                # letting the thread die quietly and the results stop
+                LOG.exception("Inference worker failed")
+                with self._result_ready:
+                    self._error = e
+                    self._result_ready.notify_all()
+                return
+            with self._result_ready:
+                self._result = result
+                self._result_ready.notify_all()
+
+    def get_result(self, timeout=None):
+        """Return the newest result not returned before, waiting up to
+        @timeout seconds for one. Returns None if there is none.
+
+        If evaluating a frame (or the callback) raised an exception, the
+        worker has stopped, and this raises that exception instead.
+        """
+        with self._result_ready:
+            if self._result is None and self._error is None:
+                self._result_ready.wait(timeout)
+            if self._error is not None:
+                raise self._error
+            result, self._result = self._result, None
+            return result
+
+    def stop(self):
+        """Ask the worker to exit after its current evaluation"""
+        self._stopping.set()
+        with self._result_ready:
+            self._result_ready.notify_all()
+
+
 class CreateFailure(Exception):
 
     def __str__(self):
@@ -474,6 +833,12 @@ class LinkFailure(Exception):
         super().__init__(message_formatter.format(src=src.name, dest=sink.name))
 
 
+class BufferMapFailure(Exception):
+
+    def __init__(self):
+        super().__init__('ERROR: Unable to map buffer for reading')
+
+
 class StateChangeFail(Exception):
 
     def __init__(self, state):
@@ -0,0 +1,116 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""A pool of independently loaded Xnor models for concurrent evaluation.
+
+`xnornet.Model.evaluate` is not thread-safe: a single model can only evaluate
+one input at a time. Separately loaded models, however, can be evaluated
+concurrently. A ModelPool owns a number of such models and hands each
+evaluation to whichever one is idle, so that many-core hosts can run several
+inferences at once instead of one model at a time.
+"""
+
+import concurrent.futures
+import os
+import queue
+
+import xnornet
+
+
+class ModelPool:
+    """Evaluates inputs on a fixed number of independently loaded models.
+
+    - `size`: number of models to load. Defaults to the number of CPUs.
+    - `threading_model`: threading model passed to every model in the pool,
+      e.g. `xnornet.Model.SINGLE_THREADED`. Defaults to single-threaded when
+      the pool holds more than one model (one model per core), and to the
+      library default otherwise.
+    - `loader`: callable used to load each model; it receives the threading
+      model as a keyword argument. Defaults to `xnornet.Model.load_built_in`.
+
+    The pool is a context object; leaving the `with` block waits for pending
+    evaluations and releases the worker threads.
+    """
+
+    def __init__(self, size=None, threading_model=None, loader=None):
+        if size is None:
+            size = os.cpu_count() or 1
+        if size < 1:
+            raise ValueError("ModelPool size must be at least 1")
+        if threading_model is None:
+            threading_model = (xnornet.Model.SINGLE_THREADED
+                               if size > 1 else xnornet.Model.MULTI_THREADED)
+        if loader is None:
+            loader = xnornet.Model.load_built_in
+
+        self.size = size
+        self.threading_model = threading_model
+
+        self._models = [loader(threading_model=threading_model)
+                        for _ in range(size)]
+        # Models not currently evaluating anything. Every worker takes one out
+        # for the duration of an evaluation, so no model is ever used by two
+        # threads at once.
+        self._idle_models = queue.Queue()
+        for model in self._models:
+            self._idle_models.put(model)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return
+
+    def _evaluate_on_idle_model(self, model_input):
+        model = self._idle_models.get()
+        try:
+            return model.evaluate(model_input)
+        finally:
+            self._idle_models.put(model)
+
+    @property
+    def name(self):
+        return self._models[0].name
+
+    @property
+    def version(self):
+        return self._models[0].version
+
+    @property
+    def result_type(self):
+        return self._models[0].result_type
+
+    @property
+    def classes(self):
+        return self._models[0].classes
+
+    ############################
+    # Start of public class API
+    ############################
+
+    def submit(self, model_input):
+        """Queue @model_input for evaluation on the next idle model.
+
+        Returns a `concurrent.futures.Future` whose result is the evaluation
+        result list. @model_input (and the data it was created from) must stay
+        alive until the future completes.
+        """
+        return self._executor.submit(self._evaluate_on_idle_model, model_input)
+
+    def evaluate(self, model_input):
+        """Evaluate @model_input on the next idle model and return the results.
+
+        Blocks until a model is available and the evaluation has finished.
+        Safe to call from any number of threads at once.
+        """
+        return self.submit(model_input).result()
+
+    def map(self, model_inputs):
+        """Evaluate every input in @model_inputs, yielding results in order."""
+        return self._executor.map(self._evaluate_on_idle_model, model_inputs)
+
+    def close(self):
+        """Wait for pending evaluations and shut down the worker threads."""
+        self._executor.shutdown(wait=True)
@@ -5,9 +5,16 @@ Overlays are objects that support a "draw()" method that takes a
 gstreamer surface, a cairo context, a timestamp, and a duration (see
 https://gstreamer.freedesktop.org/data/doc/gstreamer/head/gst-plugins-good/html/gst-plugins-good-plugins-cairooverlay.html
 for an explanation of the meaning of these parameters).
+
+The labels the overlays show are few and repeat every frame, so each line of
+text is rendered once, with its background plate, into a surface kept in
+LABEL_CACHE, and only copied onto the frame from then on.
 """
 
+import collections
+import math
 import os
+import threading
 
 import cairo
 
@@ -26,11 +33,125 @@ def readable_text_color(bg_color):
         return (1.0, 1.0, 1.0)
 
 
+Label = collections.namedtuple("Label", ["surface", "advance"])
+Label.__doc__ = """\
+A rendered line of text on its background plate.
+- `surface`: a `cairo.ImageSurface` holding it
+- `advance`: how far down the next line starts
+"""
+
+
+class LabelCache:
+    """A least recently used cache of rendered Labels.
+
+    Labels are keyed by their text, colors, font and sizes, and rendered the
+    first time they're asked for. `hits` and `misses` count the lookups that
+    found a label and the ones that had to render one; see `hit_rate` and
+    `stats()` for tuning `max_size`. Safe to use from several threads.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._labels = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # For measuring text before a surface of the right size exists
+        self._measure_context = cairo.Context(
+            cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+
+    def __len__(self):
+        return len(self._labels)
+
+    @property
+    def hit_rate(self):
+        """Fraction of the lookups that found a rendered label"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return ("{} labels cached, {} hits, {} misses ({:.1%} hit rate)"
+                .format(len(self), self.hits, self.misses, self.hit_rate))
+
+    def clear(self):
+        with self._lock:
+            self._labels.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, line, text_color, background_color, font, text_size,
+            line_width):
+        """Return the Label for a line of text drawn as by Text"""
+        key = (line, tuple(text_color), tuple(background_color), font,
+               text_size, line_width)
+        with self._lock:
+            label = self._labels.get(key)
+            if label is not None:
+                self._labels.move_to_end(key)
+                self.hits += 1
+                return label
+            self.misses += 1
+            label = self._render(*key)
+            self._labels[key] = label
+            while len(self._labels) > self.max_size:
+                self._labels.popitem(last=False)
+            return label
+
+    def _render(self, line, text_color, background_color, font, text_size,
+                line_width):
+        cr = self._measure_context
+        cr.select_font_face(font, cairo.FONT_SLANT_NORMAL,
+                            cairo.FONT_WEIGHT_BOLD)
+        cr.set_font_size(text_size)
+        # Layout as in Text.draw: the plate is a line width wider than the
+        # text, and its height puts the baseline of a text_size high line in
+        # the middle
+        text_x = line_width / 2
+        text_y = line_width * 1.5 + text_size / 2
+        plate_width = text_x + cr.text_extents(line)[4] + line_width / 2
+        plate_height = text_y + line_width
+
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                     math.ceil(plate_width),
+                                     math.ceil(plate_height))
+        cr = cairo.Context(surface)
+        cr.set_source_rgb(*background_color)
+        cr.rectangle(0, 0, plate_width, plate_height)
+        cr.fill()
+        cr.move_to(text_x, text_y)
+        cr.set_source_rgb(*text_color)
+        cr.select_font_face(font, cairo.FONT_SLANT_NORMAL,
+                            cairo.FONT_WEIGHT_BOLD)
+        cr.set_font_size(text_size)
+        cr.show_text(line)
+        surface.flush()
+        return Label(surface, plate_height)
+
+
+# Shared by all Text overlays (and so the BoundingBox and FilledBox labels)
+LABEL_CACHE = LabelCache()
+
+
+def render_layer(overlays, width, height):
+    """Draw @overlays onto a new, transparent @width x @height ARGB
+    `cairo.ImageSurface`, which can then be painted over any number of frames
+    of that size in one go. The overlays' draw() methods are passed None for
+    the gstreamer surface, timestamp and duration.
+    """
+    layer = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    cr = cairo.Context(layer)
+    for overlay in overlays:
+        overlay.draw(None, cr, None, None)
+    layer.flush()
+    return layer
+
+
 class BoundingBox:
     """Bounding box overlay: a labeled rectangle at some position with some size
 
     `class_id` is used to determine the color of the bounding box.
     """
+    __slots__ = ("x", "y", "width", "height", "text", "color")
     LINE_WIDTH = 8
 
     def __init__(self, x=0, y=0, width=0, height=0, text=None,
@@ -63,9 +184,8 @@ class BoundingBox:
         cr.stroke()
 
         if self.text:
-            self.text_overlay = Text(self.text, x_absolute, y_absolute,
-                                     self.color)
-            self.text_overlay.draw(surface, cr, timestamp, duration)
+            text_overlay = Text(self.text, x_absolute, y_absolute, self.color)
+            text_overlay.draw(surface, cr, timestamp, duration)
 
 
 class FilledBox:
@@ -73,6 +193,7 @@ class FilledBox:
 
     Takes same arguments as BoundingBox plus opacity
     """
+    __slots__ = ("x", "y", "width", "height", "text", "opacity", "color")
 
     def __init__(self, x=0, y=0, width=0, height=0, text=None,
                  bg_color=(1.0, 1.0, 1.0), opacity=1):
@@ -111,6 +232,7 @@ class Text:
     Both x and y must be absolute pixel location.
     Multi-line text is also supported by separating the lines with os.linesep.
     """
+    __slots__ = ("text", "x", "y", "background_color", "text_color")
     LINE_WIDTH = BoundingBox.LINE_WIDTH
     FONT = "Courier"
     TEXT_SIZE = LINE_WIDTH * 3
@@ -129,29 +251,15 @@ class Text:
         y = self.y + self.LINE_WIDTH
 
         for line in self.text.split(os.linesep):
-            # Write the current line at (x, y) in a group, to get the text size
-            # but don't draw it yet.
-            cr.push_group()
-            cr.move_to(x + self.LINE_WIDTH / 2,
-                       y + self.LINE_WIDTH * 1.5 + self.TEXT_SIZE / 2)
-            cr.set_source_rgb(*self.text_color)
-            cr.set_font_size(self.TEXT_SIZE)
-            cr.select_font_face(self.FONT, cairo.FONT_SLANT_NORMAL,
-                                cairo.FONT_WEIGHT_BOLD)
-            cr.show_text(line)
-            line_width = cr.get_current_point()[0] - x
-            line_height = cr.get_current_point()[1] - y
-            text_surface = cr.pop_group()
-
-            # Draw the background rectangle first
-            cr.set_source_rgb(*self.background_color)
-            cr.set_line_width(2)
-            cr.rectangle(x, y, line_width + self.LINE_WIDTH / 2,
-                         line_height + self.LINE_WIDTH)
+            # The line and its background, rendered once and then copied.
+            # Whole pixel positions copy it as is, rather than resampled.
+            label = LABEL_CACHE.get(line, self.text_color,
+                                    self.background_color, self.FONT,
+                                    self.TEXT_SIZE, self.LINE_WIDTH)
+            label_x, label_y = round(x), round(y)
+            cr.set_source_surface(label.surface, label_x, label_y)
+            cr.rectangle(label_x, label_y, label.surface.get_width(),
+                         label.surface.get_height())
             cr.fill()
 
-            # Now draw the text on top of the rectangle
-            cr.set_source(text_surface)
-            cr.paint()
-
-            y += (line_height + self.LINE_WIDTH)
+            y += label.advance
@@ -0,0 +1,198 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Detect small objects in large frames by evaluating them tile by tile.
+
+Detection models scale every input down to their own resolution, so in a 4K
+frame a person a few dozen pixels tall shrinks to a couple of pixels and is
+missed. A TiledEvaluator instead cuts the frame into overlapping tiles about
+the model's size (see the "minimum effective image size" in the model's
+README), evaluates them concurrently on a ModelPool, and merges the boxes
+found in each tile back into one list for the whole frame:
+
+    with ModelPool() as pool:
+        evaluator = TiledEvaluator(pool, tile_size=(448, 256))
+        for item in evaluator.evaluate(frame_size, rgb_data):
+            ...  # Like an xnornet.BoundingBox
+
+Objects in the overlap between tiles are found more than once, and objects
+larger than the overlap may be cut in two at a tile's edge. Both are merged by
+per-class non-maximum suppression: boxes are kept largest first, and a box
+that mostly lies within a kept box of the same class is dropped.
+"""
+
+import collections
+import math
+
+import xnornet
+
+Rectangle = collections.namedtuple("Rectangle",
+                                   ["x", "y", "width", "height"])
+Rectangle.__doc__ = """\
+A rectangle in coordinates relative to the frame size, like an
+`xnornet.Rectangle`
+"""
+
+BoundingBox = collections.namedtuple("BoundingBox",
+                                     ["class_label", "rectangle"])
+BoundingBox.__doc__ = """\
+A detected object, with the same attributes as an `xnornet.BoundingBox`. The
+`rectangle` is relative to the whole frame, not the tile it was found in.
+"""
+
+Tile = collections.namedtuple("Tile", ["x", "y", "width", "height"])
+Tile.__doc__ = "A part of a frame, in pixels"
+
+# How boxes are compared by the non-maximum suppression: intersection over
+# union, or intersection over the area of the smaller box, which also catches
+# a box cut off at a tile's edge lying inside the whole one
+MATCH_METRICS = ("ios", "iou")
+
+
+def _tile_starts(size, tile_size, overlap):
+    """Return where tiles @tile_size long start along an axis @size long, so
+    that neighbours share at least @overlap pixels and the last tile ends at
+    the end of the axis
+    """
+    if size <= tile_size:
+        return [0]
+    count = math.ceil((size - overlap) / (tile_size - overlap))
+    return [round(i * (size - tile_size) / (count - 1)) for i in range(count)]
+
+
+def _overlap(rect, other_rect, match_metric):
+    width = (min(rect.x + rect.width, other_rect.x + other_rect.width) -
+             max(rect.x, other_rect.x))
+    height = (min(rect.y + rect.height, other_rect.y + other_rect.height) -
+              max(rect.y, other_rect.y))
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area = rect.width * rect.height
+    other_area = other_rect.width * other_rect.height
+    if match_metric == "ios":
+        denominator = min(area, other_area)
+    else:
+        denominator = area + other_area - intersection
+    return intersection / denominator if denominator > 0 else 0.0
+
+
+def non_max_suppression(boxes, threshold=0.6, match_metric="ios"):
+    """Merge duplicate detections of the same object.
+
+    Returns the @boxes (anything with `class_label` and `rectangle`) left
+    after going through them from the largest to the smallest and dropping
+    each one that overlaps a box kept before it, of the same class, by at
+    least @threshold by @match_metric (one of MATCH_METRICS). Detections
+    have no confidence score, so size decides: a box cut off at a tile's edge
+    is always smaller than the whole one.
+    """
+    if match_metric not in MATCH_METRICS:
+        raise ValueError("match_metric must be one of {}".format(
+            ", ".join(MATCH_METRICS)))
+    kept_by_class = collections.defaultdict(list)
+    kept = []
+    for box in sorted(boxes, key=lambda box: (box.rectangle.width *
+                                              box.rectangle.height),
+                      reverse=True):
+        same_class = kept_by_class[box.class_label.class_id]
+        if any(_overlap(box.rectangle, other.rectangle, match_metric) >=
+               threshold for other in same_class):
+            continue
+        same_class.append(box)
+        kept.append(box)
+    return kept
+
+
+class TiledEvaluator:
+    """Evaluates large RGB frames as overlapping tiles on a pool of models.
+
+    - `model`: a `ModelPool` (see model_pool.py), or anything else with a
+      `submit(model_input)` method returning a future of the results. The
+      tiles of a frame are submitted all at once, so a pool of N models
+      evaluates N of them concurrently.
+    - `tile_size`: (width, height) of the tiles in pixels. The model's
+      minimum effective image size is a good start; smaller tiles find
+      smaller objects, but there are more of them to evaluate.
+    - `overlap`: the fraction of a tile's width (and height) that neighbouring
+      tiles share at least. Objects smaller than the overlap are always
+      inside some tile whole.
+    - `full_frame`: also evaluate the whole frame, scaled down by the model
+      as usual, to find objects too large for any one tile
+    - `nms_threshold`, `match_metric`: see non_max_suppression
+    """
+
+    def __init__(self, model, tile_size=(448, 256), overlap=0.2,
+                 full_frame=True, nms_threshold=0.6, match_metric="ios"):
+        if tile_size[0] < 1 or tile_size[1] < 1:
+            raise ValueError("tile_size must be positive")
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap must be at least 0 and less than 1")
+        if match_metric not in MATCH_METRICS:
+            raise ValueError("match_metric must be one of {}".format(
+                ", ".join(MATCH_METRICS)))
+        if (model.result_type !=
+                xnornet.EvaluationResultType.BOUNDING_BOXES):
+            raise ValueError("TiledEvaluator requires a detection model")
+        self.model = model
+        self.tile_size = tuple(tile_size)
+        self.overlap = overlap
+        self.full_frame = full_frame
+        self.nms_threshold = nms_threshold
+        self.match_metric = match_metric
+
+    def tiles(self, frame_size):
+        """Return the Tiles a frame of @frame_size = (width, height) is cut
+        into, row by row
+        """
+        width, height = frame_size
+        tile_width = min(self.tile_size[0], width)
+        tile_height = min(self.tile_size[1], height)
+        x_starts = _tile_starts(width, tile_width,
+                                int(tile_width * self.overlap))
+        y_starts = _tile_starts(height, tile_height,
+                                int(tile_height * self.overlap))
+        return [Tile(x, y, tile_width, tile_height)
+                for y in y_starts for x in x_starts]
+
+    @staticmethod
+    def _crop(frame_size, data, tile):
+        """Copy the RGB pixels of @tile out of a packed RGB frame"""
+        row_size = frame_size[0] * 3
+        view = memoryview(data)
+        start = tile.y * row_size + tile.x * 3
+        tile_row_size = tile.width * 3
+        return b"".join(
+            view[row:row + tile_row_size]
+            for row in range(start, start + tile.height * row_size, row_size))
+
+    def evaluate(self, frame_size, data):
+        """Evaluate a packed RGB frame (as for `xnornet.Input.rgb_image`) of
+        @frame_size = (width, height) and return the merged BoundingBoxes
+        found in it
+        """
+        width, height = frame_size
+        tiles = self.tiles(frame_size)
+        # The tile data must outlive the evaluations, which hold on to it
+        # through their inputs
+        jobs = []
+        for tile in tiles:
+            tile_data = self._crop(frame_size, data, tile)
+            model_input = xnornet.Input.rgb_image((tile.width, tile.height),
+                                                  tile_data)
+            jobs.append((tile, tile_data, self.model.submit(model_input)))
+        if self.full_frame and len(tiles) > 1:
+            model_input = xnornet.Input.rgb_image(frame_size, data)
+            jobs.append((Tile(0, 0, width, height), data,
+                         self.model.submit(model_input)))
+
+        boxes = []
+        for tile, _, future in jobs:
+            for item in future.result():
+                rect = item.rectangle
+                boxes.append(BoundingBox(item.class_label, Rectangle(
+                    (tile.x + rect.x * tile.width) / width,
+                    (tile.y + rect.y * tile.height) / height,
+                    rect.width * tile.width / width,
+                    rect.height * tile.height / height)))
+        return non_max_suppression(boxes, self.nms_threshold,
+                                   self.match_metric)
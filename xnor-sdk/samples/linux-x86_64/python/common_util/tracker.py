@@ -0,0 +1,264 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Carry detected objects forward between runs of a detection model.
+
+Running a detection model on every frame limits a live overlay to the model's
+frame rate. A BoxTracker instead remembers where each object was and how fast
+it was moving, so that the model only needs to run on some of the frames and
+the boxes can be moved along on the frames in between. A DetectionScheduler
+decides which frames those are: every Nth one, or adaptively, as often as the
+tracker's predictions need correcting:
+
+    tracker = BoxTracker()
+    scheduler = DetectionScheduler(max_interval=4, adaptive=True)
+    while running:
+        frame = ...
+        now = time.monotonic()
+        if scheduler.next_frame():
+            results = model.evaluate(...)
+            scheduler.report_quality(tracker.update(results, now))
+        for box in tracker.predict(now):
+            ...  # box.rectangle, box.class_label, like an xnornet.BoundingBox
+
+Boxes are matched to tracks by their overlap (intersection over union) with
+where the tracks predict them to be, computed for all pairs at once with
+NumPy.
+"""
+
+import collections
+
+import numpy as np
+
+Rectangle = collections.namedtuple("Rectangle",
+                                   ["x", "y", "width", "height"])
+Rectangle.__doc__ = """\
+A rectangle in coordinates relative to the frame size, like an
+`xnornet.Rectangle`
+"""
+
+TrackedBox = collections.namedtuple("TrackedBox",
+                                    ["rectangle", "class_label", "track_id"])
+TrackedBox.__doc__ = """\
+Where a tracked object is predicted to be. Has the same `rectangle` and
+`class_label` as an `xnornet.BoundingBox`, so it can be drawn the same way.
+- `track_id`: a number identifying the object for as long as it is tracked
+"""
+
+
+def _centers(rectangles):
+    """Convert an n x 4 array of (x, y, width, height) rectangles to
+    (center x, center y, width, height)
+    """
+    centers = rectangles.copy()
+    centers[:, :2] += centers[:, 2:] / 2
+    return centers
+
+
+def _iou_matrix(boxes, other_boxes):
+    """Return the intersection over union of every box in the n x 4 array
+    @boxes with every box in the m x 4 array @other_boxes, as an n x m array.
+    Boxes are given as (center x, center y, width, height).
+    """
+    low = boxes[:, np.newaxis, :2] - boxes[:, np.newaxis, 2:] / 2
+    high = boxes[:, np.newaxis, :2] + boxes[:, np.newaxis, 2:] / 2
+    other_low = (other_boxes[np.newaxis, :, :2] -
+                 other_boxes[np.newaxis, :, 2:] / 2)
+    other_high = (other_boxes[np.newaxis, :, :2] +
+                  other_boxes[np.newaxis, :, 2:] / 2)
+    overlap = np.clip(np.minimum(high, other_high) -
+                      np.maximum(low, other_low), 0, None)
+    intersection = overlap[:, :, 0] * overlap[:, :, 1]
+    union = (boxes[:, np.newaxis, 2] * boxes[:, np.newaxis, 3] +
+             other_boxes[np.newaxis, :, 2] * other_boxes[np.newaxis, :, 3] -
+             intersection)
+    return np.divide(intersection, union, out=np.zeros_like(intersection),
+                     where=union > 0)
+
+
+class BoxTracker:
+    """Tracks the boxes a detection model returns from one evaluation to the
+    next, and predicts where they are in between.
+
+    - `min_iou`: how much a detected box must overlap a track's predicted box
+      to be taken as the same object
+    - `max_misses`: how many evaluations in a row a track may go unmatched
+      before it is dropped. Until then it keeps moving at its last velocity.
+    - `smoothing`: weight of each new measurement in a track's velocity
+
+    Boxes are only matched to tracks of the same class.
+    """
+
+    def __init__(self, min_iou=0.3, max_misses=1, smoothing=0.5):
+        self.min_iou = min_iou
+        self.max_misses = max_misses
+        self.smoothing = smoothing
+
+        # One row per track; boxes as (center x, center y, width, height) at
+        # the time of their last detection, velocities in the same units per
+        # second
+        self._boxes = np.zeros((0, 4))
+        self._velocities = np.zeros((0, 4))
+        self._times = np.zeros(0)
+        self._misses = np.zeros(0, dtype=int)
+        self._class_ids = np.zeros(0, dtype=int)
+        self._track_ids = np.zeros(0, dtype=int)
+        self._class_labels = []
+        self._next_track_id = 0
+
+    def __len__(self):
+        return len(self._track_ids)
+
+    def _predicted_boxes(self, timestamp):
+        elapsed = (timestamp - self._times)[:, np.newaxis]
+        boxes = self._boxes + self._velocities * elapsed
+        boxes[:, 2:] = np.maximum(boxes[:, 2:], 0)
+        return boxes
+
+    def _match(self, ious):
+        """Greedily pair tracks and detections, best overlap first. Returns
+        the track indices, detection indices and IOUs of the pairs.
+        """
+        candidates = np.argwhere(ious >= self.min_iou)
+        order = np.argsort(-ious[candidates[:, 0], candidates[:, 1]],
+                           kind="stable")
+        used_tracks, used_detections = set(), set()
+        tracks, detections = [], []
+        for track, detection in candidates[order]:
+            if track in used_tracks or detection in used_detections:
+                continue
+            used_tracks.add(track)
+            used_detections.add(detection)
+            tracks.append(track)
+            detections.append(detection)
+        tracks = np.array(tracks, dtype=int)
+        detections = np.array(detections, dtype=int)
+        return tracks, detections, ious[tracks, detections]
+
+    def update(self, results, timestamp):
+        """Update the tracks with the `xnornet.BoundingBox` @results of an
+        evaluation of the frame captured at @timestamp (in seconds).
+
+        Returns how well the tracks had predicted the results, from 0 to 1:
+        the total IOU of the matched boxes divided by the number of tracks or
+        of results, whichever is larger (1 if both are 0).
+        """
+        results = list(results)
+        detected = _centers(np.array(
+            [[item.rectangle.x, item.rectangle.y, item.rectangle.width,
+              item.rectangle.height] for item in results],
+            dtype=float).reshape(-1, 4))
+        class_ids = np.array([item.class_label.class_id for item in results],
+                             dtype=int)
+
+        predicted = self._predicted_boxes(timestamp)
+        ious = _iou_matrix(predicted, detected)
+        ious[self._class_ids[:, np.newaxis] != class_ids[np.newaxis, :]] = 0
+        tracks, detections, matched_ious = self._match(ious)
+        quality = 1.0
+        if len(self) or len(results):
+            quality = float(matched_ious.sum()) / max(len(self), len(results))
+
+        # Matched tracks jump to the detected boxes
+        elapsed = timestamp - self._times[tracks]
+        moving = elapsed > 0
+        velocities = ((detected[detections[moving]] -
+                       self._boxes[tracks[moving]]) /
+                      elapsed[moving, np.newaxis])
+        self._velocities[tracks[moving]] = (
+            self.smoothing * velocities +
+            (1 - self.smoothing) * self._velocities[tracks[moving]])
+        self._boxes[tracks] = detected[detections]
+        self._times[tracks] = timestamp
+        for track, detection in zip(tracks, detections):
+            self._class_labels[track] = results[detection].class_label
+
+        # Unmatched tracks coast, and are dropped when they've missed too
+        # many evaluations
+        self._misses += 1
+        self._misses[tracks] = 0
+        keep = self._misses <= self.max_misses
+        self._boxes = self._boxes[keep]
+        self._velocities = self._velocities[keep]
+        self._times = self._times[keep]
+        self._misses = self._misses[keep]
+        self._class_ids = self._class_ids[keep]
+        self._track_ids = self._track_ids[keep]
+        self._class_labels = [label for label, kept in
+                              zip(self._class_labels, keep) if kept]
+
+        # Unmatched detections start new, stationary tracks
+        new = np.setdiff1d(np.arange(len(results)), detections)
+        new_track_ids = np.arange(self._next_track_id,
+                                  self._next_track_id + len(new))
+        self._next_track_id += len(new)
+        self._boxes = np.concatenate((self._boxes, detected[new]))
+        self._velocities = np.concatenate(
+            (self._velocities, np.zeros((len(new), 4))))
+        self._times = np.concatenate(
+            (self._times, np.full(len(new), float(timestamp))))
+        self._misses = np.concatenate(
+            (self._misses, np.zeros(len(new), dtype=int)))
+        self._class_ids = np.concatenate((self._class_ids, class_ids[new]))
+        self._track_ids = np.concatenate((self._track_ids, new_track_ids))
+        self._class_labels.extend(results[i].class_label for i in new)
+        return quality
+
+    def predict(self, timestamp):
+        """Return a TrackedBox for every track, moved along to where it
+        should be at @timestamp (in seconds)
+        """
+        boxes = self._predicted_boxes(timestamp)
+        boxes[:, :2] -= boxes[:, 2:] / 2
+        return [TrackedBox(Rectangle(*box.tolist()), class_label, track_id)
+                for box, class_label, track_id in zip(
+                    boxes, self._class_labels, self._track_ids.tolist())]
+
+
+class DetectionScheduler:
+    """Decides which frames to run the detection model on.
+
+    - `max_interval`: run the model at least once every this many frames
+    - `adaptive`: if False, run the model on every `max_interval`th frame.
+      If True, start with every frame and skip one more frame between
+      evaluations each time the tracker predicted the results well (see
+      `report_quality`), up to `max_interval`; go back to every frame as soon
+      as it didn't.
+    - `min_quality`: the lowest `BoxTracker.update` result that counts as
+      predicting the results well
+
+    `frames` and `evaluations` count the frames seen and the ones the model
+    ran on.
+    """
+
+    def __init__(self, max_interval, adaptive=False, min_quality=0.5):
+        if max_interval < 1:
+            raise ValueError("max_interval must be at least 1")
+        self.max_interval = max_interval
+        self.adaptive = adaptive
+        self.min_quality = min_quality
+        self.interval = 1 if adaptive else max_interval
+        self.frames = 0
+        self.evaluations = 0
+        self._frames_left = 0
+
+    def next_frame(self):
+        """Count a new frame, and return whether to run the model on it"""
+        self.frames += 1
+        self._frames_left -= 1
+        if self._frames_left > 0:
+            return False
+        self.evaluations += 1
+        self._frames_left = self.interval
+        return True
+
+    def report_quality(self, quality):
+        """Adapt the interval to how well the tracker predicted the results
+        of the last evaluation (the result of `BoxTracker.update`)
+        """
+        if not self.adaptive:
+            return
+        if quality >= self.min_quality:
+            self.interval = min(self.interval + 1, self.max_interval)
+        else:
+            self.interval = 1
+        self._frames_left = self.interval
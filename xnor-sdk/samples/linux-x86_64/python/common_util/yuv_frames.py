@@ -0,0 +1,77 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Helpers for frames in the planar YUV 4:2:0 formats I420 and NV12.
+
+I420 frames have a full resolution Y plane followed by U and V planes of half
+the width and height; NV12 frames have a Y plane followed by a single plane of
+interleaved U and V samples. GStreamer pads each plane's rows to a multiple of
+4 bytes, so a Frame (see gstreamer_video_pipeline.py) in one of these formats
+carries the `stride` and `offsets` of every plane.
+
+This module doesn't need GStreamer, so that it can be shared with tools like
+effects_benchmark.py.
+"""
+
+YUV_FORMATS = ("I420", "NV12")
+
+
+def _round_up(value, multiple):
+    return (value + multiple - 1) // multiple * multiple
+
+
+def _plane_shapes(frame_format, size):
+    """Return the (row size in bytes, rows) of each plane of a frame"""
+    width, height = size
+    chroma_width, chroma_height = (width + 1) // 2, (height + 1) // 2
+    if frame_format == "I420":
+        return ((width, height), (chroma_width, chroma_height),
+                (chroma_width, chroma_height))
+    if frame_format == "NV12":
+        return ((width, height), (2 * chroma_width, chroma_height))
+    raise ValueError("Bad frame format {}! Expected I420 or NV12".format(
+        frame_format))
+
+
+def default_layout(frame_format, size):
+    """Return the (strides, offsets, buffer size) GStreamer uses for a frame
+    of @frame_format and @size = (width, height) when the caps don't say
+    otherwise. This is also the layout of the frames the YUV effects return.
+    """
+    shapes = _plane_shapes(frame_format, size)
+    strides = tuple(_round_up(row_size, 4) for row_size, _ in shapes)
+    # The Y plane is laid out for an even number of rows, like the chroma
+    # planes are
+    plane_rows = [_round_up(size[1], 2)] + [rows for _, rows in shapes[1:]]
+    offsets = []
+    buffer_size = 0
+    for rows, stride in zip(plane_rows, strides):
+        offsets.append(buffer_size)
+        buffer_size += stride * rows
+    return strides, tuple(offsets), buffer_size
+
+
+def planes(frame):
+    """Return the planes of an I420 or NV12 Frame, with no padding between
+    rows, as needed by `xnornet.Input.yuv420p_image` (Y, U, V) and
+    `xnornet.Input.yuv420sp_nv12_image` (Y, UV).
+
+    Planes whose rows aren't padded are memoryviews into `frame.data`, so they
+    are only valid as long as it is; the others are copied.
+    """
+    shapes = _plane_shapes(frame.format, frame.size)
+    strides, offsets = frame.stride, frame.offsets
+    if strides is None or offsets is None:
+        default_strides, default_offsets, _ = default_layout(frame.format,
+                                                             frame.size)
+        strides = strides if strides is not None else default_strides
+        offsets = offsets if offsets is not None else default_offsets
+    data = memoryview(frame.data)
+    result = []
+    for (row_size, rows), stride, offset in zip(shapes, strides, offsets):
+        if stride == row_size:
+            result.append(data[offset:offset + row_size * rows])
+        else:
+            result.append(b"".join(
+                data[start:start + row_size]
+                for start in range(offset, offset + stride * rows, stride)))
+    return result
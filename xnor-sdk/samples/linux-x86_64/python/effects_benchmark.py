@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Xnor.ai, Inc.
+"""
+Simple utility for benchmarking the native effects used by the GStreamer
+background blur and greenscreen samples.
+
+Times `effects.blur` or `effects.background_mask` on synthetic frames. With
+--stress, the effect also runs alongside a thread that keeps evaluating an Xnor
+model, to show how much of the two overlap. Combine with the offline stand-in
+model to run without a model wheel installed:
+
+    PYTHONPATH=fake_xnornet python3 effects_benchmark.py --stress
+
+The effects use the fastest SIMD instruction set the CPU supports. --isa picks
+another one, and --check_isas checks that every available instruction set
+produces the same output as the scalar code for every effect, including
+redact and frames of a few pixels, timing each. It exits with status 1 on any
+mismatch, so CI can run it.
+
+With --frame_format I420 or NV12, the YUV variants of the effects
+(`effects.blur_yuv` and `effects.background_mask_yuv`) are timed instead.
+
+Without the extension, the NumPy version of the effects in
+common_util/effects_numpy.py is timed. --backend picks one explicitly, and
+--compare_backends times both and reports how much their results differ.
+"""
+import collections
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+if sys.version_info[0] < 3:
+    sys.exit("This sample requires Python 3. Please install Python 3!")
+
+from common_util import yuv_frames
+
+# Implementations of the effects that can be imported, fastest first
+BACKENDS = collections.OrderedDict()
+try:
+    # See common_util/effects.cc for implementation
+    import xnor_util.effects
+    BACKENDS["native"] = xnor_util.effects
+except ImportError:
+    pass
+try:
+    import common_util.effects_numpy
+    BACKENDS["numpy"] = common_util.effects_numpy
+except ImportError:
+    pass
+if not BACKENDS:
+    sys.exit("Unable to import the effects module! Please build it with:\n\n"
+             "    python3 setup.py install --user\n\n"
+             "(drop the --user if you are using a virtualenv)")
+# The backend being benchmarked; see --backend
+effects = next(iter(BACKENDS.values()))
+
+EFFECTS = ("blur", "background_mask")
+MASK_FILTERS = ("nearest", "bilinear")
+SWEEP_RESOLUTIONS = ((1280, 720), (1920, 1080))
+# Bytes per pixel of the packed formats
+FRAME_FORMATS = {"RGB": 3, "RGBA": 4, "RGBx": 4, "BGRA": 4, "BGRx": 4}
+
+
+class SyntheticMask:
+    """Stands in for an `xnornet.SegmentationMask`: a random 1-bit mask"""
+
+    def __init__(self, size):
+        self.width, self.height = size
+        self._stride = (self.width + 7) // 8
+        self._data = _random_bytes(self._stride * self.height)
+
+    def to_bytes(self):
+        return self._data
+
+
+def _random_bytes(size):
+    return random.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def _make_frame(size, frame_format="RGB"):
+    # Same layout as common_util.gstreamer_video_pipeline.Frame, which needs
+    # GStreamer to import. YUV frames use GStreamer's default layout.
+    if frame_format in yuv_frames.YUV_FORMATS:
+        return (frame_format, size, _random_bytes(
+            yuv_frames.default_layout(frame_format, size)[2]))
+    pixel_size = FRAME_FORMATS[frame_format]
+    return (frame_format, size,
+            _random_bytes(size[0] * size[1] * pixel_size))
+
+
+def _effect_functions(frame_format):
+    """Returns the (blur, background_mask) functions for frames of
+    @frame_format
+    """
+    if frame_format in yuv_frames.YUV_FORMATS:
+        if not hasattr(effects, "blur_yuv"):
+            sys.exit("Only the native effects support {} frames".format(
+                frame_format))
+        return effects.blur_yuv, effects.background_mask_yuv
+    return effects.blur, effects.background_mask
+
+
+def _parse_resolution(text):
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected a resolution like 1280x720, got {!r}".format(text))
+    return width, height
+
+
+def make_effect(args):
+    """Returns a no-argument function that applies the chosen effect once"""
+    frame = _make_frame(args.input_resolution, args.frame_format)
+    mask = SyntheticMask(args.mask_resolution)
+    blur, background_mask = _effect_functions(args.frame_format)
+    out = None
+    if args.reuse_output:
+        # The effects return a frame of the same size in the same format
+        # (RGBA for the packed ones)
+        out = bytearray(len(blur(frame, mask)))
+    if args.effect == "blur":
+        return lambda: blur(frame, mask, out=out, mask_filter=args.mask_filter,
+                            threads=args.threads)
+    background = _make_frame(args.background_resolution)
+    if args.prepared_background:
+        background = effects.Background(background)
+    return lambda: background_mask(frame, mask, background, out=out,
+                                   mask_filter=args.mask_filter,
+                                   threads=args.threads)
+
+
+class StallMonitor(threading.Thread):
+    """A pure-Python thread that wakes up every millisecond and records the
+    longest time it had to wait beyond that, i.e. how long other threads kept
+    it from running by holding the GIL.
+    """
+
+    INTERVAL = 0.001
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.longest_stall = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.INTERVAL):
+            now = time.perf_counter()
+            self.longest_stall = max(self.longest_stall,
+                                     now - last - self.INTERVAL)
+            last = now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class InferenceLoop(threading.Thread):
+    """Evaluates a model over and over until stopped, counting evaluations"""
+
+    def __init__(self, model, model_input):
+        super().__init__(daemon=True)
+        self.iterations = 0
+        self.duration = 0
+        self._model = model
+        self._model_input = model_input
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while not self._stop_event.is_set():
+            self._model.evaluate(self._model_input)
+            self.iterations += 1
+        self.duration = time.perf_counter() - start
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def time_effect(apply_effect, max_iterations, max_duration):
+    """Applies the effect up to @max_iterations times, for at most
+    @max_duration seconds, and returns (iterations, seconds per iteration,
+    longest Python thread stall in seconds).
+    """
+    monitor = StallMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    iterations = 0
+    while iterations < max_iterations:
+        apply_effect()
+        iterations += 1
+        if time.perf_counter() - start > max_duration:
+            break
+    elapsed = time.perf_counter() - start
+    monitor.stop()
+    return iterations, elapsed / iterations, monitor.longest_stall
+
+
+def time_inference(model, model_input, duration):
+    """Evaluates the model on a background thread for @duration seconds and
+    returns seconds per evaluation.
+    """
+    loop = InferenceLoop(model, model_input)
+    loop.start()
+    time.sleep(duration)
+    loop.stop()
+    return loop.duration / max(loop.iterations, 1)
+
+
+def run_stress(args, apply_effect):
+    try:
+        import xnornet
+    except ImportError:
+        sys.exit("--stress needs the xnornet wheel (or the offline stand-in "
+                 "in fake_xnornet/) to be installed.")
+
+    print("Loading model...")
+    model = xnornet.Model.load_built_in()
+    print("Model: {}".format(model.name))
+    width, height = args.input_resolution
+    model_input = xnornet.Input.rgb_image(
+        args.input_resolution, _random_bytes(width * height * 3))
+
+    print("Timing effect alone...")
+    iterations, effect_alone, stall_alone = time_effect(
+        apply_effect, args.iterations, args.max_duration)
+    print("Timing inference alone...")
+    inference_alone = time_inference(model, model_input,
+                                     min(args.max_duration, 2))
+
+    print("Timing both at once...")
+    loop = InferenceLoop(model, model_input)
+    loop.start()
+    iterations, effect_shared, stall_shared = time_effect(
+        apply_effect, args.iterations, args.max_duration)
+    loop.stop()
+    inference_shared = loop.duration / max(loop.iterations, 1)
+
+    # If the two never overlapped, each one would be slowed down by the other's
+    # share of the time: the busy fractions would add up to at most 1.
+    overlap = (effect_alone / effect_shared +
+               inference_alone / inference_shared)
+
+    print("")
+    print("Summary ({}, {}x{}, threads={})".format(
+        args.effect, width, height, args.threads))
+    print("                     alone       concurrent")
+    print("  Effect:            {:7.2f} ms  {:7.2f} ms".format(
+        effect_alone * 1000, effect_shared * 1000))
+    print("  Inference:         {:7.2f} ms  {:7.2f} ms".format(
+        inference_alone * 1000, inference_shared * 1000))
+    print("  Longest stall:     {:7.2f} ms  {:7.2f} ms".format(
+        stall_alone * 1000, stall_shared * 1000))
+    print("  Combined throughput: {:.2f}x of running one at a time".format(
+        overlap))
+
+
+def run_sampling_sweep(args):
+    """Times background_mask at common stream sizes with each mask filter.
+
+    The first call at a new size also builds the extension's sampling tables
+    for it; later calls reuse them.
+    """
+    print("Resolution   Mask filter   First call   Steady state")
+    for resolution in SWEEP_RESOLUTIONS:
+        for mask_filter in MASK_FILTERS:
+            sweep_args = argparse.Namespace(**dict(
+                vars(args), effect="background_mask",
+                input_resolution=resolution, mask_filter=mask_filter))
+            apply_effect = make_effect(sweep_args)
+            start = time.perf_counter()
+            apply_effect()
+            first_call = time.perf_counter() - start
+            _, latency, _ = time_effect(apply_effect, args.iterations,
+                                        args.max_duration)
+            print("{:>9}    {:<11}   {:7.2f} ms   {:7.2f} ms".format(
+                "{}x{}".format(*resolution), mask_filter, first_call * 1000,
+                latency * 1000))
+
+
+# (input resolution, mask resolution, frame format, mask filter, effect
+# keyword arguments) for --check_isas. The odd sizes leave partial vectors at
+# the ends of rows and of the blur bands. Frames smaller than the default
+# downsample factor must still work with background_mask, which doesn't take
+# one.
+ISA_CHECK_CASES = (
+    ((1, 1), (1, 1), "RGB", "nearest", dict(downsample=1)),
+    ((2, 5), (3, 2), "BGRA", "bilinear", dict(downsample=2, box_size=3)),
+    ((1280, 720), (256, 144), "RGB", "nearest", {}),
+    ((1280, 720), (256, 144), "BGRx", "bilinear", {}),
+    ((641, 359), (255, 143), "RGBA", "nearest",
+     dict(downsample=4, blur_iterations=1, box_size=7)),
+    ((97, 61), (33, 19), "BGRA", "bilinear",
+     dict(downsample=1, box_size=3, mask_blur_iterations=2,
+          mask_box_size=5)),
+    ((1920, 1080), (256, 144), "RGBx", "nearest",
+     dict(downsample=8, box_size=5, mask_box_size=7)),
+    ((1280, 720), (256, 144), "I420", "bilinear", {}),
+    ((641, 359), (255, 143), "NV12", "nearest",
+     dict(downsample=4, blur_iterations=1, box_size=7)),
+    ((7, 3), (5, 2), "RGBx", "nearest", dict(downsample=3, box_size=1)),
+    ((3, 5), (2, 3), "I420", "nearest", dict(downsample=1)),
+    ((5, 3), (3, 2), "NV12", "bilinear", dict(downsample=3, box_size=3)),
+)
+
+# Boxes that --check_isas redacts from the packed frames, like
+# `xnornet.Rectangle`s: inside the frame, over its edges, and all of it
+Rectangle = collections.namedtuple("Rectangle", ["x", "y", "width", "height"])
+REDACT_CHECK_BOXES = (Rectangle(0.1, 0.2, 0.5, 0.4),
+                      Rectangle(-0.1, 0.7, 0.3, 0.5),
+                      Rectangle(0.0, 0.0, 1.0, 1.0))
+
+
+def _redact_copy(frame, **params):
+    """Redact REDACT_CHECK_BOXES from a copy of @frame, returning its data"""
+    frame_format, size, data = frame
+    data = bytearray(data)
+    effects.redact((frame_format, size, data), REDACT_CHECK_BOXES, **params)
+    return bytes(data)
+
+
+def run_isa_check(args):
+    """Applies every effect with every available instruction set and compares
+    the results to the scalar code's. Returns True if they all match.
+    """
+    isas = effects.available_isas()
+    print("Available instruction sets: {}".format(", ".join(isas)))
+    previous_isa = effects.isa()
+    all_match = True
+    print("Effect            Resolution  Format  Mask filter  " +
+          "".join("{:>12}".format(isa) for isa in isas))
+    try:
+        for case in ISA_CHECK_CASES:
+            resolution, mask_resolution, frame_format, mask_filter, params = \
+                case
+            if (frame_format in yuv_frames.YUV_FORMATS and
+                    not hasattr(effects, "blur_yuv")):
+                continue
+            frame = _make_frame(resolution, frame_format)
+            mask = SyntheticMask(mask_resolution)
+            background = _make_frame((resolution[0] // 2 + 1,
+                                      resolution[1] // 2 + 1))
+            prepared_background = effects.Background(background)
+            blur, background_mask = _effect_functions(frame_format)
+            mask_params = {key: value for key, value in params.items()
+                           if key.startswith("mask_")}
+            tests = (
+                ("blur", lambda: blur(
+                    frame, mask, mask_filter=mask_filter,
+                    threads=args.threads, **params)),
+                ("background_mask", lambda: background_mask(
+                    frame, mask, background, mask_filter=mask_filter,
+                    threads=args.threads, **mask_params)),
+                ("  (Background)", lambda: background_mask(
+                    frame, mask, prepared_background, mask_filter=mask_filter,
+                    threads=args.threads, **mask_params)),
+            )
+            if frame_format not in yuv_frames.YUV_FORMATS:
+                tests += (
+                    ("redact pixelate", lambda: _redact_copy(
+                        frame, mode="pixelate", threads=args.threads,
+                        block_size=5)),
+                    ("redact blur", lambda: _redact_copy(
+                        frame, mode="blur", threads=args.threads,
+                        box_size=params.get("box_size", 5))),
+                )
+            for name, apply_effect in tests:
+                expected = None
+                cells = []
+                for isa in isas:
+                    effects.set_isa(isa)
+                    result = apply_effect()
+                    if expected is None:
+                        expected = result
+                    _, latency, _ = time_effect(apply_effect,
+                                                min(args.iterations, 10),
+                                                args.max_duration)
+                    if result == expected:
+                        cells.append("{:9.2f} ms".format(latency * 1000))
+                    else:
+                        all_match = False
+                        cells.append("   MISMATCH")
+                print("{:<16}  {:>10}  {:<6}  {:<11}  {}".format(
+                    name, "{}x{}".format(*resolution), frame_format,
+                    mask_filter, "".join("{:>12}".format(cell)
+                                         for cell in cells)))
+    finally:
+        effects.set_isa(previous_isa)
+    print("All instruction sets match" if all_match
+          else "Instruction sets produce different output!")
+    return all_match
+
+
+def run_backend_comparison(args):
+    """Times each effect with every backend, and reports the average
+    difference of each channel value from the first backend's results.
+    """
+    import numpy as np
+
+    if args.frame_format in yuv_frames.YUV_FORMATS:
+        sys.exit("Only the native effects support {} frames".format(
+            args.frame_format))
+    if len(BACKENDS) < 2:
+        sys.exit("--compare_backends needs both the effects module and "
+                 "NumPy; only {} is available".format(*BACKENDS))
+
+    frame = _make_frame(args.input_resolution, args.frame_format)
+    mask = SyntheticMask(args.mask_resolution)
+    background = _make_frame(args.background_resolution)
+    print("Effect            " + "".join(
+        "{:>12}".format(name) for name in BACKENDS) + "  Difference")
+    for effect in ("blur", "background_mask", "  (Background)"):
+        expected = None
+        cells = []
+        for module in BACKENDS.values():
+            if effect == "blur":
+                def apply_effect(module=module):
+                    return module.blur(frame, mask,
+                                       mask_filter=args.mask_filter,
+                                       threads=args.threads)
+            else:
+                backdrop = (module.Background(background)
+                            if effect == "  (Background)" else background)
+
+                def apply_effect(module=module, backdrop=backdrop):
+                    return module.background_mask(
+                        frame, mask, backdrop, mask_filter=args.mask_filter,
+                        threads=args.threads)
+            result = np.frombuffer(apply_effect(), dtype=np.uint8)
+            if expected is None:
+                expected = result
+            else:
+                difference = np.abs(result.astype(np.int16) - expected).mean()
+            _, latency, _ = time_effect(apply_effect, args.iterations,
+                                        args.max_duration)
+            cells.append("{:9.2f} ms".format(latency * 1000))
+        print("{:<16}  {}  {:10.2f}".format(
+            effect, "".join("{:>12}".format(cell) for cell in cells),
+            difference))
+
+
+def _make_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument("--effect", choices=EFFECTS, default="blur",
+                        help="Effect to benchmark (default: blur)")
+    parser.add_argument("--input_resolution", type=_parse_resolution,
+                        default=(1280, 720), metavar="WxH",
+                        help="Frame size (default: 1280x720)")
+    parser.add_argument("--mask_resolution", type=_parse_resolution,
+                        default=(256, 144), metavar="WxH",
+                        help="Segmentation mask size (default: 256x144)")
+    parser.add_argument("--background_resolution", type=_parse_resolution,
+                        default=(1920, 1080), metavar="WxH",
+                        help="Size of the background_mask backdrop (default: "
+                        "1920x1080)")
+    parser.add_argument("--prepared_background", action="store_true",
+                        help="Pass background_mask an effects.Background, "
+                        "which is only resampled when the frame size changes")
+    parser.add_argument("--frame_format",
+                        choices=sorted(FRAME_FORMATS) +
+                        list(yuv_frames.YUV_FORMATS), default="RGB",
+                        help="Pixel layout of the frames (default: RGB). I420 "
+                        "and NV12 time the YUV variants of the effects.")
+    parser.add_argument("--reuse_output", action="store_true",
+                        help="Write every result into the same preallocated "
+                        "buffer instead of a new bytes object")
+    parser.add_argument("--mask_filter", choices=MASK_FILTERS,
+                        default="nearest",
+                        help="How the mask is scaled up to the frame size "
+                        "(default: nearest)")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1,
+                        help="Threads the effect may use (default: one per "
+                        "CPU core)")
+    parser.add_argument("--backend", choices=list(BACKENDS),
+                        help="Implementation of the effects to benchmark "
+                        "(default: {})".format(next(iter(BACKENDS))))
+    parser.add_argument("--compare_backends", action="store_true",
+                        help="Time the effects with each backend, and "
+                        "compare their results")
+    # Checked once --backend has picked the module whose instruction sets
+    # these are
+    parser.add_argument("--isa",
+                        help="SIMD instruction set for the effects to use. "
+                        "Available: {} (default: the fastest)".format("; ".join(
+                            "{} {}".format(name, ", ".join(
+                                backend.available_isas()))
+                            for name, backend in BACKENDS.items())))
+    parser.add_argument("--iterations", type=int, default=100,
+                        help="Maximum number of times to apply the effect")
+    parser.add_argument("--max_duration", type=float, default=10,
+                        help="Maximum seconds to spend per measurement")
+    parser.add_argument("--stress", action="store_true",
+                        help="Also run the effect concurrently with a thread "
+                        "evaluating the installed model")
+    parser.add_argument("--sampling_sweep", action="store_true",
+                        help="Time background_mask at {} with each mask "
+                        "filter".format(" and ".join(
+                            "{}x{}".format(*size)
+                            for size in SWEEP_RESOLUTIONS)))
+    parser.add_argument("--check_isas", action="store_true",
+                        help="Check that every available instruction set "
+                        "gives the same results for every effect, and time "
+                        "each. Exits with status 1 if any differs, for CI.")
+    return parser
+
+
+def main(args=None):
+    global effects
+    parser = _make_argument_parser()
+    args = parser.parse_args(args)
+
+    if args.compare_backends:
+        run_backend_comparison(args)
+        return
+
+    if args.backend:
+        effects = BACKENDS[args.backend]
+    if args.isa is not None and args.isa not in effects.available_isas():
+        parser.error("--isa {} is not available with the {} backend "
+                     "(choose from {})".format(
+                         args.isa, args.backend or next(iter(BACKENDS)),
+                         ", ".join(effects.available_isas())))
+
+    if args.check_isas:
+        if not run_isa_check(args):
+            sys.exit(1)
+        return
+
+    if args.isa:
+        effects.set_isa(args.isa)
+
+    if args.sampling_sweep:
+        run_sampling_sweep(args)
+        return
+
+    apply_effect = make_effect(args)
+    # Warm up the effect's thread pool
+    apply_effect()
+
+    if args.stress:
+        run_stress(args, apply_effect)
+        return
+
+    iterations, latency, stall = time_effect(apply_effect, args.iterations,
+                                             args.max_duration)
+    width, height = args.input_resolution
+    print("Summary ({}, {}x{}, threads={}, isa={})".format(
+        args.effect, width, height, args.threads, effects.isa()))
+    print("  Iterations:         {}".format(iterations))
+    print("  Average latency:    {:.2f} ms".format(latency * 1000))
+    print("  Average FPS:        {:.1f}".format(1 / latency))
+    print("  Longest stall:      {:.2f} ms".format(stall * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""An offline stand-in for the `xnornet` module provided by model wheels.
+
+This package mimics the parts of the Xnor model Python API that the samples
+use, without running a real model. It is meant for measuring how much time the
+Python side of a sample (capture, effects, overlays, bookkeeping) takes on its
+own, on hosts where no model wheel is installed. Put the directory containing
+this package first on the module path to use it:
+
+    PYTHONPATH=fake_xnornet python3 model_benchmark.py
+
+`Model.evaluate` sleeps for a synthetic latency and returns results that
+depend only on the model configuration and the input data. The model is
+configured through environment variables (or `configure()`):
+
+ - `XNORNET_FAKE_RESULT_TYPE`: `bounding_boxes` (default), `class_labels` or
+   `segmentation_masks`.
+ - `XNORNET_FAKE_CLASSES`: comma-separated class names. The default depends
+   on the result type.
+ - `XNORNET_FAKE_LATENCY_MS`: fixed time each evaluation takes (default 10).
+ - `XNORNET_FAKE_LATENCY_MS_PER_MEGAPIXEL`: additional time per million input
+   pixels (default 0), to emulate resolution-dependent preprocessing.
+ - `XNORNET_FAKE_MASK_SIZE`: segmentation mask dimensions, as WIDTHxHEIGHT
+   (default 256x144).
+"""
+
+import enum
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+
+__version__ = "0.0.0+fake"
+
+
+class EvaluationResultType(enum.Enum):
+    CLASS_LABELS = 1
+    BOUNDING_BOXES = 2
+    SEGMENTATION_MASKS = 3
+
+
+_DEFAULT_CLASSES = {
+    EvaluationResultType.CLASS_LABELS:
+        ["happy", "sad", "anger", "fear", "disgust", "surprise", "neutral"],
+    EvaluationResultType.BOUNDING_BOXES: ["person", "pet", "vehicle"],
+    EvaluationResultType.SEGMENTATION_MASKS: ["person"],
+}
+
+_MODEL_NAMES = {
+    EvaluationResultType.CLASS_LABELS: "fake-classifier",
+    EvaluationResultType.BOUNDING_BOXES: "fake-detector",
+    EvaluationResultType.SEGMENTATION_MASKS: "fake-segmenter",
+}
+
+_config = {}
+
+
+def configure(result_type=None, classes=None, latency_ms=None,
+              latency_ms_per_megapixel=None, mask_size=None):
+    """Override the environment configuration for models loaded afterwards.
+
+    Arguments left as None keep their environment (or default) value.
+    """
+    overrides = {
+        "result_type": result_type,
+        "classes": classes,
+        "latency_ms": latency_ms,
+        "latency_ms_per_megapixel": latency_ms_per_megapixel,
+        "mask_size": mask_size,
+    }
+    _config.update((key, value) for key, value in overrides.items()
+                   if value is not None)
+
+
+def _get_config():
+    result_type = _config.get("result_type")
+    if result_type is None:
+        result_type = EvaluationResultType[os.environ.get(
+            "XNORNET_FAKE_RESULT_TYPE", "bounding_boxes").upper()]
+    classes = _config.get("classes")
+    if classes is None:
+        classes = os.environ.get("XNORNET_FAKE_CLASSES")
+        classes = (classes.split(",") if classes
+                   else _DEFAULT_CLASSES[result_type])
+    latency_ms = _config.get("latency_ms")
+    if latency_ms is None:
+        latency_ms = float(os.environ.get("XNORNET_FAKE_LATENCY_MS", 10))
+    latency_ms_per_megapixel = _config.get("latency_ms_per_megapixel")
+    if latency_ms_per_megapixel is None:
+        latency_ms_per_megapixel = float(
+            os.environ.get("XNORNET_FAKE_LATENCY_MS_PER_MEGAPIXEL", 0))
+    mask_size = _config.get("mask_size")
+    if mask_size is None:
+        mask_size = tuple(int(value) for value in os.environ.get(
+            "XNORNET_FAKE_MASK_SIZE", "256x144").lower().split("x"))
+    return (result_type, list(classes), latency_ms, latency_ms_per_megapixel,
+            mask_size)
+
+
+class ClassLabel:
+
+    def __init__(self, class_id, label):
+        self.class_id = class_id
+        self.label = label
+
+    def __repr__(self):
+        return "ClassLabel(class_id={!r}, label={!r})".format(
+            self.class_id, self.label)
+
+
+class Rectangle:
+    """A rectangle in coordinates relative to the input image size"""
+
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "Rectangle(x={!r}, y={!r}, width={!r}, height={!r})".format(
+            self.x, self.y, self.width, self.height)
+
+
+class BoundingBox:
+
+    def __init__(self, class_label, rectangle):
+        self.class_label = class_label
+        self.rectangle = rectangle
+
+    def __repr__(self):
+        return "BoundingBox(class_label={!r}, rectangle={!r})".format(
+            self.class_label, self.rectangle)
+
+
+class SegmentationMask:
+    """A 1-bit mask, laid out like `xnor_bitmap` in xnornet.h: rows of
+    `_stride` bytes, with the least significant bit of each byte first.
+    """
+
+    def __init__(self, class_label, width, height, stride, data):
+        self.class_label = class_label
+        self.width = width
+        self.height = height
+        self._stride = stride
+        self._data = data
+
+    def to_bytes(self):
+        return self._data
+
+    def __repr__(self):
+        return "SegmentationMask(class_label={!r}, {}x{})".format(
+            self.class_label, self.width, self.height)
+
+
+class Input:
+    """An image to evaluate. Use the static constructors to create one."""
+
+    def __init__(self, size, planes):
+        self.size = size
+        self._planes = planes
+
+    @staticmethod
+    def _check_plane(name, data, expected_size):
+        if len(data) < expected_size:
+            raise ValueError("{} data is {} bytes, expected {}".format(
+                name, len(data), expected_size))
+
+    @staticmethod
+    def rgb_image(size, data):
+        width, height = size
+        Input._check_plane("RGB", memoryview(data), width * height * 3)
+        return Input(size, [data])
+
+    @staticmethod
+    def yuv422_image(size, data):
+        width, height = size
+        Input._check_plane("YUV422", memoryview(data), width * height * 2)
+        return Input(size, [data])
+
+    @staticmethod
+    def yuv420p_image(size, y_plane, u_plane, v_plane):
+        width, height = size
+        chroma_size = ((width + 1) // 2) * ((height + 1) // 2)
+        Input._check_plane("Y plane", memoryview(y_plane), width * height)
+        Input._check_plane("U plane", memoryview(u_plane), chroma_size)
+        Input._check_plane("V plane", memoryview(v_plane), chroma_size)
+        return Input(size, [y_plane, u_plane, v_plane])
+
+    @staticmethod
+    def yuv420sp_nv12_image(size, y_plane, uv_plane):
+        width, height = size
+        chroma_size = 2 * ((width + 1) // 2) * ((height + 1) // 2)
+        Input._check_plane("Y plane", memoryview(y_plane), width * height)
+        Input._check_plane("UV plane", memoryview(uv_plane), chroma_size)
+        return Input(size, [y_plane, uv_plane])
+
+    @staticmethod
+    def yuv420sp_nv21_image(size, y_plane, vu_plane):
+        return Input.yuv420sp_nv12_image(size, y_plane, vu_plane)
+
+    @staticmethod
+    def jpeg_image(data):
+        return Input(_jpeg_size(memoryview(data)), [data])
+
+    def _fingerprint(self):
+        """A cheap checksum of a sample of the input data"""
+        checksum = 0
+        for plane in self._planes:
+            plane = memoryview(plane).cast("B")
+            # Sampling keeps this negligible next to the synthetic latency,
+            # even for 4K frames
+            checksum = zlib.crc32(plane[::4093].tobytes(), checksum)
+        return checksum
+
+
+def _jpeg_size(data):
+    """Returns the (width, height) in a JPEG's start-of-frame header"""
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            break
+        marker = data[offset + 1]
+        segment_length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        # SOF0..SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + segment_length
+    raise ValueError("Could not decode JPEG header")
+
+
+class Model:
+    """A stand-in model; see the module documentation for configuration"""
+
+    MULTI_THREADED = 1
+    SINGLE_THREADED = 2
+
+    def __init__(self, threading_model):
+        (self.result_type, self.classes, self._latency_ms,
+         self._latency_ms_per_megapixel, self._mask_size) = _get_config()
+        self.name = _MODEL_NAMES[self.result_type]
+        self.version = __version__
+        self.threading_model = threading_model
+        # Like the real library, a model must not evaluate two inputs at once
+        self._evaluating = threading.Lock()
+        self._mask_data = None
+
+    @staticmethod
+    def enumerate_built_in():
+        return [_MODEL_NAMES[_get_config()[0]]]
+
+    @staticmethod
+    def load_built_in(name=None, threading_model=MULTI_THREADED):
+        return Model(threading_model)
+
+    def evaluate(self, model_input):
+        if not self._evaluating.acquire(blocking=False):
+            raise RuntimeError(
+                "Model.evaluate called concurrently on the same model")
+        try:
+            width, height = model_input.size
+            latency_ms = (self._latency_ms + self._latency_ms_per_megapixel *
+                          width * height / 1e6)
+            time.sleep(latency_ms / 1000)
+            rng = random.Random(model_input._fingerprint())
+            if self.result_type == EvaluationResultType.CLASS_LABELS:
+                return self._class_labels(rng)
+            elif self.result_type == EvaluationResultType.BOUNDING_BOXES:
+                return self._bounding_boxes(rng)
+            else:
+                return self._segmentation_masks(rng)
+        finally:
+            self._evaluating.release()
+
+    def _class_labels(self, rng):
+        class_ids = list(range(len(self.classes)))
+        rng.shuffle(class_ids)
+        return [ClassLabel(class_id, self.classes[class_id])
+                for class_id in class_ids]
+
+    def _bounding_boxes(self, rng):
+        boxes = []
+        for _ in range(rng.randint(0, 4)):
+            class_id = rng.randrange(len(self.classes))
+            width = rng.uniform(0.1, 0.5)
+            height = rng.uniform(0.1, 0.5)
+            rectangle = Rectangle(rng.uniform(0, 1 - width),
+                                  rng.uniform(0, 1 - height), width, height)
+            boxes.append(BoundingBox(
+                ClassLabel(class_id, self.classes[class_id]), rectangle))
+        return boxes
+
+    def _segmentation_masks(self, rng):
+        width, height = self._mask_size
+        stride = (width + 7) // 8
+        if self._mask_data is None:
+            self._mask_data = self._ellipse_bitmap(width, height, stride)
+        return [SegmentationMask(ClassLabel(0, self.classes[0]), width,
+                                 height, stride, self._mask_data)]
+
+    @staticmethod
+    def _ellipse_bitmap(width, height, stride):
+        """A bitmap of an ellipse rising from the bottom center, roughly where
+        a person in a video call would be
+        """
+        radius_x = width * 0.25
+        radius_y = height * 0.6
+        rows = []
+        for y in range(height):
+            row = bytearray(stride)
+            dy = (height - y) / radius_y
+            if dy < 1:
+                half_width = radius_x * (1 - dy * dy)**0.5
+                for x in range(max(0, int(width / 2 - half_width)),
+                               min(width, int(width / 2 + half_width) + 1)):
+                    row[x // 8] |= 1 << (x % 8)
+            rows.append(bytes(row))
+        return b"".join(rows)
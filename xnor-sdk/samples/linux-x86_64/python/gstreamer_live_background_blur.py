@@ -6,6 +6,7 @@
 import argparse
 import gc
 import sys
+import time
 
 if sys.version_info[0] < 3:
     sys.exit("This sample requires Python 3. Please install Python 3!")
@@ -14,16 +15,13 @@ if sys.version_info[0] < 3:
 import common_util.ansi as ansi
 # Support code that helps capture video from various sources
 import common_util.gstreamer_video_pipeline as gst_pipeline
-try:
-    # Support code that helps process video frames using segmentation masks
-    # See common_util/effects.cc for implementation
-    import xnor_util.effects as effects
-except ImportError as e:
-    print(ansi.RED + "ERROR: " + ansi.NORMAL +
-          "Unable to import the effects module!")
-    print("(Have you run " + ansi.BOLD + "python3 setup.py install" +
-          ansi.NORMAL + "?)\n")
-    raise e
+# Access to the planes of YUV frames
+import common_util.yuv_frames as yuv_frames
+# Quality presets for the blur, and a tuner that picks one to hold a frame rate
+from common_util.effect_autotuner import EffectAutotuner, QUALITY_TIERS
+# The video effects: the native module, or a NumPy version if it isn't built
+import common_util.effects_loader as effects_loader
+effects = effects_loader.load_effects()
 
 # "xnornet" is the module provided by the installed model
 try:
@@ -40,11 +38,45 @@ def parse_args(args=None):
     parser.add_argument(
         '--webcam_device', help="/dev/ identifier of a webcam to use (If "
         "webcam_device is not specified, GStreamer defaults to /dev/video0)")
+    parser.add_argument(
+        '--threads', type=int, default=0,
+        help="Number of threads to use for the blur effect (default: one per "
+        "CPU core)")
+    parser.add_argument(
+        '--quality', choices=[tier.name for tier in QUALITY_TIERS],
+        default=QUALITY_TIERS[0].name,
+        help="Blur quality preset; lower ones are faster (default: "
+        "%(default)s). With --target_fps, the preset to start from.")
+    parser.add_argument(
+        '--target_fps', type=float,
+        help="Lower the blur quality as needed to hold this frame rate, and "
+        "raise it again when there is time to spare")
+    parser.add_argument(
+        '--frame_format', choices=gst_pipeline.VideoProcessingPipeline.
+        FRAME_FORMATS, default="RGB",
+        help="Format to process frames in (default: %(default)s). I420 and "
+        "NV12 apply the effect to the camera's YUV frames directly, skipping "
+        "the conversions to and from RGB.")
     return parser.parse_args(args)
 
 
+def make_model_input(frame):
+    """Wrap a Frame from the pipeline in an `xnornet.Input`"""
+    if frame.format == "I420":
+        return xnornet.Input.yuv420p_image(frame.size,
+                                           *yuv_frames.planes(frame))
+    if frame.format == "NV12":
+        return xnornet.Input.yuv420sp_nv12_image(frame.size,
+                                                 *yuv_frames.planes(frame))
+    return xnornet.Input.rgb_image(frame.size, frame.data)
+
+
 def main():
     args = parse_args()
+    if (args.frame_format in yuv_frames.YUV_FORMATS and
+            not hasattr(effects, "blur_yuv")):
+        sys.exit("--frame_format {} needs the effects module; build it with "
+                 "python3 setup.py install".format(args.frame_format))
 
     # Load the Xnor model
     model = xnornet.Model.load_built_in()
@@ -58,31 +90,58 @@ def main():
     print("Model: {}".format(model.name))
     print("  version {!r}".format(model.version))
 
+    tier_names = [tier.name for tier in QUALITY_TIERS]
+    tier_index = tier_names.index(args.quality)
+    tuner = None
+    if args.target_fps is not None:
+        tuner = EffectAutotuner(args.target_fps, initial_tier=tier_index)
+
     # Start the pipeline
     pipeline = gst_pipeline.VideoProcessingPipeline(
-        "Xnor Background Blur Demo", args.webcam_device, None)
+        "Xnor Background Blur Demo", args.webcam_device, None,
+        frame_format=args.frame_format)
+    if args.frame_format in yuv_frames.YUV_FORMATS:
+        # Composites the planes in place of the RGB ones, and returns the
+        # frame in the same format
+        blur, result_format = effects.blur_yuv, args.frame_format
+    else:
+        blur, result_format = effects.blur, "RGBA"
     pipeline.start()
 
     while pipeline.running:
-        frame = pipeline.get_frame()
-        if frame is None:
+        frame_start = time.perf_counter()
+        mapped_frame = pipeline.get_mapped_frame()
+        if mapped_frame is None:
             continue
-        input = xnornet.Input.rgb_image(frame.size, frame.data)
-        results = model.evaluate(input)
-
-        # Segmentation model should always return results
-        if len(results) == 0:
-            print("{} returned no results!".format(args.model))
-            pipeline.stop()
-            break
-
-        # Use the mask to blur only the background
-        mask = results[0]
-        result_data = effects.blur(frame, mask)
-        processed = gst_pipeline.Frame("RGBA", frame.size, result_data)
+        # The frame data is read in place from the pipeline's buffer, so the
+        # model and the effect must be done with it before the block ends.
+        with mapped_frame as frame:
+            input = make_model_input(frame)
+            results = model.evaluate(input)
+
+            # Segmentation model should always return results
+            if len(results) == 0:
+                print("{} returned no results!".format(model.name))
+                pipeline.stop()
+                break
+
+            # Use the mask to blur only the background
+            mask = results[0]
+            blur_params = (tuner.blur_params if tuner is not None
+                           else QUALITY_TIERS[tier_index].blur_params)
+            effect_start = time.perf_counter()
+            result_data = blur(frame, mask, threads=args.threads,
+                               **blur_params)
+            effect_time = time.perf_counter() - effect_start
+        processed = gst_pipeline.Frame(result_format, frame.size, result_data)
         pipeline.put_frame(processed)
         gc.collect()
 
+        if tuner is not None and tuner.update(
+                time.perf_counter() - frame_start, effect_time):
+            print("Switched to {} quality to hold {:g} FPS".format(
+                tuner.tier.name, args.target_fps))
+
 
 if __name__ == "__main__":
     main()
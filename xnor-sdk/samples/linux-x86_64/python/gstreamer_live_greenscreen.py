@@ -23,16 +23,11 @@ except ImportError as e:
 
 # Support code that helps capture video from various sources
 import common_util.gstreamer_video_pipeline as gst_pipeline
-try:
-    # Support code that helps process video frames using segmentation masks
-    # See common_util/effects.cc for implementation
-    import xnor_util.effects as effects
-except ImportError as e:
-    print(ansi.RED + "ERROR: " + ansi.NORMAL +
-          "Unable to import the effects module!")
-    print("(Have you run " + ansi.BOLD + "python3 setup.py install" +
-          ansi.NORMAL + "?)\n")
-    raise e
+# Access to the planes of YUV frames
+import common_util.yuv_frames as yuv_frames
+# The video effects: the native module, or a NumPy version if it isn't built
+import common_util.effects_loader as effects_loader
+effects = effects_loader.load_effects()
 
 # "xnornet" is the module provided by the installed model
 try:
@@ -51,11 +46,36 @@ def parse_args(args=None):
         "webcam_device is not specified, GStreamer defaults to /dev/video0)")
     parser.add_argument('--background_image', required=True,
                         help="The backdrop to superimpose the objects over")
+    parser.add_argument(
+        '--threads', type=int, default=0,
+        help="Number of threads to use for the greenscreen effect "
+        "(default: one per CPU core)")
+    parser.add_argument(
+        '--frame_format', choices=gst_pipeline.VideoProcessingPipeline.
+        FRAME_FORMATS, default="RGB",
+        help="Format to process frames in (default: %(default)s). I420 and "
+        "NV12 apply the effect to the camera's YUV frames directly, skipping "
+        "the conversions to and from RGB.")
     return parser.parse_args(args)
 
 
+def make_model_input(frame):
+    """Wrap a Frame from the pipeline in an `xnornet.Input`"""
+    if frame.format == "I420":
+        return xnornet.Input.yuv420p_image(frame.size,
+                                           *yuv_frames.planes(frame))
+    if frame.format == "NV12":
+        return xnornet.Input.yuv420sp_nv12_image(frame.size,
+                                                 *yuv_frames.planes(frame))
+    return xnornet.Input.rgb_image(frame.size, frame.data)
+
+
 def main():
     args = parse_args()
+    if (args.frame_format in yuv_frames.YUV_FORMATS and
+            not hasattr(effects, "blur_yuv")):
+        sys.exit("--frame_format {} needs the effects module; build it with "
+                 "python3 setup.py install".format(args.frame_format))
 
     # Load the Xnor model
     model = xnornet.Model.load_built_in()
@@ -71,32 +91,45 @@ def main():
 
     background_image = Image.open(args.background_image)
     background_image = background_image.convert('RGB')
-    background_frame = gst_pipeline.Frame(
+    # Converted and scaled to the camera resolution once, not on every frame
+    background = effects.Background(gst_pipeline.Frame(
         'RGB', (background_image.width, background_image.height),
-        background_image.tobytes())
+        background_image.tobytes()))
 
     # Start the pipeline
     pipeline = gst_pipeline.VideoProcessingPipeline(
-        "Xnor Greenscreen Demo", args.webcam_device, None)
+        "Xnor Greenscreen Demo", args.webcam_device, None,
+        frame_format=args.frame_format)
+    if args.frame_format in yuv_frames.YUV_FORMATS:
+        # Composites the planes in place of the RGB ones, and returns the
+        # frame in the same format. The background is converted to YUV once.
+        background_mask = effects.background_mask_yuv
+        result_format = args.frame_format
+    else:
+        background_mask, result_format = effects.background_mask, "RGBA"
     pipeline.start()
 
     while pipeline.running:
-        frame = pipeline.get_frame()
-        if frame is None:
+        mapped_frame = pipeline.get_mapped_frame()
+        if mapped_frame is None:
             continue
-        input = xnornet.Input.rgb_image(frame.size, frame.data)
-        results = model.evaluate(input)
-
-        # Segmentation model should always return results
-        if len(results) == 0:
-            print("{} returned no results!".format(args.model))
-            pipeline.stop()
-            break
-
-        # Use the mask to superimpose the object(s) on the background!
-        mask = results[0]
-        result_data = effects.background_mask(frame, mask, background_frame)
-        processed = gst_pipeline.Frame("RGBA", frame.size, result_data)
+        # The frame data is read in place from the pipeline's buffer, so the
+        # model and the effect must be done with it before the block ends.
+        with mapped_frame as frame:
+            input = make_model_input(frame)
+            results = model.evaluate(input)
+
+            # Segmentation model should always return results
+            if len(results) == 0:
+                print("{} returned no results!".format(model.name))
+                pipeline.stop()
+                break
+
+            # Use the mask to superimpose the object(s) on the background!
+            mask = results[0]
+            result_data = background_mask(frame, mask, background,
+                                          threads=args.threads)
+        processed = gst_pipeline.Frame(result_format, frame.size, result_data)
         pipeline.put_frame(processed)
         gc.collect()
 
@@ -6,6 +6,7 @@
 import argparse
 import gc
 import sys
+import time
 
 if sys.version_info[0] < 3:
     sys.exit("This sample requires Python 3. Please install Python 3!")
@@ -35,7 +36,101 @@ def parse_args(args=None):
         help="/dev/ identifier of a webcam to use"
         "(If neither webcam_device or video_file are specified,"
         "GStreamer defaults to /dev/video0)")
-    return parser.parse_args(args)
+    parser.add_argument(
+        '--inference_worker', action='store_true',
+        help="Evaluate the model on a background thread, so that the window "
+        "stays responsive and the overlays update as soon as results are "
+        "ready, however slow the model is")
+    parser.add_argument(
+        '--prerender_overlays', action='store_true',
+        help="Draw the overlays into an image once per result, and only "
+        "paint that image over each video frame")
+    parser.add_argument(
+        '--detect_every', type=int, default=1, metavar='N',
+        help="Only evaluate the model on every Nth frame, and move the boxes "
+        "along with a tracker on the frames in between (default: "
+        "%(default)s, every frame)")
+    parser.add_argument(
+        '--adaptive', action='store_true',
+        help="With --detect_every N, evaluate the model as often as the "
+        "tracker needs correcting: every frame when objects move "
+        "unpredictably, and down to every Nth frame when they don't")
+    args = parser.parse_args(args)
+    if args.detect_every < 1:
+        parser.error("--detect_every must be at least 1")
+    if (args.detect_every > 1 or args.adaptive) and args.inference_worker:
+        parser.error("--detect_every and --adaptive can't be combined with "
+                     "--inference_worker")
+    return args
+
+
+def draw_results(pipeline, model, results):
+    """Replace the overlays with a BoundingBox for each item in @results"""
+    scene = [overlays.Text(model.name, x=0, y=0, bg_color=color_by_id(-1))]
+    for item in results:
+        rect = item.rectangle
+        scene.append(overlays.BoundingBox(
+            rect.x, rect.y, rect.width, rect.height,
+            item.class_label.label,
+            bg_color=color_by_id(item.class_label.class_id)))
+    pipeline.set_overlays(scene)
+
+
+def run_with_tracker(pipeline, model, evaluate, args):
+    """Evaluate the model on only some of the frames, as scheduled by
+    --detect_every and --adaptive, and draw tracked boxes on every frame
+    """
+    # The tracker needs NumPy, which the other modes don't
+    from common_util.tracker import BoxTracker, DetectionScheduler
+
+    tracker = BoxTracker()
+    scheduler = DetectionScheduler(args.detect_every, adaptive=args.adaptive)
+    while pipeline.running:
+        # The frame is only mapped if the model is going to look at it
+        mapped_frame = pipeline.get_mapped_frame()
+        if mapped_frame is None:
+            break
+        now = time.monotonic()
+        if scheduler.next_frame():
+            with mapped_frame as frame:
+                results = evaluate(frame)
+            scheduler.report_quality(tracker.update(results, now))
+
+        draw_results(pipeline, model, tracker.predict(now))
+        gc.collect()
+
+    if scheduler.frames:
+        print("Evaluated the model on {} of {} frames ({:.0%})".format(
+            scheduler.evaluations, scheduler.frames,
+            scheduler.evaluations / scheduler.frames))
+
+
+def run_every_frame(pipeline, model, evaluate, args):
+    """Draw the model's results for every frame it evaluates, on this thread
+    or (with --inference_worker) on a background one
+    """
+    if args.inference_worker:
+        pipeline.start_inference_worker(evaluate)
+
+    while pipeline.running:
+        if args.inference_worker:
+            # Wait for the worker to finish evaluating a newer frame
+            inference = pipeline.get_inference_result()
+            if inference is None:
+                continue
+            results = inference.results
+        else:
+            # Get a frame of video from the pipeline, without copying it
+            # out of the pipeline's buffer.
+            mapped_frame = pipeline.get_mapped_frame()
+            if mapped_frame is None:
+                break
+            with mapped_frame as frame:
+                results = evaluate(frame)
+
+        # Draw the results as BoundingBox overlays
+        draw_results(pipeline, model, results)
+        gc.collect()
 
 
 def main():
@@ -52,34 +147,25 @@ def main():
     print("Model: {}".format(model.name))
     print("  version {!r}".format(model.version))
 
+    def evaluate(frame):
+        # Feed the video frame into the model
+        input = xnornet.Input.rgb_image(frame.size, frame.data)
+        return model.evaluate(input)
+
     # Create and start the video pipeline
     with gst_pipeline.VideoOverlayPipeline(
             "Xnor Object Detection Demo",
             args.webcam_device,
-            args.video_file) as pipeline:
+            args.video_file,
+            prerender_overlays=args.prerender_overlays) as pipeline:
 
-        while pipeline.running:
-            # Get a frame of video from the pipeline.
-            frame = pipeline.get_frame()
-            if frame is None:
-                break
+        if args.detect_every > 1 or args.adaptive:
+            run_with_tracker(pipeline, model, evaluate, args)
+        else:
+            run_every_frame(pipeline, model, evaluate, args)
 
-            # Feed the video frame into the model
-            input = xnornet.Input.rgb_image(frame.size, frame.data)
-            results = model.evaluate(input)
-
-            # Draw the results as BoundingBox overlays
-            pipeline.clear_overlay()
-            pipeline.add_overlay(overlays.Text(model.name, x=0, y=0,
-                                               bg_color=color_by_id(-1)))
-            for item in results:
-                rect = item.rectangle
-                bbox = overlays.BoundingBox(
-                    rect.x, rect.y, rect.width, rect.height,
-                    item.class_label.label,
-                    bg_color=color_by_id(item.class_label.class_id))
-                pipeline.add_overlay(bbox)
-            gc.collect()
+    # How well the rendered labels are reused; see overlays.LabelCache
+    print("Overlay labels: " + overlays.LABEL_CACHE.stats())
 
 
 if __name__ == "__main__":
@@ -35,6 +35,11 @@ def parse_args(args=None):
         help="/dev/ identifier of a webcam to use"
         "(If neither webcam_device or video_file are specified,"
         "GStreamer defaults to /dev/video0)")
+    parser.add_argument(
+        '--inference_worker', action='store_true',
+        help="Evaluate the model on a background thread, so that the window "
+        "stays responsive and the overlays update as soon as results are "
+        "ready, however slow the model is")
     return parser.parse_args(args)
 
 
@@ -52,31 +57,44 @@ def main():
     print("Model: {}".format(model.name))
     print("  version {!r}".format(model.version))
 
+    def evaluate(frame):
+        # Feed the video frame into the model
+        input = xnornet.Input.rgb_image(frame.size, frame.data)
+        return model.evaluate(input)
+
     # Start the pipeline
     pipeline = gst_pipeline.VideoOverlayPipeline(
         "Xnor Scene Classification Demo", args.webcam_device, args.video_file)
     pipeline.start()
 
-    while pipeline.running:
-        # Get a frame of video from the pipeline.
-        frame = pipeline.get_frame()
-        if frame is None:
-            break
+    if args.inference_worker:
+        pipeline.start_inference_worker(evaluate)
 
-        # Feed the video frame into the model
-        input = xnornet.Input.rgb_image(frame.size, frame.data)
-        results = model.evaluate(input)
+    while pipeline.running:
+        if args.inference_worker:
+            # Wait for the worker to finish evaluating a newer frame
+            inference = pipeline.get_inference_result()
+            if inference is None:
+                continue
+            frame, results = inference
+        else:
+            # Get a frame of video from the pipeline, without copying it
+            # out of the pipeline's buffer.
+            mapped_frame = pipeline.get_mapped_frame()
+            if mapped_frame is None:
+                break
+            with mapped_frame as frame:
+                results = evaluate(frame)
 
         # Draw the results as Text overlays
-        pipeline.clear_overlay()
-        pipeline.add_overlay(overlays.Text(model.name, x=frame.size[0] / 3,
-                                           y=0, bg_color=color_by_id(-1)))
+        scene = [overlays.Text(model.name, x=frame.size[0] / 3, y=0,
+                               bg_color=color_by_id(-1))]
         label_y_coord = 0
         for item in results:
-            label = overlays.Text(item.label, y=label_y_coord,
-                                  bg_color=color_by_id(item.class_id))
-            pipeline.add_overlay(label)
+            scene.append(overlays.Text(item.label, y=label_y_coord,
+                                       bg_color=color_by_id(item.class_id)))
             label_y_coord += overlays.Text.LINE_WIDTH * 4
+        pipeline.set_overlays(scene)
         gc.collect()
 
 
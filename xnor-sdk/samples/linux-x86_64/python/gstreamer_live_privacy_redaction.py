@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Xnor SDK sample application: Privacy redaction"""
+
+import argparse
+import collections
+import gc
+import sys
+
+if sys.version_info[0] < 3:
+    sys.exit("This sample requires Python 3. Please install Python 3!")
+
+# Colorful printing!
+import common_util.ansi as ansi
+# Support code that helps capture video from various sources
+import common_util.gstreamer_video_pipeline as gst_pipeline
+# The video effects: the native module, or a NumPy version if it isn't built
+import common_util.effects_loader as effects_loader
+effects = effects_loader.load_effects()
+
+# "xnornet" is the module provided by the installed model
+try:
+    import xnornet
+except ImportError as e:
+    print(ansi.RED + "ERROR: " + ansi.NORMAL +
+          "Unable to import an Xnornet model!")
+    print("(Have you installed one? See the SDK README.md for more info)\n")
+    raise e
+
+# A rectangle to redact, in coordinates relative to the frame size like an
+# `xnornet.Rectangle`
+Region = collections.namedtuple("Region", ["x", "y", "width", "height"])
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False)
+    parser.add_argument('--video_file', required=False,
+                        help="URI of a video file")
+    parser.add_argument(
+        '--webcam_device', required=False,
+        help="/dev/ identifier of a webcam to use "
+        "(If neither webcam_device or video_file are specified, "
+        "GStreamer defaults to /dev/video0)")
+    parser.add_argument(
+        '--mode', choices=["pixelate", "blur"], default="pixelate",
+        help="How to hide the detected objects (default: %(default)s)")
+    parser.add_argument(
+        '--block_size', type=int, default=16,
+        help="Size in pixels of the squares that --mode pixelate averages "
+        "(default: %(default)s)")
+    parser.add_argument(
+        '--box_size', type=int, default=31,
+        help="Width in pixels of the box blur of --mode blur; must be odd "
+        "(default: %(default)s)")
+    parser.add_argument(
+        '--classes', nargs='+', metavar='LABEL',
+        help="Only redact objects with these labels, e.g. --classes person "
+        "(default: every detected object)")
+    parser.add_argument(
+        '--padding', type=float, default=0.1,
+        help="Grow each box by this fraction of its size on every side, so "
+        "that the edges of objects are hidden too (default: %(default)s)")
+    parser.add_argument(
+        '--threads', type=int, default=0,
+        help="Number of threads to use for the redaction (default: one per "
+        "CPU core)")
+    return parser.parse_args(args)
+
+
+def regions_to_redact(results, classes, padding):
+    """Return the Regions covering the detected objects in @results whose
+    labels are in @classes (or all of them if it's None), grown by @padding
+    """
+    regions = []
+    for item in results:
+        if classes is not None and item.class_label.label not in classes:
+            continue
+        rect = item.rectangle
+        regions.append(
+            Region(rect.x - rect.width * padding,
+                   rect.y - rect.height * padding,
+                   rect.width * (1 + 2 * padding),
+                   rect.height * (1 + 2 * padding)))
+    return regions
+
+
+def main():
+    args = parse_args()
+
+    model = xnornet.Model.load_built_in()
+
+    if model.result_type != xnornet.EvaluationResultType.BOUNDING_BOXES:
+        sys.exit(model.name + " is not a detection model! This sample requires "
+                 "a detection model to be installed (e.g. "
+                 "person-pet-vehicle-detector).")
+
+    print("Xnor Privacy Redaction Demo")
+    print("Model: {}".format(model.name))
+    print("  version {!r}".format(model.version))
+
+    classes = set(args.classes) if args.classes is not None else None
+    redact_params = {"mode": args.mode, "threads": args.threads}
+    if args.mode == "pixelate":
+        redact_params["block_size"] = args.block_size
+    else:
+        redact_params["box_size"] = args.box_size
+
+    pipeline = gst_pipeline.VideoProcessingPipeline(
+        "Xnor Privacy Redaction Demo", args.webcam_device, args.video_file)
+    pipeline.start()
+
+    while pipeline.running:
+        # Unlike get_mapped_frame(), this copies the frame into a writable
+        # bytearray (see GStreamerPipeline.get_frame), which the objects can
+        # then be redacted from in place
+        frame = pipeline.get_frame()
+        if frame is None:
+            continue
+        input = xnornet.Input.rgb_image(frame.size, frame.data)
+        results = model.evaluate(input)
+
+        # Only the pixels inside the regions are touched, so this costs
+        # little when the objects are small
+        effects.redact(frame, regions_to_redact(results, classes,
+                                                args.padding),
+                       **redact_params)
+        pipeline.put_frame(frame)
+        gc.collect()
+
+
+if __name__ == "__main__":
+    main()
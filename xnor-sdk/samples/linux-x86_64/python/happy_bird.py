@@ -174,15 +174,12 @@ def start_game(pipeline, model, emotion):
             emotion_id = results[0].class_id
             emotion_label = results[0].label
 
-        pipeline.clear_overlay()
-
         # Draw bird
         ibox = overlays.FilledBox(
             X_BIRD / SURFACE_WIDTH, y_bird / SURFACE_HEIGHT,
             BIRD_WIDTH / SURFACE_WIDTH, BIRD_HEIGHT / SURFACE_HEIGHT,
             emotion_label, bg_color=color_by_id(emotion_id),
             opacity=BIRD_OPACITY)
-        pipeline.add_overlay(ibox)
 
         # Draw blocks
         tbox = overlays.FilledBox(
@@ -197,13 +194,11 @@ def start_game(pipeline, model, emotion):
             BLOCK_WIDTH / SURFACE_WIDTH,
             (SURFACE_HEIGHT - b2height) / SURFACE_HEIGHT, None,
             bg_color=block_color, opacity=BLOCK_OPACITY)
-        pipeline.add_overlay(tbox)
-        pipeline.add_overlay(bbox)
 
         # Draw score
         sbox = overlays.Text("score: " + str(current_score), x=0, y=0,
                              bg_color=SCORE_COLOR)
-        pipeline.add_overlay(sbox)
+        pipeline.set_overlays((ibox, tbox, bbox, sbox))
         # End drawing step
 
     return False  # User has not exited
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Xnor.ai, Inc.
+"""
+Benchmarks drawing overlays (see common_util/overlays.py) onto video frames.
+
+For each number of bounding boxes given, times what the cairooverlay draw
+callback of VideoOverlayPipeline costs per frame: drawing every overlay, as
+by default, or painting a layer they were prerendered into, as with
+prerender_overlays. Also times prerendering the layer, which happens once per
+scene instead of once per frame.
+"""
+import argparse
+import random
+import sys
+import time
+
+if sys.version_info[0] < 3:
+    sys.exit("This sample requires Python 3. Please install Python 3!")
+
+try:
+    import cairo
+except ImportError:
+    sys.exit("Requires pycairo module. "
+             "Please install it with pip:\n\n"
+             "   pip3 install pycairo\n"
+             "(drop the --user if you are using a virtualenv)")
+
+import common_util.colors as colors
+import common_util.overlays as overlays
+
+LABELS = ("person", "pet", "vehicle")
+
+
+def _parse_resolution(text):
+    """argparse type for resolutions written as WIDTHxHEIGHT"""
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "resolution must look like 1280x720, not {!r}".format(text))
+    return width, height
+
+
+def _make_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False)
+    parser.add_argument(
+        "--resolution", type=_parse_resolution, default=(1280, 720),
+        metavar="WIDTHxHEIGHT", help="Size of the video frames (default: "
+        "1280x720).")
+    parser.add_argument(
+        "--box_counts", nargs='+', type=int, default=[1, 5, 10, 20, 50],
+        help="Numbers of bounding boxes to benchmark.")
+    parser.add_argument(
+        "--iterations", type=int, default=200,
+        help="Frames to draw per configuration.")
+    return parser
+
+
+def make_scene(n_boxes):
+    """Return a model name label and @n_boxes randomly placed BoundingBoxes,
+    like the object detector sample draws
+    """
+    scene = [overlays.Text("benchmark-model", x=0, y=0,
+                           bg_color=[c / 255 for c in colors.COLORS[-1]])]
+    for _ in range(n_boxes):
+        class_id = random.randrange(len(LABELS))
+        width, height = random.uniform(0.05, 0.3), random.uniform(0.05, 0.3)
+        scene.append(overlays.BoundingBox(
+            random.uniform(0, 1 - width), random.uniform(0, 1 - height),
+            width, height, LABELS[class_id],
+            bg_color=[c / 255 for c in colors.COLORS[class_id]]))
+    return scene
+
+
+def time_per_iteration(function, iterations):
+    """Call @function @iterations times, returning the mean time in ms"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main(args=None):
+    parser = _make_argument_parser()
+    args = parser.parse_args(args)
+    width, height = args.resolution
+
+    # Like the frames the cairooverlay element hands to the draw callback
+    frame = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    cr = cairo.Context(frame)
+
+    def draw_overlays(scene):
+        for overlay in scene:
+            overlay.draw(None, cr, None, None)
+
+    def paint_layer(layer):
+        cr.set_source_surface(layer, 0, 0)
+        cr.paint()
+
+    print("{:>6} {:>14} {:>14} {:>14}".format(
+        "Boxes", "Draw ms/frame", "Paint ms/frame", "Render ms"))
+    for n_boxes in args.box_counts:
+        scene = make_scene(n_boxes)
+        # Fill the label cache, as a running sample would have
+        draw_overlays(scene)
+
+        draw_ms = time_per_iteration(lambda: draw_overlays(scene),
+                                     args.iterations)
+        render_ms = time_per_iteration(
+            lambda: overlays.render_layer(scene, width, height),
+            max(args.iterations // 10, 1))
+        layer = overlays.render_layer(scene, width, height)
+        paint_ms = time_per_iteration(lambda: paint_layer(layer),
+                                      args.iterations)
+        print("{:>6} {:14.3f} {:14.3f} {:14.3f}".format(
+            n_boxes, draw_ms, paint_ms, render_ms))
+    print("")
+    print("Overlay labels: " + overlays.LABEL_CACHE.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,14 @@
 
 from distutils.core import setup, Extension
 
+# The effects pick SIMD code for the CPU they run on at import time, so the
+# module is built for the baseline instruction set rather than -march=native.
+# Contracting multiplies and adds into FMA instructions would make the results
+# differ between instruction sets, so it's turned off.
 module1 = Extension('xnor_util.effects',
-                    extra_compile_args=["--std=c++14", "-O3", "-march=native"],
+                    extra_compile_args=["--std=c++14", "-O3",
+                                        "-ffp-contract=off", "-pthread"],
+                    extra_link_args=["-pthread"],
                     sources=['common_util/effects.cc'])
 
 setup(name='xnor_python_samples', version='1.0',
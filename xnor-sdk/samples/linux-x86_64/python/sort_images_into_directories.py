@@ -20,9 +20,14 @@ script to move the images into different directories:
 """
 
 import argparse
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
 import os
 import shutil
 import sys
+import time
 
 if sys.version_info[0] < 3:
     sys.exit("This sample requires Python 3. Please install Python 3!")
@@ -37,6 +42,10 @@ except ImportError:
     raise
 
 
+# Per-process model used by the --workers process pool; see _init_worker.
+_WORKER_MODEL = None
+
+
 def _make_argument_parser():
     parser = argparse.ArgumentParser(
         description=__doc__, allow_abbrev=False,
@@ -50,26 +59,45 @@ def _make_argument_parser():
         '--move', action='store_true', help="Move files "
         "rather than copying them. This will remove all jpeg files from the "
         "input directory.")
+    parser.add_argument(
+        '--workers', action='store', type=int, default=0,
+        help="Number of worker processes to evaluate images with, each with "
+        "its own model. File reads are prefetched and copies/moves happen on "
+        "a separate I/O thread pool. 0 (the default) sorts serially.")
+    parser.add_argument(
+        '--io_threads', action='store', type=int, default=4,
+        help="Number of threads used for reading and for copying/moving files "
+        "when --workers is set.")
     return parser
 
 
-def main(args=None):
-    parser = _make_argument_parser()
-    args = parser.parse_args(args)
-
-    try:
-        os.mkdir(args.output_dir)
-    except FileExistsError:
-        parser.error("output directory already exists")
-
-    model = xnornet.Model.load_built_in()
+def _label_for_result(result):
+    """Returns the directory name an image with evaluation @result goes in"""
+    if result:
+        if isinstance(result[0], xnornet.ClassLabel):
+            # This is a classification model.  Pick the top class.
+            return result[0].label
+        elif isinstance(result[0], xnornet.BoundingBox):
+            # This is an object detection model.  This probably isn't the
+            # best kind of model to use for this application, but it's
+            # workable if you want it.  For kicks, we'll include the names
+            # of all unique objects in our directory name.
+            return '_and_'.join(
+                sorted(set(item.class_label.label for item in result)))
+        else:
+            raise TypeError(
+                "Evaluation result list items are not class labels or "
+                "bounding boxes; are you sure you're using a "
+                "classification or object detection model?")
+    else:
+        return "unknown"
 
-    print("Sorting images into directories")
-    print("Model: {}".format(model.name))
-    print("  version {!r}".format(model.version))
 
-    for filename in os.listdir(args.input_dir):
-        source_path = os.path.join(args.input_dir, filename)
+def _list_jpeg_files(input_dir):
+    """Returns the names of the JPEG files in @input_dir, in listing order"""
+    filenames = []
+    for filename in os.listdir(input_dir):
+        source_path = os.path.join(input_dir, filename)
         if not os.path.isfile(source_path):
             print("skipping {!r} (not a file)".format(filename),
                   file=sys.stderr)
@@ -81,43 +109,199 @@ def main(args=None):
                   file=sys.stderr)
             continue
 
-        with open(source_path, 'rb') as f:
-            xnor_input = xnornet.Input.jpeg_image(f.read())
+        filenames.append(filename)
+    return filenames
+
+
+class StageTimer:
+    """Accumulates the number of images and busy time spent in one stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy_time = 0
+
+    def add(self, duration):
+        self.count += 1
+        self.busy_time += duration
+
+    def summary(self):
+        rate = self.count / self.busy_time if self.busy_time > 0 else 0
+        return ("  {:<10} {:>7} images  {:8.3f} s busy  "
+                "{:9.1f} images/s per worker".format(
+                    self.name + ":", self.count, self.busy_time, rate))
+
+
+def _read_file(path):
+    t0 = time.time()
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, time.time() - t0
+
+
+def _place_file(args, filename, label):
+    """Copies (or moves) @filename from the input directory into the @label
+    subdirectory of the output directory. Returns the time taken.
+    """
+    t0 = time.time()
+    source_path = os.path.join(args.input_dir, filename)
+    dest_dir = os.path.join(args.output_dir, label)
+    dest_path = os.path.join(dest_dir, filename)
+    if args.move:
+        os.rename(source_path, dest_path)
+    else:
+        shutil.copyfile(source_path, dest_path)
+    return time.time() - t0
+
+
+def _announce_destination(args, filename, label):
+    """Creates the destination directory for @label and logs the operation"""
+    source_path = os.path.join(args.input_dir, filename)
+    dest_dir = os.path.join(args.output_dir, label)
+    try:
+        os.mkdir(dest_dir)
+    except FileExistsError:
+        pass
+
+    print(
+        "{} {!r} into {!r}".format("moving" if args.move else "copying",
+                                   source_path, dest_dir), file=sys.stderr)
+
+
+def _sort_serially(args, model, filenames, timers):
+    for filename in filenames:
+        source_path = os.path.join(args.input_dir, filename)
+        data, read_time = _read_file(source_path)
+        timers['read'].add(read_time)
+
+        t0 = time.time()
+        xnor_input = xnornet.Input.jpeg_image(data)
         result = model.evaluate(xnor_input)
+        label = _label_for_result(result)
+        timers['evaluate'].add(time.time() - t0)
 
-        if result:
-            if isinstance(result[0], xnornet.ClassLabel):
-                # This is a classification model.  Pick the top class.
-                label = result[0].label
-            elif isinstance(result[0], xnornet.BoundingBox):
-                # This is an object detection model.  This probably isn't the
-                # best kind of model to use for this application, but it's
-                # workable if you want it.  For kicks, we'll include the names
-                # of all unique objects in our directory name.
-                label = '_and_'.join(
-                    sorted(set(item.class_label.label for item in result)))
-            else:
-                raise TypeError(
-                    "Evaluation result list items are not class labels or "
-                    "bounding boxes; are you sure you're using a "
-                    "classification or object detection model?")
-        else:
-            label = "unknown"
-
-        dest_dir = os.path.join(args.output_dir, label)
-        try:
-            os.mkdir(dest_dir)
-        except FileExistsError:
-            pass
-
-        print(
-            "{} {!r} into {!r}".format("moving" if args.move else "copying",
-                                       source_path, dest_dir), file=sys.stderr)
-        dest_path = os.path.join(dest_dir, filename)
-        if args.move:
-            os.rename(source_path, dest_path)
-        else:
-            shutil.copyfile(source_path, dest_path)
+        _announce_destination(args, filename, label)
+        timers['copy'].add(_place_file(args, filename, label))
+
+
+def _init_worker():
+    """Process pool initializer: loads this worker's own model"""
+    global _WORKER_MODEL
+    # Each worker process runs on its own core, so one thread per model avoids
+    # oversubscribing the CPU.
+    _WORKER_MODEL = xnornet.Model.load_built_in(
+        threading_model=xnornet.Model.SINGLE_THREADED)
+
+
+def _describe_worker_model():
+    return _WORKER_MODEL.name, _WORKER_MODEL.version
+
+
+def _print_model(name, version):
+    print("Model: {}".format(name))
+    print("  version {!r}".format(version))
+
+
+def _evaluate_in_worker(data):
+    t0 = time.time()
+    xnor_input = xnornet.Input.jpeg_image(data)
+    label = _label_for_result(_WORKER_MODEL.evaluate(xnor_input))
+    return label, time.time() - t0
+
+
+def _prefetch_reads(io_pool, input_dir, filenames, depth):
+    """Yields (filename, data, read_time) in order, keeping up to @depth file
+    reads in flight ahead of the consumer.
+    """
+    def submit(filename):
+        path = os.path.join(input_dir, filename)
+        return filename, io_pool.submit(_read_file, path)
+
+    names = iter(filenames)
+    pending = collections.deque(
+        submit(filename) for filename in itertools.islice(names, depth))
+    while pending:
+        filename, read_future = pending.popleft()
+        next_filename = next(names, None)
+        if next_filename is not None:
+            pending.append(submit(next_filename))
+        data, read_time = read_future.result()
+        yield filename, data, read_time
+
+
+def _sort_in_parallel(args, filenames, timers):
+    # Enough images in flight to keep every worker busy while the main thread
+    # hands out results, without holding the whole directory in memory.
+    depth = 2 * args.workers
+    read_pool = concurrent.futures.ThreadPoolExecutor(args.io_threads)
+    copy_pool = concurrent.futures.ThreadPoolExecutor(args.io_threads)
+    copies = []
+
+    def finish(filename, evaluation):
+        label, evaluate_time = evaluation.get()
+        timers['evaluate'].add(evaluate_time)
+        # Directory creation and logging stay on this thread and in input
+        # order, so the output matches the serial mode exactly.
+        _announce_destination(args, filename, label)
+        copies.append(copy_pool.submit(_place_file, args, filename, label))
+
+    with multiprocessing.Pool(args.workers, _init_worker) as pool:
+        # The parent never loads a model: forking a process that is already
+        # running the model's threads isn't safe
+        _print_model(*pool.apply(_describe_worker_model))
+        print("  using {} worker processes".format(args.workers))
+        evaluations = collections.deque()
+        for filename, data, read_time in _prefetch_reads(
+                read_pool, args.input_dir, filenames, depth):
+            timers['read'].add(read_time)
+            evaluations.append(
+                (filename, pool.apply_async(_evaluate_in_worker, (data,))))
+            if len(evaluations) >= depth:
+                finish(*evaluations.popleft())
+        while evaluations:
+            finish(*evaluations.popleft())
+
+    read_pool.shutdown()
+    copy_pool.shutdown()
+    for copy in copies:
+        timers['copy'].add(copy.result())
+
+
+def main(args=None):
+    parser = _make_argument_parser()
+    args = parser.parse_args(args)
+    if args.workers < 0:
+        parser.error("--workers must not be negative")
+    if args.io_threads < 1:
+        parser.error("--io_threads must be at least 1")
+
+    try:
+        os.mkdir(args.output_dir)
+    except FileExistsError:
+        parser.error("output directory already exists")
+
+    print("Sorting images into directories")
+
+    filenames = _list_jpeg_files(args.input_dir)
+    timers = collections.OrderedDict(
+        (name, StageTimer(name)) for name in ('read', 'evaluate', 'copy'))
+
+    t0 = time.time()
+    if args.workers > 0:
+        _sort_in_parallel(args, filenames, timers)
+    else:
+        model = xnornet.Model.load_built_in()
+        _print_model(model.name, model.version)
+        _sort_serially(args, model, filenames, timers)
+    duration = time.time() - t0
+
+    print("")
+    print("Summary")
+    print("  Sorted {} images in {:.3f} s ({:.1f} images/s)".format(
+        len(filenames), duration,
+        len(filenames) / duration if duration > 0 else 0))
+    for timer in timers.values():
+        print(timer.summary())
 
 
 if __name__ == '__main__':
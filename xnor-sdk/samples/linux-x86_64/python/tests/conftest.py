@@ -0,0 +1,10 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+import os.path
+import sys
+
+# Import the samples' common_util, and the offline xnornet stand-in in place
+# of a model wheel
+SAMPLES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SAMPLES_DIR)
+sys.path.insert(0, os.path.join(SAMPLES_DIR, "fake_xnornet"))
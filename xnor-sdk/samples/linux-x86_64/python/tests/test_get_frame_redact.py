@@ -0,0 +1,57 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Tests that the frames of GStreamerPipeline.get_frame can be redacted"""
+
+import collections
+
+import pytest
+
+# The pipeline module needs GStreamer's Python bindings
+pytest.importorskip("gi")
+
+import common_util.effects_loader as effects_loader
+from common_util.gstreamer_video_pipeline import GStreamerPipeline
+from common_util.gstreamer_video_pipeline import Gst
+
+Region = collections.namedtuple("Region", ["x", "y", "width", "height"])
+
+WIDTH = 8
+HEIGHT = 4
+
+
+class FakePipeline:
+    """Stands in for a running pipeline, returning @gst_sample as its only
+    sample
+    """
+
+    _sample_to_frame = staticmethod(GStreamerPipeline._sample_to_frame)
+
+    def __init__(self, gst_sample):
+        self._gst_sample = gst_sample
+
+    def _get_sample(self):
+        return self._gst_sample
+
+
+def _make_sample(data):
+    Gst.init(None)
+    caps = Gst.Caps.from_string(
+        "video/x-raw,format=RGB,width={},height={}".format(WIDTH, HEIGHT))
+    return Gst.Sample.new(Gst.Buffer.new_wrapped(data), caps, None, None)
+
+
+@pytest.mark.parametrize("mode", ["pixelate", "blur"])
+def test_redact_frame(mode):
+    data = bytes(range(WIDTH * HEIGHT * 3))
+    frame = GStreamerPipeline.get_frame(FakePipeline(_make_sample(data)))
+    assert isinstance(frame.data, bytearray)
+
+    effects = effects_loader.load_effects()
+    effects.redact(frame, [Region(0.0, 0.0, 0.5, 1.0)], mode=mode)
+    assert bytes(frame.data) != data
+    # Only the left half of every row is redacted
+    row_size = WIDTH * 3
+    for row in range(HEIGHT):
+        start = row * row_size + row_size // 2
+        assert (frame.data[start:start + row_size // 2] ==
+                data[start:start + row_size // 2])
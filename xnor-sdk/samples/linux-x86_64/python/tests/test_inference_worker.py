@@ -0,0 +1,85 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Tests that an InferenceWorker hands evaluation errors to its caller"""
+
+import pytest
+
+# The pipeline module needs GStreamer's Python bindings
+pytest.importorskip("gi")
+
+import xnornet
+
+from common_util.gstreamer_video_pipeline import Frame
+from common_util.gstreamer_video_pipeline import Gst
+from common_util.gstreamer_video_pipeline import InferenceWorker
+
+
+class FakeBuffer:
+    def __init__(self, pts):
+        self.pts = pts
+
+
+class FakeSample:
+    def __init__(self, pts):
+        self._buffer = FakeBuffer(pts)
+
+    def get_buffer(self):
+        return self._buffer
+
+
+class FakePipeline:
+    """Plays frames of @frame_data as fast as the worker pulls them"""
+
+    def __init__(self, frame_data):
+        self._frame_data = frame_data
+        self._pts = 0
+
+    def _get_state(self):
+        return Gst.State.PLAYING
+
+    def _pull_sample(self, state, timeout):
+        self._pts += 1
+        return FakeSample(self._pts)
+
+    def _sample_to_frame(self, sample):
+        return Frame("RGB", (4, 2), self._frame_data)
+
+
+def _evaluate(model):
+    def evaluate(frame):
+        return model.evaluate(xnornet.Input.rgb_image(frame.size, frame.data))
+    return evaluate
+
+
+def _run_worker(frame_data):
+    worker = InferenceWorker(FakePipeline(frame_data),
+                             _evaluate(xnornet.Model.load_built_in()))
+    worker.start()
+    try:
+        return worker.get_result(timeout=5)
+    finally:
+        worker.stop()
+
+
+def test_result():
+    result = _run_worker(bytes(4 * 2 * 3))
+    assert result is not None
+    assert result.frame.size == (4, 2)
+
+
+def test_evaluate_error_is_raised():
+    # A frame too small for its size makes the model's input raise
+    with pytest.raises(ValueError, match="RGB data is 3 bytes"):
+        _run_worker(bytes(3))
+
+
+def test_error_is_raised_again():
+    worker = InferenceWorker(FakePipeline(bytes(3)),
+                             _evaluate(xnornet.Model.load_built_in()))
+    worker.start()
+    try:
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                worker.get_result(timeout=5)
+    finally:
+        worker.stop()
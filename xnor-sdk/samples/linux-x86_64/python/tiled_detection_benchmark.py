@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Xnor.ai, Inc.
+"""
+Benchmarks tiled detection of large frames; see common_util/tiled_evaluator.py
+
+Evaluates a large random frame tile by tile on a pool of models, for every
+combination of tile size and overlap given, and reports how many tiles and
+frames per second each manages and how many boxes survive merging.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+if sys.version_info[0] < 3:
+    sys.exit("This sample requires Python 3. Please install Python 3!")
+
+try:
+    import xnornet
+except ImportError:
+    sys.exit("The xnornet wheel is not installed.  "
+             "Please install it with pip:\n\n"
+             "    python3 -m pip install --user xnornet-<...>.whl\n\n"
+             "(drop the --user if you are using a virtualenv)")
+
+from common_util.model_pool import ModelPool
+from common_util.tiled_evaluator import TiledEvaluator
+
+
+def _parse_resolution(text):
+    """argparse type for resolutions written as WIDTHxHEIGHT"""
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "resolution must look like 448x256, not {!r}".format(text))
+    return width, height
+
+
+def _random_bytes(size):
+    """Returns @size random bytes"""
+    return random.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def _make_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False)
+    parser.add_argument(
+        "--input_resolution", type=_parse_resolution, default=(3840, 2160),
+        metavar="WIDTHxHEIGHT", help="Size of the frame to cut into tiles "
+        "(default: 3840x2160).")
+    parser.add_argument(
+        "--tile_sizes", nargs='+', type=_parse_resolution,
+        default=[(448, 256), (640, 360), (896, 512)], metavar="WIDTHxHEIGHT",
+        help="Tile sizes to benchmark.")
+    parser.add_argument(
+        "--overlaps", nargs='+', type=float, default=[0.0, 0.1, 0.25],
+        help="Fractions of the tile size that neighbouring tiles share.")
+    parser.add_argument(
+        "--no_full_frame", action='store_true',
+        help="Only evaluate the tiles, not also the whole frame.")
+    parser.add_argument(
+        "--pool_size", type=int, default=os.cpu_count() or 1,
+        help="Number of models to evaluate tiles on concurrently (default: "
+        "one per CPU).")
+    parser.add_argument(
+        "--iterations", type=int, default=20,
+        help="Maximum number of frames to evaluate per configuration.")
+    parser.add_argument(
+        "--max_duration", type=float, default=10,
+        help="Maximum time to spend per configuration, in seconds.")
+    return parser
+
+
+def time_configuration(evaluator, frame_size, data, iterations, max_duration):
+    """Evaluate the frame up to @iterations times or for up to @max_duration
+    seconds, and return (frames evaluated, seconds taken, boxes found in the
+    last frame)
+    """
+    # Warm up the models and the executor
+    boxes = evaluator.evaluate(frame_size, data)
+    frames = 0
+    start = time.perf_counter()
+    while frames < iterations and (
+            frames == 0 or time.perf_counter() - start < max_duration):
+        boxes = evaluator.evaluate(frame_size, data)
+        frames += 1
+    return frames, time.perf_counter() - start, len(boxes)
+
+
+def main(args=None):
+    parser = _make_argument_parser()
+    args = parser.parse_args(args)
+    width, height = args.input_resolution
+
+    print("Loading {} models...".format(args.pool_size))
+    with ModelPool(args.pool_size) as pool:
+        if pool.result_type != xnornet.EvaluationResultType.BOUNDING_BOXES:
+            sys.exit(pool.name + " is not a detection model! This benchmark "
+                     "requires a detection model to be installed (e.g. "
+                     "person-pet-vehicle-detector).")
+        print("Model: {}".format(pool.name))
+        print("  version {!r}".format(pool.version))
+
+        data = _random_bytes(width * height * 3)
+        results = []
+        for tile_size in args.tile_sizes:
+            for overlap in args.overlaps:
+                evaluator = TiledEvaluator(
+                    pool, tile_size=tile_size, overlap=overlap,
+                    full_frame=not args.no_full_frame)
+                n_tiles = len(evaluator.tiles((width, height)))
+                print("Benchmarking {}x{} tiles with {:.0%} overlap "
+                      "({} tiles)...".format(tile_size[0], tile_size[1],
+                                             overlap, n_tiles))
+                frames, seconds, n_boxes = time_configuration(
+                    evaluator, (width, height), data, args.iterations,
+                    args.max_duration)
+                results.append((tile_size, overlap, n_tiles, frames / seconds,
+                                n_tiles * frames / seconds, n_boxes))
+
+    print("")
+    print("Frame: {}x{}, {} models{}".format(
+        width, height, args.pool_size,
+        "" if args.no_full_frame else ", plus a full-frame pass per frame"))
+    print("{:>9} {:>8} {:>6} {:>9} {:>9} {:>6}".format(
+        "Tile", "Overlap", "Tiles", "Frames/s", "Tiles/s", "Boxes"))
+    for tile_size, overlap, n_tiles, fps, tiles_per_second, n_boxes in results:
+        print("{:>9} {:>8.0%} {:>6} {:9.2f} {:9.1f} {:>6}".format(
+            "{}x{}".format(*tile_size), overlap, n_tiles, fps,
+            tiles_per_second, n_boxes))
+
+
+if __name__ == "__main__":
+    main()
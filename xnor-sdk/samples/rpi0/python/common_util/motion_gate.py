@@ -0,0 +1,109 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Skip evaluating the model on camera frames where nothing moves.
+
+A MotionGate compares a heavily downsampled copy of each frame's brightness
+with the previous one's, and only lets frames through while enough of it
+changes (or every so often regardless):
+
+    gate = MotionGate(camera.resolution)
+    while running:
+        frame = reader.read()
+        y_plane = frame.planes[0]
+        brightness = Image.frombuffer("L", camera.resolution, y_plane,
+                                      "raw", "L", 0, 1)
+        if gate.check(brightness):
+            results = model.evaluate(...)
+"""
+
+import time
+
+from PIL import Image
+from PIL import ImageChops
+
+
+class MotionGate:
+    """Decides which frames are worth evaluating the model on, by comparing a
+    heavily downsampled copy of each frame's brightness (Y plane) with the
+    previous one's. Evaluating only while something moves saves most of the
+    CPU time, and so power and heat, when the scene is static.
+
+    - `resolution`: (width, height) of the frames
+    - `threshold`: fraction of the downsampled pixels that must change for
+      motion to start
+    - `release_threshold`: motion only ends once fewer than this fraction of
+      the pixels change, which stops it from flickering on and off around
+      `threshold`...
+    - `hold`: ...and has kept doing so for this many seconds
+    - `pixel_delta`: how many brightness levels (out of 255) a downsampled
+      pixel must change by to count as changed, above the sensor noise
+    - `keep_alive`: evaluate at least every this many seconds regardless, to
+      notice a person who came into view without tripping the gate
+    - `scale`: how many times smaller the compared images are on each side
+
+    `frames` and `evaluations` count the frames checked and the ones that
+    were let through.
+    """
+
+    def __init__(self, resolution, threshold=0.01, release_threshold=0.005,
+                 hold=2.0, pixel_delta=16, keep_alive=30.0, scale=16):
+        self.threshold = threshold
+        self.release_threshold = release_threshold
+        self.hold = hold
+        self.pixel_delta = pixel_delta
+        self.keep_alive = keep_alive
+        self.small_size = (max(resolution[0] // scale, 1),
+                           max(resolution[1] // scale, 1))
+
+        self.moving = False
+        self.frames = 0
+        self.evaluations = 0
+        self._previous = None
+        self._last_motion = None
+        self._last_evaluation = None
+
+    def changed_fraction(self, small_image):
+        """Return the fraction of the pixels of @small_image, a downsampled
+        brightness image, that changed since the previous call
+        """
+        previous, self._previous = self._previous, small_image
+        if previous is None:
+            return 1.0
+        histogram = ImageChops.difference(small_image, previous).histogram()
+        n_pixels = self.small_size[0] * self.small_size[1]
+        return sum(histogram[self.pixel_delta:]) / n_pixels
+
+    def check(self, brightness, now=None):
+        """Return whether to evaluate the frame with the brightness image
+        @brightness (a Pillow "L" image, of any size) captured at @now (in
+        seconds, from `time.monotonic()`)
+        """
+        if now is None:
+            now = time.monotonic()
+        self.frames += 1
+        changed = self.changed_fraction(
+            brightness.resize(self.small_size, Image.BOX))
+        if changed >= self.threshold or (
+                self.moving and changed >= self.release_threshold):
+            self.moving = True
+            self._last_motion = now
+        elif self.moving and now - self._last_motion > self.hold:
+            self.moving = False
+
+        evaluate = (self.moving or self._last_evaluation is None or
+                    now - self._last_evaluation >= self.keep_alive)
+        if evaluate:
+            self.evaluations += 1
+            self._last_evaluation = now
+        return evaluate
+
+    @property
+    def skipped_fraction(self):
+        """Fraction of the frames checked that were not evaluated"""
+        if self.frames == 0:
+            return 0.0
+        return 1 - self.evaluations / self.frames
+
+    def report(self):
+        return ("Evaluated {} of {} frames; skipped {:.1%} of inferences"
+                .format(self.evaluations, self.frames, self.skipped_fraction))
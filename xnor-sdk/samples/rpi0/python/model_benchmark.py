@@ -6,6 +6,10 @@ Simple utility for benchmarking Xnor models.
 Evaluates a model with a configurable input size and measures resource usage.
 """
 import argparse
+import collections
+import io
+import json
+import math
 import random
 import resource  # For memory statistics
 import time
@@ -70,6 +74,130 @@ def do_inference_loop(model, model_input, max_iterations, max_duration=10):
             total_iterations, min_latency)
 
 
+def record_latencies(model, model_input, max_iterations, max_duration=10):
+    """Like do_inference_loop, but returns the latency of every iteration (in
+    seconds) so that the distribution can be analyzed afterwards.
+    """
+    latencies = []
+    cumulative_time = 0
+    for _ in range(0, max_iterations):
+        t0 = time.time()
+        _ = model.evaluate(model_input)
+        latency = time.time() - t0
+        latencies.append(latency)
+        cumulative_time += latency
+        if cumulative_time > max_duration:
+            break
+    return latencies
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted, non-empty list"""
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_latencies(latencies):
+    """Returns a dict of latency statistics, in milliseconds"""
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    total_ms = sum(latencies_ms)
+    return {
+        "iterations": len(latencies_ms),
+        "fps": len(latencies_ms) * 1000 / total_ms if total_ms > 0 else 0,
+        "mean_ms": total_ms / len(latencies_ms),
+        "min_ms": latencies_ms[0],
+        "p50_ms": percentile(latencies_ms, 0.50),
+        "p90_ms": percentile(latencies_ms, 0.90),
+        "p99_ms": percentile(latencies_ms, 0.99),
+        "max_ms": latencies_ms[-1],
+        # Per-iteration latencies, in the order they were measured
+        "latencies_ms": [latency * 1000 for latency in latencies],
+    }
+
+
+def _random_bytes(size):
+    """Returns @size random bytes"""
+    return random.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def _make_rgb_input(resolution):
+    width, height = resolution
+    return xnornet.Input.rgb_image(resolution,
+                                   _random_bytes(width * height * 3))
+
+
+def _make_jpeg_input(resolution):
+    # Imported lazily, so the rest of the benchmark works without Pillow
+    from PIL import Image
+    width, height = resolution
+    image = Image.frombytes("RGB", resolution,
+                            _random_bytes(width * height * 3))
+    encoded = io.BytesIO()
+    image.save(encoded, format="JPEG")
+    return xnornet.Input.jpeg_image(encoded.getvalue())
+
+
+def _make_yuv422_input(resolution):
+    width, height = resolution
+    return xnornet.Input.yuv422_image(resolution,
+                                      _random_bytes(width * height * 2))
+
+
+def _make_yuv420p_input(resolution):
+    width, height = resolution
+    chroma_size = (width // 2) * (height // 2)
+    return xnornet.Input.yuv420p_image(resolution,
+                                       _random_bytes(width * height),
+                                       _random_bytes(chroma_size),
+                                       _random_bytes(chroma_size))
+
+
+def _make_semiplanar_input(constructor_name):
+
+    def make_input(resolution):
+        width, height = resolution
+        constructor = getattr(xnornet.Input, constructor_name)
+        return constructor(resolution, _random_bytes(width * height),
+                           _random_bytes(2 * (width // 2) * (height // 2)))
+
+    return make_input
+
+
+# Every input type the matrix mode can benchmark, mapped to a function that
+# creates a random input of that type at a given (width, height), and to the
+# name of the xnornet.Input constructor it needs.
+INPUT_TYPES = collections.OrderedDict([
+    ("rgb", (_make_rgb_input, "rgb_image")),
+    ("jpeg", (_make_jpeg_input, "jpeg_image")),
+    ("yuv422", (_make_yuv422_input, "yuv422_image")),
+    ("yuv420p", (_make_yuv420p_input, "yuv420p_image")),
+    ("nv12", (_make_semiplanar_input("yuv420sp_nv12_image"),
+              "yuv420sp_nv12_image")),
+    ("nv21", (_make_semiplanar_input("yuv420sp_nv21_image"),
+              "yuv420sp_nv21_image")),
+])
+
+THREADING_MODELS = collections.OrderedDict([
+    ("multi", "MULTI_THREADED"),
+    ("single", "SINGLE_THREADED"),
+])
+
+# The Pi Zero has a single core, so a multi-threaded model only adds overhead,
+# and large frames take seconds each; benchmark what the samples run by default
+MATRIX_THREADING = ["single"]
+MATRIX_RESOLUTIONS = [(224, 224), (448, 448)]
+
+
+def _parse_resolution(text):
+    """argparse type for resolutions written as WIDTHxHEIGHT"""
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "resolution must look like 448x448, not {!r}".format(text))
+    return width, height
+
+
 def _make_argument_parser():
     parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False)
     parser.add_argument("--input_resolution", action='store', nargs=2, type=int,
@@ -90,6 +218,25 @@ def _make_argument_parser():
         "--single_threaded", default=False, action='store_true',
         help="If specified, run the model in single-threaded mode instead of "
         "multi-threaded mode.")
+    parser.add_argument(
+        "--matrix", default=False, action='store_true',
+        help="Benchmark every combination of --matrix_resolutions, "
+        "--matrix_threading and --matrix_inputs, and report latency "
+        "percentiles for each.")
+    parser.add_argument(
+        "--matrix_resolutions", nargs='+', type=_parse_resolution,
+        default=MATRIX_RESOLUTIONS, metavar="WIDTHxHEIGHT",
+        help="Input resolutions for --matrix (default: 224x224 448x448).")
+    parser.add_argument(
+        "--matrix_threading", nargs='+', choices=list(THREADING_MODELS),
+        default=MATRIX_THREADING,
+        help="Threading models for --matrix (default: single).")
+    parser.add_argument(
+        "--matrix_inputs", nargs='+', choices=list(INPUT_TYPES),
+        default=list(INPUT_TYPES), help="Input types for --matrix.")
+    parser.add_argument(
+        "--json_output", action='store', default=None, metavar="FILE",
+        help="With --matrix, also write the results as JSON to FILE.")
     return parser
 
 
@@ -106,11 +253,84 @@ def _validate_arguments(args):
     return args
 
 
+def run_matrix(args):
+    """Benchmarks every configuration requested on the command line, returning
+    a list of result dicts.
+    """
+    results = []
+    for threading_name in args.matrix_threading:
+        print("Loading {}-threaded model...".format(threading_name))
+        threading_model = getattr(xnornet.Model,
+                                  THREADING_MODELS[threading_name])
+        model = xnornet.Model.load_built_in(threading_model=threading_model)
+
+        for resolution in args.matrix_resolutions:
+            for input_name in args.matrix_inputs:
+                make_input, constructor_name = INPUT_TYPES[input_name]
+                config = {
+                    "model": model.name,
+                    "width": resolution[0],
+                    "height": resolution[1],
+                    "threading": threading_name,
+                    "input": input_name,
+                }
+                label = "{}x{} {} {}".format(resolution[0], resolution[1],
+                                             threading_name, input_name)
+                if not hasattr(xnornet.Input, constructor_name):
+                    print("Skipping {} (xnornet.Input.{} is not "
+                          "available)".format(label, constructor_name))
+                    continue
+                try:
+                    model_input = make_input(resolution)
+                except ImportError:
+                    print("Skipping {} (requires Pillow)".format(label))
+                    continue
+
+                print("Benchmarking {}...".format(label))
+                if args.warm_up_iterations > 0:
+                    record_latencies(model, model_input,
+                                     args.warm_up_iterations)
+                latencies = record_latencies(model, model_input,
+                                             args.max_benchmark_iterations,
+                                             args.max_benchmark_duration)
+                config.update(summarize_latencies(latencies))
+                results.append(config)
+        del model
+    return results
+
+
+def print_matrix_table(results):
+    print("")
+    print("{:>11} {:>9} {:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+        "Resolution", "Threading", "Input", "Iters", "Mean ms", "p50 ms",
+        "p90 ms", "p99 ms", "Max ms", "FPS"))
+    for result in results:
+        print("{:>11} {:>9} {:>8} {:>6} {:9.1f} {:9.1f} {:9.1f} {:9.1f} "
+              "{:9.1f} {:8.2f}".format(
+                  "{}x{}".format(result["width"], result["height"]),
+                  result["threading"], result["input"], result["iterations"],
+                  result["mean_ms"], result["p50_ms"], result["p90_ms"],
+                  result["p99_ms"], result["max_ms"], result["fps"]))
+
+
+def write_matrix_json(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results written to {}".format(filename))
+
+
 def main(args=None):
     parser = _make_argument_parser()
     args = parser.parse_args(args)
     args = _validate_arguments(args)
 
+    if args.matrix:
+        results = run_matrix(args)
+        print_matrix_table(results)
+        if args.json_output is not None:
+            write_matrix_json(results, args.json_output)
+        return
+
     print("Loading model...")
     threading_model = xnornet.Model.MULTI_THREADED
     if args.single_threaded:
@@ -27,15 +27,11 @@ except ImportError:
              "    python3 -m pip install --user xnornet-<...>.whl\n\n"
              "(drop the --user if you are using a virtualenv)")
 
+# Support code that reads camera frames without copying them
+from common_util.frame_reader import FrameReader
 
 # Input resolution
 INPUT_RES = 0
-# Constant frame size
-SINGLE_FRAME_SIZE_RGB = 0
-SINGLE_FRAME_SIZE_YUV = 0
-YUV420P_Y_PLANE_SIZE = 0
-YUV420P_U_PLANE_SIZE = 0
-YUV420P_V_PLANE_SIZE = 0
 
 
 # This is a naive implementation of non-thread safe MovingAverage class
@@ -60,18 +56,8 @@ class MovingAverage():
 
 def _initialize_global_variable(camera_res):
     global INPUT_RES
-    global SINGLE_FRAME_SIZE_RGB
-    global SINGLE_FRAME_SIZE_YUV
-    global YUV420P_Y_PLANE_SIZE
-    global YUV420P_U_PLANE_SIZE
-    global YUV420P_V_PLANE_SIZE
 
     INPUT_RES = camera_res
-    SINGLE_FRAME_SIZE_RGB = INPUT_RES[0] * INPUT_RES[1] * 3
-    SINGLE_FRAME_SIZE_YUV = INPUT_RES[0] * INPUT_RES[1] * 3 // 2
-    YUV420P_Y_PLANE_SIZE = INPUT_RES[0] * INPUT_RES[1]
-    YUV420P_U_PLANE_SIZE = YUV420P_Y_PLANE_SIZE // 4
-    YUV420P_V_PLANE_SIZE = YUV420P_U_PLANE_SIZE
 
 
 def _make_argument_parser():
@@ -91,39 +77,28 @@ def _make_argument_parser():
     return parser
 
 
-def _inference_loop(args, camera, stream, model):
+def _inference_loop(args, camera, reader, model):
 
     # Moving Average for inference FPS
     mv_inf = MovingAverage()
 
     while True:
 
-        t0 = time.time()
-        # Get the frame from the CircularIO buffer.
-        cam_output = stream.getvalue()
+        # Wait for a frame newer than the last one evaluated. Its planes are
+        # views into the reader's buffers, not copies.
+        frame = reader.read(timeout=1)
+        if frame is None:
+            # The camera has not captured a frame yet
+            continue
 
+        t0 = time.time()
         if args.camera_recording_format == 'yuv':
-            # The camera has not written anything to the CircularIO yet
-            # Thus no frame is been captured
-            if len(cam_output) != SINGLE_FRAME_SIZE_YUV:
-                continue
-            # Split YUV plane
-            y_plane = cam_output[0:YUV420P_Y_PLANE_SIZE]
-            u_plane = cam_output[YUV420P_Y_PLANE_SIZE:YUV420P_Y_PLANE_SIZE +
-                                 YUV420P_U_PLANE_SIZE]
-            v_plane = cam_output[YUV420P_Y_PLANE_SIZE +
-                                 YUV420P_U_PLANE_SIZE:SINGLE_FRAME_SIZE_YUV]
             # Passing corresponding YUV plane
+            y_plane, u_plane, v_plane = frame.planes
             model_input = xnornet.Input.yuv420p_image(INPUT_RES, y_plane,
                                                       u_plane, v_plane)
-        elif args.camera_recording_format == 'rgb':
-            # The camera has not written anything to the CircularIO yet
-            # Thus no frame is been captured
-            if len(cam_output) != SINGLE_FRAME_SIZE_RGB:
-                continue
-            model_input = xnornet.Input.rgb_image(INPUT_RES, cam_output)
         else:
-            raise ValueError("Unsupported recording format")
+            model_input = xnornet.Input.rgb_image(INPUT_RES, frame.planes[0])
 
         # Evaluate
         results = model.evaluate(model_input)
@@ -147,23 +122,15 @@ def main(args=None):
         camera.resolution = tuple(args.camera_input_resolution)
         _initialize_global_variable(camera.resolution)
 
-        # Initialize the buffer for picamera to hold the frame
-        # https://picamera.readthedocs.io/en/release-1.13/api_streams.html?highlight=PiCameraCircularIO
-        if args.camera_recording_format == 'yuv':
-            stream = picamera.PiCameraCircularIO(camera,
-                                                 size=SINGLE_FRAME_SIZE_YUV)
-        elif args.camera_recording_format == 'rgb':
-            stream = picamera.PiCameraCircularIO(camera,
-                                                 size=SINGLE_FRAME_SIZE_RGB)
-        else:
-            raise ValueError("Unsupported recording format")
+        # Initialize the buffers for picamera to hold the frames
+        reader = FrameReader(camera.resolution, args.camera_recording_format)
 
         camera.framerate = args.camera_frame_rate
         camera.brightness = args.camera_brightness
-        # Record to the internal CircularIO
+        # Record to the frame reader
         # PiCamera's YUV is YUV420P
         # https://picamera.readthedocs.io/en/release-1.13/recipes2.html#unencoded-image-capture-yuv-format
-        camera.start_recording(stream, format=args.camera_recording_format)
+        camera.start_recording(reader, format=args.camera_recording_format)
 
         # Load model from disk
         model = xnornet.Model.load_built_in()
@@ -177,7 +144,7 @@ def main(args=None):
         print("Model: {}".format(model.name))
         print("  version {!r}".format(model.version))
 
-        _inference_loop(args, camera, stream, model)
+        _inference_loop(args, camera, reader, model)
     except picamera.exc.PiCameraMMALError:
         print("\nPiCamera failed to open, do you have another task using it "
               "in the background? Is your camera connected correctly?\n")
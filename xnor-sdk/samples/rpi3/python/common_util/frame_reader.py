@@ -0,0 +1,156 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Read the latest camera frame without copying it around.
+
+Recording to a `PiCameraCircularIO` and calling `getvalue()` copies the
+whole frame into new bytes every time, and slicing the YUV planes out of those
+copies it again. A FrameReader is given to picamera as the recording's output
+instead:
+
+    reader = FrameReader(camera.resolution, 'yuv')
+    camera.start_recording(reader, format='yuv')
+    while running:
+        frame = reader.read()
+        y_plane, u_plane, v_plane = frame.planes
+        model_input = xnornet.Input.yuv420p_image(camera.resolution,
+                                                  y_plane, u_plane, v_plane)
+
+The camera writes each frame into one of three buffers allocated up front:
+one being written, one holding the latest complete frame, and one being read.
+The camera never waits for the reader, which always gets the newest frame.
+
+picamera pads the frames it records to 32 x 16 pixel blocks. Padding rows at
+the bottom of a plane are just left out of its view; padding at the end of
+each row can't be, so those frames are repacked into another reusable buffer
+first.
+https://picamera.readthedocs.io/en/release-1.13/recipes2.html#unencoded-image-capture-yuv-format
+"""
+
+import collections
+import threading
+
+Frame = collections.namedtuple("Frame", ["index", "data", "planes"])
+Frame.__doc__ = """\
+A frame read from the camera. Its memoryviews stay valid until the next call
+to `FrameReader.read`, which reuses the buffers behind them.
+- `index`: how many frames the camera had written before this one
+- `data`: the frame as recorded, padding included
+- `planes`: the Y, U and V planes of a 'yuv' frame, or the pixels of an
+  'rgb' one, without padding
+"""
+
+FORMATS = ('yuv', 'rgb')
+
+
+def padded_resolution(resolution):
+    """Return @resolution = (width, height) with the width padded to a
+    multiple of 32 and the height to a multiple of 16, like picamera pads its
+    buffers.
+    https://picamera.readthedocs.io/en/release-1.13/recipes2.html#unencoded-image-capture-yuv-format
+    """
+    return ((resolution[0] + 31) // 32 * 32, (resolution[1] + 15) // 16 * 16)
+
+
+class FrameReader:
+    """A picamera recording output keeping the latest complete frame of
+    `resolution` = (width, height), recorded in `recording_format` (one of
+    FORMATS; 'yuv' is YUV420P).
+    """
+
+    def __init__(self, resolution, recording_format='yuv'):
+        if recording_format not in FORMATS:
+            raise ValueError("recording_format must be one of {}".format(
+                ", ".join(FORMATS)))
+        width, height = resolution[0:2]
+        padded_width, padded_height = padded_resolution((width, height))
+        # (width in bytes, rows, row stride in bytes, plane size in bytes)
+        # of each plane
+        if recording_format == 'yuv':
+            self._layout = [
+                (width, height, padded_width, padded_width * padded_height)]
+            self._layout += [((width + 1) // 2, (height + 1) // 2,
+                              padded_width // 2,
+                              padded_width * padded_height // 4)] * 2
+        else:
+            self._layout = [(width * 3, height, padded_width * 3,
+                             padded_width * padded_height * 3)]
+        self.frame_size = sum(plane[3] for plane in self._layout)
+        self._repack = any(row_size != stride
+                           for row_size, _, stride, _ in self._layout)
+
+        self._back = bytearray(self.frame_size)
+        self._ready = bytearray(self.frame_size)
+        self._front = bytearray(self.frame_size)
+        if self._repack:
+            self._repacked = bytearray(sum(
+                row_size * rows for row_size, rows, _, _ in self._layout))
+        self._position = 0
+        # Frames written so far, and the index of the one in _ready
+        self._frames_written = 0
+        self._ready_index = None
+        self._last_read_index = None
+        self._lock = threading.Condition()
+
+    def write(self, data):
+        """Called by picamera with the recording's data, usually one whole
+        frame at a time
+        """
+        size = len(data)
+        if self._position + size > self.frame_size:
+            # Not the rest of the frame that was started; start over
+            self._position = 0
+            if size > self.frame_size:
+                return size
+        self._back[self._position:self._position + size] = data
+        self._position += size
+        if self._position == self.frame_size:
+            self._position = 0
+            with self._lock:
+                self._back, self._ready = self._ready, self._back
+                self._ready_index = self._frames_written
+                self._frames_written += 1
+                self._lock.notify_all()
+        return size
+
+    def flush(self):
+        pass
+
+    def _planes(self, data):
+        """Return views of the planes of @data, a frame as recorded"""
+        if self._repack:
+            output = memoryview(self._repacked)
+        planes = []
+        input_offset = 0
+        output_offset = 0
+        for row_size, rows, stride, plane_size in self._layout:
+            if row_size == stride:
+                # Any padding rows are at the end of the plane, outside the
+                # view
+                planes.append(
+                    data[input_offset:input_offset + row_size * rows])
+            else:
+                for row in range(rows):
+                    start = input_offset + row * stride
+                    output[output_offset + row * row_size:
+                           output_offset + (row + 1) * row_size] = \
+                        data[start:start + row_size]
+                planes.append(output[output_offset:
+                                     output_offset + row_size * rows])
+                output_offset += row_size * rows
+            input_offset += plane_size
+        return tuple(planes)
+
+    def read(self, timeout=None):
+        """Return the latest complete Frame, waiting for one newer than the
+        last one read. Returns None if none came within @timeout seconds.
+        """
+        with self._lock:
+            if not self._lock.wait_for(
+                    lambda: (self._ready_index is not None and
+                             self._ready_index != self._last_read_index),
+                    timeout):
+                return None
+            self._ready, self._front = self._front, self._ready
+            self._last_read_index = self._ready_index
+        data = memoryview(self._front)
+        return Frame(self._last_read_index, data, self._planes(data))
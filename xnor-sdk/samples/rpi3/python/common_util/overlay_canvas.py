@@ -0,0 +1,143 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Draw boxes and labels into a reusable RGBA buffer for a picamera overlay.
+
+picamera shows overlays from packed RGBA buffers the size of the preview.
+Building a fresh one every frame means allocating and zeroing the whole
+frame, and drawing into it pixel by pixel from Python is slow. An
+OverlayCanvas instead keeps one buffer for as long as the camera runs:
+
+    canvas = OverlayCanvas(camera.resolution)
+    while running:
+        canvas.clear()
+        canvas.draw_box(left, top, right, bottom, thickness, color)
+        canvas.draw_text(x, y, "person", color, font)
+        camera.add_overlay(canvas.buffer, layer=3)
+
+Everything is drawn a row at a time by slice assignment, which copies a whole
+run of pixels in C, and clear() only erases the rectangles drawn since the
+last clear(), not the whole frame. Text is rendered with Pillow once per
+distinct string and kept in a small cache.
+"""
+
+import collections
+
+from PIL import Image
+from PIL import ImageDraw
+
+# How many rendered strings to keep; the labels of a detection model and the
+# changing FPS readout fit comfortably
+_TEXT_CACHE_SIZE = 64
+
+
+def _text_size(font, text):
+    """Return the (width, height) @text takes up when drawn at (0, 0)"""
+    if hasattr(font, "getbbox"):
+        _, _, right, bottom = font.getbbox(text)
+        return right, bottom
+    # Pillow before 8.0
+    return font.getsize(text)
+
+
+class OverlayCanvas:
+    """A transparent RGBA image of `size` = (width, height) in `buffer`, a
+    bytearray that can be passed to picamera's `add_overlay` or an overlay
+    renderer's `update`. picamera copies the buffer, so it can be redrawn as
+    soon as that returns.
+    """
+
+    def __init__(self, size):
+        self.size = tuple(size)
+        width, height = self.size
+        self._row_size = width * 4
+        self.buffer = bytearray(height * self._row_size)
+        # Rectangles drawn since the last clear(), as (left, top, right,
+        # bottom) in pixels
+        self._drawn = []
+        self._text_cache = collections.OrderedDict()
+
+    def _clip(self, left, top, right, bottom):
+        width, height = self.size
+        return (max(left, 0), max(top, 0), min(right, width),
+                min(bottom, height))
+
+    def _write_rows(self, left, top, right, bottom, row_data):
+        """Copy @row_data, or the next item of it if it's a list, into every
+        row of a clipped rectangle
+        """
+        start = top * self._row_size + left * 4
+        end = start + (right - left) * 4
+        for row in range(top, bottom):
+            self.buffer[start:end] = (row_data[row - top]
+                                      if isinstance(row_data, list)
+                                      else row_data)
+            start += self._row_size
+            end += self._row_size
+
+    def fill_rect(self, left, top, right, bottom, color):
+        """Fill the pixels from (@left, @top) up to but not including
+        (@right, @bottom) with the RGBA @color, a 4-tuple of 0-255 values
+        """
+        left, top, right, bottom = self._clip(left, top, right, bottom)
+        if left >= right or top >= bottom:
+            return
+        self._write_rows(left, top, right, bottom,
+                         bytes(color) * (right - left))
+        self._drawn.append((left, top, right, bottom))
+
+    def draw_box(self, left, top, right, bottom, thickness, color):
+        """Draw the outline of a rectangle, @thickness pixels wide on the
+        inside of its edges, in the RGBA @color
+        """
+        self.fill_rect(left, top, right, min(top + thickness, bottom), color)
+        self.fill_rect(left, max(bottom - thickness, top), right, bottom,
+                       color)
+        self.fill_rect(left, top, min(left + thickness, right), bottom, color)
+        self.fill_rect(max(right - thickness, left), top, right, bottom,
+                       color)
+
+    def _render_text(self, text, color, font):
+        """Return the rows of @text rendered in @color on transparent pixels,
+        as a list of bytes, and its size
+        """
+        key = (text, tuple(color), font)
+        rendered = self._text_cache.get(key)
+        if rendered is not None:
+            self._text_cache.move_to_end(key)
+            return rendered
+
+        width, height = _text_size(font, text)
+        image = Image.new("RGBA", (max(width, 1), max(height, 1)))
+        ImageDraw.Draw(image).text((0, 0), text, fill=tuple(color),
+                                   font=font)
+        data = image.tobytes()
+        row_size = image.size[0] * 4
+        rendered = ([data[i:i + row_size]
+                     for i in range(0, len(data), row_size)], image.size)
+        self._text_cache[key] = rendered
+        if len(self._text_cache) > _TEXT_CACHE_SIZE:
+            self._text_cache.popitem(last=False)
+        return rendered
+
+    def draw_text(self, x, y, text, color, font):
+        """Draw @text with its top left corner at (@x, @y), in the RGBA
+        @color and the Pillow @font. The text's background is transparent,
+        and replaces whatever was drawn under it.
+        """
+        rows, (width, height) = self._render_text(text, color, font)
+        left, top, right, bottom = self._clip(x, y, x + width, y + height)
+        if left >= right or top >= bottom:
+            return
+        # Crop the rendered rows to the part inside the canvas
+        start = (left - x) * 4
+        end = start + (right - left) * 4
+        self._write_rows(left, top, right, bottom,
+                         [row[start:end] for row in rows[top - y:bottom - y]])
+        self._drawn.append((left, top, right, bottom))
+
+    def clear(self):
+        """Erase everything drawn since the last clear()"""
+        for left, top, right, bottom in self._drawn:
+            self._write_rows(left, top, right, bottom,
+                             bytes((right - left) * 4))
+        self._drawn = []
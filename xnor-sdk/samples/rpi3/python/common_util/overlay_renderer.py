@@ -0,0 +1,62 @@
+# Copyright (c) 2019 Xnor.ai, Inc.
+
+"""Show an OverlayCanvas over the camera preview with one picamera renderer.
+
+Adding a new overlay for every frame and removing the old one tears down and
+sets up an MMAL renderer each time, and the old one has to stay up until the
+new one is shown, or the preview flickers. A renderer can instead be updated
+in place, but picamera only accepts buffers padded to its 32 x 16 pixel
+blocks for that, and refuses unpadded ones with errors about the buffer size.
+An OverlayRenderer allocates a padded canvas up front, adds one overlay the
+first time it's shown and updates that overlay after that:
+
+    with OverlayRenderer(camera) as renderer:
+        while running:
+            renderer.canvas.clear()
+            renderer.canvas.draw_box(...)
+            renderer.show()
+
+Only the camera's resolution, at the top left of the canvas, is shown; the
+padding is cropped off.
+"""
+
+from common_util.frame_reader import padded_resolution
+from common_util.overlay_canvas import OverlayCanvas
+
+
+class OverlayRenderer:
+    """Shows `canvas`, an OverlayCanvas padded to picamera's block size, in a
+    single overlay on `layer` of `camera`'s preview. The preview must be
+    started to see it. Layer 3 or above is shown over the preview, which is
+    on layer 2.
+    """
+
+    def __init__(self, camera, layer=3):
+        self.camera = camera
+        self.layer = layer
+        self.size = tuple(camera.resolution)
+        self.canvas = OverlayCanvas(padded_resolution(self.size))
+        self._renderer = None
+
+    def show(self):
+        """Show what is drawn on the canvas now. picamera copies it, so the
+        canvas can be redrawn as soon as this returns.
+        """
+        if self._renderer is None:
+            self._renderer = self.camera.add_overlay(
+                self.canvas.buffer, size=self.size, format='rgba',
+                layer=self.layer)
+        else:
+            self._renderer.update(self.canvas.buffer)
+
+    def close(self):
+        """Remove the overlay from the preview"""
+        if self._renderer is not None:
+            self.camera.remove_overlay(self._renderer)
+            self._renderer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -6,13 +6,16 @@ The example needs to work with a person classification/detection model.
 import argparse
 import os
 import sys
+import time
 
 if sys.version_info[0] < 3:
     sys.exit("This sample requires Python 3. Please install Python 3!")
 
 try:
     from PIL import Image
+    from PIL import ImageColor
     from PIL import ImageDraw
+    from PIL import ImageFont
 except ImportError:
     sys.exit("Requires PIL module. "
              "Please install it with pip:\n\n"
@@ -35,6 +38,16 @@ except ImportError:
              "    python3 -m pip install --user xnornet-<...>.whl\n\n"
              "(drop the --user if you are using a virtualenv)")
 
+# Support code that records the camera into reusable buffers, skips frames
+# where nothing moves, and shows an overlay over the camera preview
+from common_util.frame_reader import FrameReader
+from common_util.motion_gate import MotionGate
+from common_util.overlay_renderer import OverlayRenderer
+
+# Width of the boxes drawn on the preview, and color of its text, in RGBA
+PREVIEW_BOX_THICKNESS = 3
+PREVIEW_TEXT_COLOR = (255, 255, 255, 255)
+
 
 def _draw_pillow_rectangle_with_width(pillow_draw, xy, color=None, width=1):
     """ImageDraw does not support drawing rectangle with width, this is a
@@ -86,14 +99,87 @@ def _make_argument_parser():
         "--detection_confidence", action='store', type=int, default=5,
         help="If anything is detected consecutively for detection_confidence "
         "times, then we consider the object to be detected.")
+    parser.add_argument(
+        "--camera_recording_format", action='store', default='rgb',
+        choices=('yuv', 'rgb'),
+        help="Format to record in (default: rgb). With 'yuv', the motion gate "
+        "reads the brightness (Y) plane directly instead of converting each "
+        "frame, which is cheaper.")
+    parser.add_argument(
+        "--no_motion_gate", action='store_true',
+        help="Evaluate the model on every frame, even when nothing moves.")
+    parser.add_argument(
+        "--motion_threshold", action='store', type=float, default=0.01,
+        help="Fraction of the (downsampled) image that must change between "
+        "frames for the model to start evaluating.")
+    parser.add_argument(
+        "--motion_release_threshold", action='store', type=float,
+        default=0.005,
+        help="Keep evaluating until less than this fraction of the image "
+        "changes between frames for --motion_hold seconds. Lower than "
+        "--motion_threshold, so that borderline motion doesn't flicker.")
+    parser.add_argument(
+        "--motion_hold", action='store', type=float, default=2.0,
+        help="Seconds to keep evaluating after the motion stops.")
+    parser.add_argument(
+        "--motion_pixel_delta", action='store', type=int, default=16,
+        help="How much (0-255) the brightness of a pixel must change by to "
+        "count as motion rather than sensor noise.")
+    parser.add_argument(
+        "--keep_alive", action='store', type=float, default=30.0,
+        help="Evaluate the model at least this often (in seconds), even "
+        "without motion.")
+    parser.add_argument(
+        "--report_interval", action='store', type=float, default=60.0,
+        help="How often (in seconds) to report the fraction of inferences "
+        "the motion gate skipped.")
+    parser.add_argument(
+        "--preview", action='store_true',
+        help="Show the camera preview, with the boxes of the last evaluation "
+        "and the detection progress over it. Needs a display or VNC; see "
+        "picamera_live_overlay_object_detector.py.")
     return parser
 
 
-def _convert_to_pillow_img(cam_buffer, resolution):
-    """Convert the @cam_buffer, which is a python camera buffer, to pillow image
+def _update_preview(renderer, results, status, color, font):
+    """Draw the bounding boxes in @results in the RGBA @color, and the
+    @status text, on the preview overlay of @renderer
+    """
+    canvas = renderer.canvas
+    canvas.clear()
+    width, height = renderer.size
+    for result in results:
+        if type(result) is not xnornet.BoundingBox:
+            continue
+        left = int(result.rectangle.x * width)
+        top = int(result.rectangle.y * height)
+        right = left + int(result.rectangle.width * width)
+        bottom = top + int(result.rectangle.height * height)
+        canvas.draw_box(left, top, right, bottom, PREVIEW_BOX_THICKNESS,
+                        color)
+        canvas.draw_text(left + PREVIEW_BOX_THICKNESS + 2,
+                         top + PREVIEW_BOX_THICKNESS + 2,
+                         result.class_label.label, PREVIEW_TEXT_COLOR, font)
+    canvas.draw_text(0, 0, status, PREVIEW_TEXT_COLOR, font)
+    renderer.show()
+
+
+def _convert_to_pillow_img(planes, resolution, recording_format):
+    """Convert the @planes of a frame from a FrameReader to pillow image
     """
     print("Converting buffer to image...")
-    image = Image.frombytes("RGB", resolution[0:2], cam_buffer)
+    if recording_format == 'yuv':
+        y_plane, u_plane, v_plane = planes
+        chroma_resolution = ((resolution[0] + 1) // 2,
+                             (resolution[1] + 1) // 2)
+        image = Image.merge("YCbCr", (
+            Image.frombytes("L", resolution[0:2], bytes(y_plane)),
+            Image.frombytes("L", chroma_resolution, bytes(u_plane)).resize(
+                resolution[0:2]),
+            Image.frombytes("L", chroma_resolution, bytes(v_plane)).resize(
+                resolution[0:2]))).convert("RGB")
+    else:
+        image = Image.frombytes("RGB", resolution[0:2], bytes(planes[0]))
     print("Finished conversion.")
     return image
 
@@ -130,7 +216,6 @@ def main(args=None):
 
     # Reconstruct the input resolution to include color channel
     input_res = (args.input_resolution[0], args.input_resolution[1], 3)
-    SINGLE_FRAME_SIZE_RGB = input_res[0] * input_res[1] * input_res[2]
 
     # Initialize the camera, set the resolution and framerate
     try:
@@ -141,9 +226,8 @@ def main(args=None):
         sys.exit("Connect your camera and kill other tasks using it to run "
                  "this sample.")
 
-    # Initialize the buffer for picamera to hold the frame
-    # https://picamera.readthedocs.io/en/release-1.13/api_streams.html?highlight=PiCameraCircularIO
-    stream = picamera.PiCameraCircularIO(camera, size=SINGLE_FRAME_SIZE_RGB)
+    # Initialize the buffers for picamera to hold the frames
+    reader = FrameReader(input_res[0:2], args.camera_recording_format)
     # All essential camera settings
     camera.resolution = input_res[0:2]
     camera.framerate = args.camera_frame_rate
@@ -151,8 +235,19 @@ def main(args=None):
     camera.shutter_speed = args.camera_shutter_speed
     camera.video_stabilization = args.camera_video_stablization
 
-    # Record to the internal CircularIO
-    camera.start_recording(stream, format="rgb")
+    # Record to the frame reader
+    # PiCamera's YUV is YUV420P
+    camera.start_recording(reader, format=args.camera_recording_format)
+
+    renderer = None
+    if args.preview:
+        camera.start_preview()
+        # A single overlay, updated in place after every evaluation
+        renderer = OverlayRenderer(camera, layer=3)
+        preview_color = ImageColor.getrgb(args.bounding_box_color)[0:3] + (
+            255,)
+        preview_font = ImageFont.load_default()
+
     # Load model
     model = xnornet.Model.load_built_in()
 
@@ -169,16 +264,51 @@ def main(args=None):
     detected_last_frame = False
     bounding_boxes = []
 
+    motion_gate = None
+    if not args.no_motion_gate:
+        motion_gate = MotionGate(
+            input_res[0:2], threshold=args.motion_threshold,
+            release_threshold=args.motion_release_threshold,
+            hold=args.motion_hold, pixel_delta=args.motion_pixel_delta,
+            keep_alive=args.keep_alive)
+    last_report = time.monotonic()
+
     while person_detected < args.detection_confidence:
-        detected_this_frame = False
-        # Get the frame from the CircularIO buffer.
-        cam_buffer = stream.getvalue()
-        # The camera has not written anything to the CircularIO yet
-        # Thus no frame is been captured
-        if len(cam_buffer) != SINGLE_FRAME_SIZE_RGB:
+        if (motion_gate is not None and
+                time.monotonic() - last_report >= args.report_interval):
+            print(motion_gate.report())
+            last_report = time.monotonic()
+
+        # Wait for a frame newer than the last one checked, rather than
+        # checking the same one over and over. Its planes are views into the
+        # reader's buffers, not copies.
+        frame = reader.read(timeout=1)
+        if frame is None:
+            # The camera has not captured a frame yet
             continue
-        # Passing corresponding RGB
-        model_input = xnornet.Input.rgb_image(input_res[0:2], cam_buffer)
+
+        detected_this_frame = False
+        if motion_gate is not None:
+            if args.camera_recording_format == 'yuv':
+                # The Y plane is the brightness, for free
+                brightness = Image.frombuffer("L", input_res[0:2],
+                                              frame.planes[0], "raw", "L", 0,
+                                              1)
+            else:
+                brightness = Image.frombuffer(
+                    "RGB", input_res[0:2], frame.planes[0], "raw", "RGB", 0,
+                    1).convert("L")
+            if not motion_gate.check(brightness):
+                continue
+
+        # Passing corresponding YUV planes or RGB
+        if args.camera_recording_format == 'yuv':
+            y_plane, u_plane, v_plane = frame.planes
+            model_input = xnornet.Input.yuv420p_image(input_res[0:2], y_plane,
+                                                      u_plane, v_plane)
+        else:
+            model_input = xnornet.Input.rgb_image(input_res[0:2],
+                                                  frame.planes[0])
         # Evaluate
         results = model.evaluate(model_input)
 
@@ -216,13 +346,20 @@ def main(args=None):
                     person_detected >= args.detection_confidence:
                 bounding_boxes.append(result.rectangle)
 
+        if renderer is not None:
+            _update_preview(
+                renderer, results, "Detecting... {}/{}".format(
+                    person_detected, args.detection_confidence),
+                preview_color, preview_font)
+
         if person_detected >= args.detection_confidence:
             # Classification model
             if len(bounding_boxes) == 0:
                 print("Person detected!")
             else:  # Detection model
                 print("{} person detected!".format(len(bounding_boxes)))
-            image = _convert_to_pillow_img(cam_buffer, input_res)
+            image = _convert_to_pillow_img(frame.planes, input_res,
+                                           args.camera_recording_format)
             if not (args.no_draw_bounding_box) and len(bounding_boxes) != 0:
                 image = _draw_bounding_box(image, bounding_boxes, input_res,
                                            args.bounding_box_color)
@@ -230,7 +367,12 @@ def main(args=None):
         else:
             print("Detecting...")
 
+    if motion_gate is not None:
+        print(motion_gate.report())
     print("Cleaning up...")
+    if renderer is not None:
+        renderer.close()
+        camera.stop_preview()
     camera.stop_recording()
     camera.close()
 
@@ -15,8 +15,6 @@ if sys.version_info[0] < 3:
     sys.exit("This sample requires Python 3. Please install Python 3!")
 
 try:
-    from PIL import Image
-    from PIL import ImageDraw
     from PIL import ImageFont
 except ImportError:
     sys.exit("Requires PIL module. "
@@ -40,6 +38,11 @@ except ImportError:
              "    python3 -m pip install --user xnornet-<...>.whl\n\n"
              "(drop the --user if you are using a virtualenv)")
 
+# Support code that reads camera frames without copying them
+from common_util.frame_reader import FrameReader
+# Support code that shows an overlay drawn into a reusable buffer
+from common_util.overlay_renderer import OverlayRenderer
+
 # The following command will give you the arial font on rpi3
 # sudo apt install ttf-mscorefonts-installer
 MS_ARIAL_FONT_LOCATION = "/usr/share/fonts/truetype/msttcorefonts/arial.ttf"
@@ -53,44 +56,21 @@ BB_PAD = 0
 OT_OFFSET = 0
 # Font to be used in overlay
 OVERLAY_FONT = 0
-# Constant frame size
-SINGLE_FRAME_SIZE_RGB = 0
-SINGLE_FRAME_SIZE_YUV = 0
-YUV420P_Y_PLANE_SIZE = 0
-YUV420P_U_PLANE_SIZE = 0
-YUV420P_V_PLANE_SIZE = 0
-
-
-def _set_bytearray_color(array, shape, rows, cols, color):
-    height, width, depth = shape
-    color_bytes = bytearray.fromhex(color)
-    for row in range(rows[0], rows[1]):
-        for col in range(cols[0], cols[1]):
-            array[row * width * depth + col * depth:
-                  row * width * depth + col * depth + 4] = color_bytes
+# Bounding box color in RGBA, half transparent
+BB_COLOR = (0xff, 0x88, 0x11, 0x80)
+# Label and FPS text colors in RGBA
+LABEL_COLOR = (0, 255, 255, 255)
+FPS_COLOR = (255, 0, 255, 255)
 
 
 def _initialize_global_variable(camera_res):
 
     global INPUT_RES
-    global SHAPE
-    global SINGLE_FRAME_SIZE_RGB
-    global SINGLE_FRAME_SIZE_YUV
-    global YUV420P_Y_PLANE_SIZE
-    global YUV420P_U_PLANE_SIZE
-    global YUV420P_V_PLANE_SIZE
     global BB_PAD
     global OT_OFFSET
     global OVERLAY_FONT
 
     INPUT_RES = camera_res
-    SHAPE = (INPUT_RES[1], INPUT_RES[0], 4)
-
-    SINGLE_FRAME_SIZE_RGB = INPUT_RES[0] * INPUT_RES[1] * 3
-    SINGLE_FRAME_SIZE_YUV = INPUT_RES[0] * INPUT_RES[1] * 3 // 2
-    YUV420P_Y_PLANE_SIZE = INPUT_RES[0] * INPUT_RES[1]
-    YUV420P_U_PLANE_SIZE = YUV420P_Y_PLANE_SIZE // 4
-    YUV420P_V_PLANE_SIZE = YUV420P_U_PLANE_SIZE
 
     # By a ratio: for 512x512 resolution, we are using 3 as BoundingBox Padding
     BB_PAD = round(3.0 / 512 * max(INPUT_RES[0], INPUT_RES[1]))
@@ -124,14 +104,12 @@ class MovingAverage():
         self.num_updates += 1
 
 
-def _add_overlay(camera, overlay_obj, results, show_fps, fps):
-    # Old overlays we want to remove
-    start_overlay_obj_length = len(overlay_obj)
-
-    # Overlay buffer in RGBA
-    overlay_buff = bytearray(SHAPE[0] * SHAPE[1] * SHAPE[2])
+def _add_overlay(renderer, results, show_fps, fps):
+    canvas = renderer.canvas
+    # Erase the boxes and text of the last frame from the RGBA overlay
+    # buffer, which is reused from frame to frame
+    canvas.clear()
 
-    location_contents_tuple = []
     for result in results:
         if type(result) is xnornet.BoundingBox:
             # Generate coordinates
@@ -140,91 +118,47 @@ def _add_overlay(camera, overlay_obj, results, show_fps, fps):
             left = int(result.rectangle.x * INPUT_RES[0])
             right = int(result.rectangle.width * INPUT_RES[0]) + left
 
-            # Draw the bounding box by setting the alpha value to 128
-            _set_bytearray_color(overlay_buff, SHAPE,
-                                 (bottom, min(bottom + BB_PAD, SHAPE[0])),
-                                 (left, right), 'ff881180')
-            _set_bytearray_color(overlay_buff, SHAPE,
-                                 (max(top - BB_PAD, 0), top), (left, right),
-                                 'ff881180')
-            _set_bytearray_color(overlay_buff, SHAPE, (bottom, top),
-                                 (left, min(left + BB_PAD, SHAPE[1])),
-                                 'ff881180')
-            _set_bytearray_color(overlay_buff, SHAPE, (bottom, top),
-                                 (max(right - BB_PAD, 0), right), 'ff881180')
-
-            # Save the location of the content and the content
-            content = "{}".format(result.class_label.label)
-            location_contents_tuple.append(((left + BB_PAD + 2,
-                                             bottom + BB_PAD + 2), content))
-
-    # Convert to a Pillow Image, which will create another buffer
-    pillow_img = Image.frombytes(mode="RGBA", size=INPUT_RES,
-                                 data=bytes(overlay_buff))
-
-    # Add overlayed text
-    d = ImageDraw.Draw(pillow_img)
-
-    for (location_of_content, content) in location_contents_tuple:
-        # Draw the text with @pillow_font defined above
-        d.text(location_of_content, content, fill=(0, 255, 255, 255),
-               font=OVERLAY_FONT)
+            # Draw the bounding box with the alpha value set to 128
+            canvas.draw_box(left, bottom, right, top, BB_PAD, BB_COLOR)
+            canvas.draw_text(left + BB_PAD + 2, bottom + BB_PAD + 2,
+                             "{}".format(result.class_label.label),
+                             LABEL_COLOR, OVERLAY_FONT)
 
     if show_fps:
-        d.text((0, 0), "FPS: {}".format(str(fps)[0:4]), fill=(255, 0, 255, 255),
-               font=OVERLAY_FONT)
+        canvas.draw_text(0, 0, "FPS: {}".format(str(fps)[0:4]), FPS_COLOR,
+                         OVERLAY_FONT)
 
-    # Store the overlay render, need for removing the overlay
-    overlay_obj.append(
-        # Add the overlay to the 4th layer, otherwise it will not be
-        # visible
-        camera.add_overlay(pillow_img.tobytes(), layer=3))
+    # Update the overlay in place; it's only added on the first frame
+    renderer.show()
 
-    # Old overlay is removed after new overlays are added to avoid flickering
-    # NOTE: The overlay pipeline can be refactored using picamera's
-    # PiOverlayRenderer `update` command, but too much error will be thrown out
-    # about not enough buffer. Using `update` increase the overall FPS
-    for i in range(0, start_overlay_obj_length):
-        camera.remove_overlay(overlay_obj.pop(0))
 
-
-def _inference_loop(args, camera, stream, model):
+def _inference_loop(args, camera, reader, model):
 
     # Moving Average for inference FPS
     mv_inf = MovingAverage()
     # Moving Average for overlay FPS
     mv_all = MovingAverage()
 
-    # Overlay renderer to keep track of
-    overlay_obj = []
+    # Overlay shown on top of the preview, on the 4th layer, otherwise it
+    # will not be visible
+    renderer = OverlayRenderer(camera, layer=3)
     while True:
 
-        t0 = time.time()
-        # Get the frame from the CircularIO buffer.
-        cam_output = stream.getvalue()
+        # Wait for a frame newer than the last one evaluated. Its planes are
+        # views into the reader's buffers, not copies.
+        frame = reader.read(timeout=1)
+        if frame is None:
+            # The camera has not captured a frame yet
+            continue
 
+        t0 = time.time()
         if args.camera_recording_format == 'yuv':
-            # The camera has not written anything to the CircularIO yet
-            # Thus no frame is been captured
-            if len(cam_output) != SINGLE_FRAME_SIZE_YUV:
-                continue
-            # Split YUV plane
-            y_plane = cam_output[0:YUV420P_Y_PLANE_SIZE]
-            u_plane = cam_output[YUV420P_Y_PLANE_SIZE:YUV420P_Y_PLANE_SIZE +
-                                 YUV420P_U_PLANE_SIZE]
-            v_plane = cam_output[YUV420P_Y_PLANE_SIZE +
-                                 YUV420P_U_PLANE_SIZE:SINGLE_FRAME_SIZE_YUV]
             # Passing corresponding YUV plane
+            y_plane, u_plane, v_plane = frame.planes
             model_input = xnornet.Input.yuv420p_image(INPUT_RES, y_plane,
                                                       u_plane, v_plane)
-        elif args.camera_recording_format == 'rgb':
-            # The camera has not written anything to the CircularIO yet
-            # Thus no frame is been captured
-            if len(cam_output) != SINGLE_FRAME_SIZE_RGB:
-                continue
-            model_input = xnornet.Input.rgb_image(INPUT_RES, cam_output)
         else:
-            raise ValueError("Unsupported recording format")
+            model_input = xnornet.Input.rgb_image(INPUT_RES, frame.planes[0])
 
         # Evaluate
         results = model.evaluate(model_input)
@@ -238,7 +172,7 @@ def _inference_loop(args, camera, stream, model):
 
         if args.overlay_mode:
             _add_overlay(
-                camera, overlay_obj, results, args.overlay_show_fps,
+                renderer, results, args.overlay_show_fps,
                 0 if mv_all.get_average() == 0 else 1 / mv_all.get_average())
 
         diff_all = time.time() - t0
@@ -290,23 +224,15 @@ def main(args=None):
         camera.resolution = tuple(args.camera_input_resolution)
         _initialize_global_variable(camera.resolution)
 
-        # Initialize the buffer for picamera to hold the frame
-        # https://picamera.readthedocs.io/en/release-1.13/api_streams.html?highlight=PiCameraCircularIO
-        if args.camera_recording_format == 'yuv':
-            stream = picamera.PiCameraCircularIO(camera,
-                                                 size=SINGLE_FRAME_SIZE_YUV)
-        elif args.camera_recording_format == 'rgb':
-            stream = picamera.PiCameraCircularIO(camera,
-                                                 size=SINGLE_FRAME_SIZE_RGB)
-        else:
-            raise ValueError("Unsupported recording format")
+        # Initialize the buffers for picamera to hold the frames
+        reader = FrameReader(camera.resolution, args.camera_recording_format)
 
         camera.framerate = args.camera_frame_rate
         camera.brightness = args.camera_brightness
-        # Record to the internal CircularIO
+        # Record to the frame reader
         # PiCamera's YUV is YUV420P
         # https://picamera.readthedocs.io/en/release-1.13/recipes2.html#unencoded-image-capture-yuv-format
-        camera.start_recording(stream, format=args.camera_recording_format)
+        camera.start_recording(reader, format=args.camera_recording_format)
 
         if args.overlay_mode:
             # Start the preview that will show on desktop environment
@@ -324,7 +250,7 @@ def main(args=None):
         print("Model: {}".format(model.name))
         print("  version {!r}".format(model.version))
 
-        _inference_loop(args, camera, stream, model)
+        _inference_loop(args, camera, reader, model)
     except picamera.exc.PiCameraMMALError:
         print("\nPiCamera failed to open, do you have another task using it "
               "in the background? Is your camera connected correctly?\n")